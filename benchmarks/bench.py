@@ -0,0 +1,189 @@
+"""End-to-end benchmark of main.main against the local stand-in API.
+
+    python -m benchmarks.bench                      # compare against benchmarks/baseline.json
+    python -m benchmarks.bench --update-baseline    # accept the current numbers
+    python -m benchmarks.bench --cassette .cache/cassette.json --runs 10
+
+Each run happens in a fresh subprocess on a scratch copy of data/, so peak
+memory and caches are per run. The suite exits non-zero when the median total,
+any source or any pipeline phase gets slower than the baseline by more than the
+tolerance, or when peak memory or the request count grows."""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_FILE = ROOT / "benchmarks" / "baseline.json"
+
+# Regressions smaller than this are noise on a shared runner (seconds)
+ABSOLUTE_SLACK = 0.05
+
+
+# ------------------------
+# One run (child process)
+# ------------------------
+
+async def _run_once(cassette: str | None, latency: float) -> Dict[str, Any]:
+    from benchmarks.mock_api import MockAPI, load_snapshot
+    from main import main
+    from scripts import tracing
+
+    api = MockAPI(load_snapshot(Path("data/stats.json")), Path(cassette) if cassette else None, latency)
+    await api.start()
+
+    start = time.perf_counter()
+    try:
+        results = await main(cassette=api)
+    finally:
+        total = time.perf_counter() - start
+        await api.stop()
+
+    return {
+        "total": total,
+        "stages": {name: {"elapsed": r.elapsed, "status": r.status} for name, r in results.items()},
+        "requests": dict(api.requests),
+        # Pipeline stages from the run's trace, so a regression can be pinned to a phase
+        "phases": {e["name"]: e["dur"] / 1e6 for e in tracing.events() if e["cat"] == "stage"},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _child(args) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(_run_once(args.cassette, args.latency_ms / 1000))
+    print(json.dumps(result))
+
+
+# ------------------------
+# Driver
+# ------------------------
+
+def _spawn(args) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        shutil.copytree(ROOT / "data", Path(workdir) / "data")
+
+        command = [sys.executable, "-m", "benchmarks.bench", "--child", "--latency-ms", str(args.latency_ms)]
+        if args.cassette:
+            command += ["--cassette", str(Path(args.cassette).resolve())]
+
+        env = {**os.environ, "PYTHONPATH": str(ROOT)}
+        env.pop("HTTP_CASSETTE_MODE", None)
+        output = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict[str, Any]], args) -> Dict[str, Any]:
+    return {
+        "runs": len(runs),
+        "latency_ms": args.latency_ms,
+        "cassette": bool(args.cassette),
+        "total": statistics.median(run["total"] for run in runs),
+        "stages": {
+            name: {
+                "elapsed": statistics.median(run["stages"][name]["elapsed"] for run in runs),
+                "status": runs[-1]["stages"][name]["status"],
+            }
+            for name in runs[0]["stages"]
+        },
+        "phases": {
+            name: statistics.median(run["phases"].get(name, 0) for run in runs)
+            for name in runs[0]["phases"]
+        },
+        "requests": sum(runs[-1]["requests"].values()),
+        "requests_by_endpoint": runs[-1]["requests"],
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable list of regressions; empty when the run is within budget."""
+    def slower(now: float, then: float) -> bool:
+        return now > then * (1 + tolerance) + ABSOLUTE_SLACK
+
+    problems = []
+
+    if slower(current["total"], baseline["total"]):
+        problems.append(f"total {current['total']:.3f}s > baseline {baseline['total']:.3f}s")
+
+    for name, stage in baseline["stages"].items():
+        now = current["stages"].get(name)
+        if now is None:
+            problems.append(f"{name} missing")
+        elif stage["status"] == "ok" and now["status"] != "ok":
+            problems.append(f"{name} now {now['status']}")
+        elif slower(now["elapsed"], stage["elapsed"]):
+            problems.append(f"{name} {now['elapsed']:.3f}s > baseline {stage['elapsed']:.3f}s")
+
+    for name, elapsed in baseline.get("phases", {}).items():
+        now = current["phases"].get(name, 0)
+        if slower(now, elapsed):
+            problems.append(f"phase {name} {now:.3f}s > baseline {elapsed:.3f}s")
+
+    if current["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        problems.append(f"peak RSS {current['peak_rss_mb']:.0f} MB > baseline {baseline['peak_rss_mb']:.0f} MB")
+
+    if current["requests"] > baseline["requests"]:
+        problems.append(f"{current['requests']} requests > baseline {baseline['requests']}")
+
+    return problems
+
+
+def report(summary: Dict[str, Any]) -> None:
+    print(f"{summary['runs']} runs, {summary['latency_ms']:.0f} ms injected latency")
+    for name, stage in summary["stages"].items():
+        print(f"  {name:<22} {stage['elapsed']:7.3f}s  {stage['status']}")
+    print(f"  {'total':<22} {summary['total']:7.3f}s")
+    for name, elapsed in summary.get("phases", {}).items():
+        print(f"    {name:<20} {elapsed:7.3f}s")
+    print(f"  requests {summary['requests']}, peak RSS {summary['peak_rss_mb']:.0f} MB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="delay before every mock response")
+    parser.add_argument("--cassette", help="recorded HoYoLAB responses (HTTP_CASSETTE_MODE=record)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args)
+        return 0
+
+    summary = summarize([_spawn(args) for _ in range(args.runs)], args)
+    report(summary)
+
+    if args.update_baseline or not BASELINE_FILE.exists():
+        BASELINE_FILE.write_text(json.dumps(summary, indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_FILE.relative_to(ROOT)}")
+        return 0
+
+    baseline = json.loads(BASELINE_FILE.read_text())
+    if (baseline["latency_ms"], baseline["cassette"]) != (summary["latency_ms"], summary["cassette"]):
+        print("Baseline was taken with different settings; pass --update-baseline to replace it")
+        return 1
+
+    problems = compare(summary, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,463 @@
+"""Local stand-in for the HoYoLAB and SKPort APIs, used by benchmarks/bench.py.
+
+Every request the pipeline makes is rewritten to http://127.0.0.1:<port>/<scheme>/<host>/<path>
+and answered here. The Endfield API, the HoYoLAB battle chronicle and diaries and
+every image are generated from a stats.json snapshot. Given a cassette recorded
+with HTTP_CASSETTE_MODE=record, HoYoLAB requests are served from it instead."""
+
+import asyncio
+import functools
+import io
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+from aiohttp import web
+from genshin.utility import extdb
+from PIL import Image
+
+from scripts.replay import PLACEHOLDER_UID, Cassette
+
+ENDFIELD_API = "https://zonai.skport.com"
+ENDFIELD_STATIC = "https://static.skport.com/bench"
+HOYOLAB_STATIC = "https://act-webstatic.hoyoverse.com/bench"
+
+# Any URL with one of these suffixes is answered with a generated PNG
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+# Fixed start of every HoYoLAB schedule, so fixtures do not depend on the day
+BENCH_TIME = {"year": 2026, "month": 1, "day": 1, "hour": 4, "minute": 0}
+
+
+def _icon(name: str) -> str:
+    return f"{ENDFIELD_STATIC}/{name}.png"
+
+
+def _png(seed: str, size: int = 128) -> bytes:
+    color = tuple(b for b in seed.encode()[:3].ljust(3, b"\0"))
+    buffer = io.BytesIO()
+    Image.new("RGBA", (size, size), color + (255,)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def endfield_fixtures(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Refresh, attendance and card detail responses shaped like SKPort's, from a stats.json snapshot."""
+    endfield = snapshot.get("endfield_data") or {}
+    calendar = (snapshot.get("endfield_attendance") or {}).get("attendance", {}).get("calendar", [])
+    award_ids = sorted({day["awardId"] for day in calendar}) or ["bench_award"]
+    resources = {award: {"name": award, "count": 1, "icon": _icon(award)} for award in award_ids}
+
+    chars = [
+        {
+            "charData": {
+                "name": name,
+                "avatarSqUrl": _icon(f"char-{index}"),
+                "rarity": {"value": char.get("rarity")},
+                "profession": {"value": char.get("profession")},
+                "property": {"value": char.get("property")},
+                "weaponType": {"value": char.get("weaponType")},
+            },
+            "potentialLevel": char.get("potential"),
+            "level": char.get("level"),
+            "weapon": {
+                "weaponData": {
+                    "name": char["weapon"]["name"],
+                    "iconUrl": _icon(f"weapon-{index}"),
+                    "rarity": {"value": char["weapon"]["rarity"]},
+                    "type": {"value": char["weapon"]["type"]},
+                },
+                "level": char["weapon"]["level"],
+                "refineLevel": char["weapon"]["refineLevel"],
+            } if char.get("weapon") else None,
+        }
+        for index, (name, char) in enumerate(endfield.get("six_star_characters", {}).items())
+    ]
+
+    detail = {
+        "base": {
+            "name": endfield.get("nickname", "Bench"),
+            "level": endfield.get("level", 1),
+            "avatarUrl": _icon("avatar"),
+            "charNum": endfield.get("avatar_count", len(chars)),
+        },
+        "achieve": {"count": endfield.get("achievements", 0)},
+        "dailyMission": {"dailyActivation": endfield.get("daily_mission", 0)},
+        "dungeon": {"curStamina": endfield.get("stamina", 0)},
+        "domain": [{"levels": [{
+            "puzzleCount": {"count": endfield.get("aurylenes", 0)},
+            "trchestCount": {"count": endfield.get("chest_count", 0)},
+        }]}],
+        "chars": chars,
+    }
+
+    return {
+        "refresh": {"code": 0, "data": {"token": "bench-token"}},
+        "attendance": {"code": 0, "data": {
+            "hasToday": False,
+            "calendar": [{"awardId": award, "available": i == 0, "done": False} for i, award in enumerate(award_ids)],
+            "resourceInfoMap": resources,
+        }},
+        "claim": {"code": 0, "data": {"awardIds": [{"id": award_ids[0]}], "resourceInfoMap": resources}},
+        "card": {"code": 0, "data": {"detail": detail}},
+    }
+
+
+# ------------------------
+# HoYoLAB
+# ------------------------
+
+def _buff() -> Dict[str, Any]:
+    return {"id": 1, "name_mi18n": "Bench", "desc_mi18n": "", "icon": f"{HOYOLAB_STATIC}/buff.png"}
+
+
+def _floor_avatars(avatars) -> list:
+    return [
+        {"id": a["id"], "element": "", "rarity": 5, "icon": f"{HOYOLAB_STATIC}/avatar-{a['id']}.png", "level": a["level"], "rank": a["eidolon"]}
+        for a in avatars or []
+    ]
+
+
+def _season(name: str, **extra) -> Dict[str, Any]:
+    return {"schedule_id": 1, "name_mi18n": name, "status": "", "begin_time": BENCH_TIME, "end_time": BENCH_TIME, **extra}
+
+
+def _hsr_floor(floor: Dict[str, Any]) -> Dict[str, Any]:
+    """One floor of Memory of Chaos, Pure Fiction or Apocalyptic Shadow (the fields they share)."""
+    node = {"challenge_time": BENCH_TIME, "buff": _buff(), "score": 0, "boss_defeated": True}
+    return {
+        "maze_id": 1,
+        "name": floor.get("floor", ""),
+        "star_num": 3,
+        "is_fast": False,
+        "round_num": floor.get("cycles", 0),
+        "is_chaos": True,
+        "last_update_time": BENCH_TIME,
+        # The floor score is the sum of its two nodes
+        "node_1": {**node, "avatars": _floor_avatars(floor.get("first_half")), "score": floor.get("score", 0)},
+        "node_2": {**node, "avatars": _floor_avatars(floor.get("second_half"))},
+    }
+
+
+def _hsr_challenge(record: Dict[str, Any], **season) -> Dict[str, Any]:
+    floor = record.get("floor_data")
+    return {
+        "name": record.get("season", ""),
+        "season_id": 1,
+        "schedule_id": 1,
+        "begin_time": BENCH_TIME,
+        "end_time": BENCH_TIME,
+        "star_num": record.get("total_stars", 0),
+        "max_floor": floor["floor"] if floor else "",
+        "max_floor_id": 1,
+        "battle_num": 1,
+        "has_data": bool(floor),
+        "all_floor_detail": [_hsr_floor(floor)] if floor else [],
+        "groups": [_season(record.get("season", ""), **season)] if record else [],
+    }
+
+
+def _anomaly_arbitration(record: Dict[str, Any], player: Dict[str, Any]) -> Dict[str, Any]:
+    boss = record.get("boss_record")
+    minis = record.get("mini_boss_records") or []
+    return {
+        "challenge_peak_records": [{
+            "group": {
+                "group_id": 1, "begin_time": BENCH_TIME, "end_time": BENCH_TIME, "status": "",
+                "name_mi18n": record.get("season") or "", "game_version": "", "theme_pic_path": "",
+            },
+            "boss_info": {"maze_id": 1, "name_mi18n": "", "hard_mode_name_mi18n": "", "icon": f"{HOYOLAB_STATIC}/boss.png"},
+            "mob_infos": [
+                {"maze_id": i, "name": "", "monster_name": "", "monster_icon": f"{HOYOLAB_STATIC}/mob-{i}.png"}
+                for i in range(len(minis))
+            ],
+            "has_challenge_record": bool(record),
+            "battle_num": record.get("cycles_used", 0),
+            "boss_record": {
+                "maze_id": 1, "has_challenge_record": True, "challenge_time": BENCH_TIME,
+                "avatars": _floor_avatars(boss["characters"]), "buff": _buff(), "hard_mode": False,
+                "round_num": boss["cycles_used"], "star_num": boss["stars"], "finish_color_medal": False,
+                "challenge_peak_rank_icon_type": boss["medal_type"], "challenge_peak_rank_icon": "",
+                "record_unique_key": "bench",
+            } if boss else None,
+            "mob_records": [
+                {
+                    "maze_id": i, "has_challenge_record": True, "challenge_time": BENCH_TIME,
+                    "avatars": _floor_avatars(mini["characters"]), "round_num": mini["cycles_used"],
+                    "star_num": mini["stars"], "is_fast": False,
+                }
+                for i, mini in enumerate(minis)
+            ],
+            "boss_stars": record.get("boss_stars", 0),
+            "mob_stars": record.get("mini_boss_stars", 0),
+        }] if record else [],
+        "challenge_peak_best_record_brief": {
+            "total_battle_num": 1, "mob_stars": record.get("mini_boss_stars", 0), "boss_stars": record.get("boss_stars", 0),
+            "challenge_peak_rank_icon_type": "", "challenge_peak_rank_icon": "",
+        },
+        "role": {"server": "", "nickname": player.get("nickname", "Bench"), "level": player.get("level", 1), "role_id": "0"},
+    }
+
+
+def hoyolab_fixtures(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Battle chronicle and diary responses shaped like HoYoLAB's, from a stats.json snapshot, keyed by path."""
+    hsr = snapshot.get("hsr_data") or {}
+    genshin = snapshot.get("genshin_data") or {}
+
+    # Ids start at 1: genshin.py treats a falsy id as a character it has to look up online
+    hsr_characters = [
+        {
+            "id": 1001 + index, "element": char.get("element", ""), "rarity": 5, "icon": char["icon"], "name": name,
+            "level": char.get("level", 1), "rank": char.get("eidolon", 0), "image": char["icon"],
+            "equip": {
+                "id": 20001 + index, "level": char["lc"]["level"], "rank": char["lc"]["superimposition"], "name": char["lc"]["name"],
+                "desc": "", "icon": char["lc"]["icon"], "rarity": char["lc"]["rarity"], "wiki": "",
+            } if char.get("lc") else None,
+            "relics": [], "ornaments": [], "ranks": [], "properties": [], "skills": [], "servant_detail": None,
+            "base_type": char.get("path", 1), "figure_path": "",
+        }
+        for index, (name, char) in enumerate(hsr.get("five_star_characters", {}).items())
+    ]
+
+    genshin_characters = [
+        {
+            "id": 10000001 + index, "name": name, "element": char.get("element", ""), "rarity": 5, "icon": char["icon"],
+            "level": char.get("level", 1), "fetter": char.get("friendship", 0),
+            "actived_constellation_num": char.get("constellation", 0), "weapon_type": char.get("weaponType", 1),
+            "weapon": {
+                "id": 11501 + index, "icon": char["weapon"]["icon"], "name": char["weapon"]["name"], "rarity": char["weapon"]["rarity"],
+                "level": char["weapon"]["level"], "type": char.get("weaponType", 1), "affix_level": char["weapon"]["refinement"],
+            },
+        }
+        for index, (name, char) in enumerate(genshin.get("five_star_characters", {}).items())
+        if char.get("weapon")
+    ]
+
+    hsr_gain = (snapshot.get("hsr_diary") or {}).get("Net Currency Gain", 0)
+    genshin_gain = (snapshot.get("genshin_diary") or {}).get("Net Currency Gain", 0)
+    month = {"uid": 0, "region": "", "data_month": BENCH_TIME["month"]}
+    boss = {"id": 1, "name_mi18n": "", "icon": f"{HOYOLAB_STATIC}/boss.png"}
+
+    return {
+        "game_record/hkrpg/api/index": {
+            "stats": {
+                "active_days": hsr.get("active_days", 0), "avatar_num": hsr.get("avatar_count", 0),
+                "achievement_num": hsr.get("achievements", 0), "chest_num": hsr.get("chest_count", 0),
+                "abyss_process": "", "dream_paster_num": 0,
+            },
+            "avatar_list": [], "cur_head_icon_url": "", "phone_background_image_url": "",
+        },
+        "game_record/hkrpg/api/role/basicInfo": {
+            "nickname": hsr.get("nickname", "Bench"), "region": "", "level": hsr.get("level", 1),
+            "avatar": hsr.get("avatar_url", f"{HOYOLAB_STATIC}/hsr-avatar.png"),
+        },
+        "game_record/hkrpg/api/avatar/info": {
+            "avatar_list": hsr_characters, "equip_wiki": {}, "relic_wiki": {}, "property_info": {},
+            "recommend_property": {
+                str(char["id"]): {"recommend_relic_properties": [], "custom_relic_properties": [], "is_custom_property_valid": False}
+                for char in hsr_characters
+            },
+            "relic_properties": [],
+        },
+        "game_record/hkrpg/api/note": {
+            "current_stamina": hsr.get("stamina", 0), "max_stamina": 300, "stamina_recover_time": 0,
+            "accepted_epedition_num": 0, "total_expedition_num": 0, "expeditions": [],
+            "current_train_score": hsr.get("current_train_score", 0), "max_train_score": 500,
+            "current_rogue_score": 0, "max_rogue_score": 0, "rogue_tourn_weekly_unlocked": False,
+            "rogue_tourn_weekly_max": 0, "rogue_tourn_weekly_cur": 0, "weekly_cocoon_cnt": 0,
+            "weekly_cocoon_limit": 0, "current_reserve_stamina": 0, "is_reserve_stamina_full": False,
+        },
+        "game_record/hkrpg/api/challenge": _hsr_challenge(hsr.get("memory_of_chaos") or {}),
+        "game_record/hkrpg/api/challenge_story": _hsr_challenge(hsr.get("pure_fiction") or {}),
+        "game_record/hkrpg/api/challenge_boss": _hsr_challenge(
+            hsr.get("apocalyptic_shadow") or {}, upper_boss=boss, lower_boss=boss,
+        ),
+        "game_record/hkrpg/api/challenge_peak": _anomaly_arbitration(hsr.get("anomaly_arbitration") or {}, hsr),
+        "event/game_record/genshin/api/index": {
+            "role": {
+                "nickname": genshin.get("nickname", "Bench"), "region": "", "level": genshin.get("level", 1),
+                "AvatarUrl": "", "game_head_icon": genshin.get("avatar_url", f"{HOYOLAB_STATIC}/genshin-avatar.png"),
+            },
+            "stats": {
+                "achievement_number": genshin.get("achievements", 0), "active_day_number": genshin.get("active_days", 0),
+                "avatar_number": genshin.get("avatar_count", 0), "spiral_abyss": "",
+                # The oculi and chests are summed back up by fetch_genshin_data
+                "anemoculus_number": genshin.get("oculus", 0), "geoculus_number": 0, "dendroculus_number": 0,
+                "electroculus_number": 0, "hydroculus_number": 0, "pyroculus_number": 0, "moonoculus_number": 0,
+                "common_chest_number": genshin.get("chest_count", 0), "exquisite_chest_number": 0,
+                "precious_chest_number": 0, "luxurious_chest_number": 0, "magic_chest_number": 0,
+                "way_point_number": 0, "domain_number": 0, "full_fetter_avatar_num": 0,
+                "role_combat": {"is_unlock": False, "max_round_id": 0, "has_data": False, "has_detail_data": False},
+                "hard_challenge": {"difficulty": 0, "name": "", "has_data": False, "is_unlock": False},
+            },
+            "avatars": [], "world_explorations": [], "homes": [],
+        },
+        "event/game_record/genshin/api/character/list": {"list": genshin_characters},
+        "event/game_record/genshin/api/dailyNote": {
+            "current_resin": genshin.get("resin", 0), "max_resin": 200, "resin_recovery_time": "0",
+            "current_home_coin": 0, "max_home_coin": 0, "home_coin_recovery_time": "0",
+            "finished_task_num": genshin.get("daily_task", 0), "total_task_num": 4, "is_extra_task_reward_received": False,
+            "remain_resin_discount_num": 0, "resin_discount_num_limit": 3, "transformer": None,
+            "expeditions": [], "max_expedition_num": 5,
+            "archon_quest_progress": {
+                "list": [], "is_finish_all_mainline": True, "is_open_archon_quest": True, "is_finish_all_interchapter": True,
+            },
+            "daily_task": {
+                "total_num": 4, "finished_num": genshin.get("daily_task", 0), "is_extra_task_reward_received": False,
+                "task_rewards": [], "attendance_rewards": [], "attendance_visible": False, "stored_attendance": 0,
+            },
+        },
+        "event/srledger/month_info": {
+            **month,
+            "month_data": {
+                "current_hcoin": hsr_gain, "current_rails_pass": 0, "last_hcoin": 0, "last_rails_pass": 0,
+                "hcoin_rate": 0, "rails_rate": 0, "group_by": [],
+            },
+            "day_data": {"current_hcoin": hsr_gain, "current_rails_pass": 0, "last_hcoin": 0, "last_rails_pass": 0},
+        },
+        "event/ysledgeros/month_info": {
+            **month,
+            "month_data": {
+                "current_primogems": genshin_gain, "current_mora": 0, "last_primogems": 0, "last_mora": 0,
+                "primogem_rate": 0, "mora_rate": 0, "group_by": [],
+            },
+            "day_data": {"current_primogems": genshin_gain, "current_mora": 0},
+        },
+    }
+
+
+def seed_character_names(fixtures: Dict[str, Any]) -> None:
+    """Give genshin.py the Genshin characters of the fixtures.
+
+    Until it knows some, genshin.py downloads its character table (gi.yatta.moe,
+    Enka, GitLab) alongside every battle chronicle request, which would put the
+    internet back into the benchmark."""
+    for char in fixtures["event/game_record/genshin/api/character/list"]["list"]:
+        # Icons are named after the internal character name (UI_AvatarIcon_Qin.png for Jean)
+        icon_name = Path(char["icon"]).stem.removeprefix("UI_AvatarIcon_")
+        extdb.update_character_name("en-us", char["id"], icon_name, char["name"], char["element"], char["rarity"])
+
+
+class MockAPI:
+    """aiohttp server answering every rewritten request, with optional injected latency."""
+
+    def __init__(self, snapshot: Dict[str, Any], cassette: Optional[Path] = None, latency: float = 0.0):
+        self.fixtures = endfield_fixtures(snapshot)
+        self.hoyolab = hoyolab_fixtures(snapshot)
+        seed_character_names(self.hoyolab)
+        self.cassette = Cassette(cassette, "replay", latency) if cassette else None
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{scheme}/{host}/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        scheme, host, path = request.match_info["scheme"], request.match_info["host"], request.match_info["path"]
+        url = f"{scheme}://{host}/{path}" + (f"?{request.query_string}" if request.query_string else "")
+        self.requests[f"{request.method} {host}/{path}"] += 1
+
+        if url.startswith(ENDFIELD_API):
+            await asyncio.sleep(self.latency)
+            return web.json_response(self._endfield(request.method, f"/{path}"))
+
+        if path.lower().endswith(IMAGE_SUFFIXES):
+            await asyncio.sleep(self.latency)
+            return web.Response(body=_png(path), content_type="image/png", headers={"ETag": f'"{path}"'})
+
+        if self.cassette:
+            interaction = self.cassette.next(request.method, url)
+            if interaction is None:
+                return web.json_response({"retcode": -1, "message": "not recorded"}, status=404)
+
+            await self.cassette.delay(interaction)
+            return web.Response(body=Cassette.body(interaction), status=interaction["status"], headers=interaction["headers"])
+
+        await asyncio.sleep(self.latency)
+        data = next((data for endpoint, data in self.hoyolab.items() if path.endswith(endpoint)), None)
+        if data is None:
+            return web.json_response({"retcode": -1, "message": f"unknown endpoint /{path}"}, status=404)
+        return web.json_response({"retcode": 0, "message": "OK", "data": data})
+
+    def _endfield(self, method: str, path: str) -> Dict[str, Any]:
+        if path.endswith("/auth/refresh"):
+            return self.fixtures["refresh"]
+        if path.endswith("/attendance"):
+            return self.fixtures["claim" if method == "POST" else "attendance"]
+        if path.endswith("/card/detail"):
+            return self.fixtures["card"]
+        return {"code": 404, "message": f"unknown endpoint {path}"}
+
+    # ------------------------
+    # Client hooks (same interface as replay.Cassette)
+    # ------------------------
+
+    replaying = True  # main.main runs offline: no secrets, no webhooks
+
+    def uid(self, name: str) -> int:
+        return self.cassette.uid(name) if self.cassette else PLACEHOLDER_UID
+
+    def rewrite(self, url) -> str:
+        url = httpx.URL(str(url))
+        return f"http://127.0.0.1:{self.port}/{url.scheme}/{url.host}{url.raw_path.decode()}"
+
+    def wrap_transport(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        return _RewritingTransport(self, transport)
+
+    def wrap_session(self, create):
+        return _RewritingSession(self, create())
+
+    def save(self) -> None:
+        pass
+
+
+class _RewritingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, api: MockAPI, inner: httpx.AsyncBaseTransport):
+        self.api = api
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = httpx.URL(self.api.rewrite(request.url))
+        request.headers["Host"] = request.url.netloc.decode()
+        return await self.inner.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class _RewritingSession:
+    def __init__(self, api: MockAPI, session):
+        self.api = api
+        self.session = session
+
+    def request(self, method: str, url, **kwargs):
+        return self.session.request(method, self.api.rewrite(url), **kwargs)
+
+    get = functools.partialmethod(request, "GET")
+    post = functools.partialmethod(request, "POST")
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+def load_snapshot(path: Path) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
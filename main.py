@@ -1,29 +1,75 @@
 import asyncio
+import contextlib
 import json
 import logging
 import os
 import time
 
-import genshin
-
-from scripts.constants import now
-from scripts.endfield.client import EndfieldClient
+from scripts import run_metrics
+from scripts.assets import load_manifest, localize_snapshot, referenced_images
+from scripts.constants import CARRY_FORWARD_SECTIONS, RUN_DEADLINE, SOURCE_TIMEOUTS, now
+from scripts.derivatives import describe_images
+from scripts.diff import snapshot_changes
+from scripts.endfield.client import AsyncEndfieldClient
+from scripts.freshness import save_fetch_times, split_fetch_times, with_fetch_times
 from scripts.hoyolab.diary import GENSHIN_CONFIG, HSR_CONFIG, update_diary_xlsx
+from scripts.hoyolab.session import create_hoyolab_client, save_hoyolab_session
 from scripts.hoyolab.stats import fetch_genshin_data, fetch_hsr_data
+from scripts.history import HistoryStore
+from scripts.http_client import create_http_client
 from scripts.logging_config import setup_logging
-from scripts.notifier import WebhookClient, endfield_attendance_embed, endfield_embed, hoyolab_diary_embed, hoyolab_embed
+from scripts.notifier import (
+    WebhookClient,
+    endfield_attendance_embed,
+    endfield_embed,
+    hoyolab_diary_embed,
+    hoyolab_embed,
+    performance_embed
+)
+from scripts.orchestrator import Source, run_sources
+from scripts.profiling import enabled as profiling_enabled, profiled
+from scripts.publish import content_hash, publish_delta, publish_shards, publish_stats
+from scripts.replay import Cassette
+from scripts.response_cache import ResponseCache
+from scripts.session_cache import SessionCache
+from scripts.tracing import export as export_trace, span, traced
+
+
+def _env(name: str, offline: bool) -> str:
+    """Required setting; an offline replay runs without real credentials or webhooks."""
+    return os.environ.get(name, "0") if offline else os.environ[name]
+
+
+def _uid(name: str, cassette, offline: bool) -> int:
+    """HoYoLAB uid; an offline replay defaults to one on the server its cassette was recorded against."""
+    if offline:
+        return int(os.environ.get(name) or cassette.uid(name))
 
+    uid = int(os.environ[name])
+    if cassette:
+        cassette.record_uid(name, uid)
+    return uid
 
-async def main():
+
+@traced("main", "stage")
+async def main(cassette=None):
     start_time = time.perf_counter()
     logger = logging.getLogger("main")
 
+    # HTTP_CASSETTE_MODE=record|replay, see scripts/replay.py (benchmarks pass their own)
+    cassette = cassette or Cassette.from_env()
+    offline = bool(cassette and cassette.replaying)
+
     notifier = WebhookClient(
-        hoyolab_webhook=os.environ["HOYOLAB_WEBHOOK"],
-        endfield_webhook=os.environ["ENDFIELD_WEBHOOK"],
-        discord_id=os.environ["DISCORD_ID"]
+        hoyolab_webhook=_env("HOYOLAB_WEBHOOK", offline),
+        endfield_webhook=_env("ENDFIELD_WEBHOOK", offline),
+        discord_id=_env("DISCORD_ID", offline),
+        dry_run=offline
     )
 
+    # Reports an earlier run could not deliver go out while this one fetches
+    notifier.resume()
+
     try:
         # ---------------------------
         # Save JSON
@@ -41,43 +87,117 @@ async def main():
         # Setup + Client
         # ---------------------------
 
-        hoyolab_client = genshin.Client()
-        hoyolab_client.set_cookies(os.environ["HOYOLAB_USER_COOKIES"])
+        # Tokens and cookies from earlier runs, reused while still valid
+        session_cache = SessionCache()
+
+        # Parsed rosters and endgame records. Left out while recording or replaying
+        # a cassette, which has to see (and answer) every request itself.
+        response_cache = None if cassette else ResponseCache()
 
-        hsr_uid = int(os.environ["HOYOLAB_HSR_UID"])
-        genshin_uid = int(os.environ["HOYOLAB_GENSHIN_UID"])
+        hoyolab_cookies = _env("HOYOLAB_USER_COOKIES", offline)
+        hoyolab_client = create_hoyolab_client(hoyolab_cookies, session_cache, cassette)
 
-        endfield_client = EndfieldClient(
-            cred=os.environ["ENDFIELD_CRED"],
-            sk_game_role=os.environ["ENDFIELD_GAME_ROLE"]
+        hsr_uid = _uid("HOYOLAB_HSR_UID", cassette, offline)
+        genshin_uid = _uid("HOYOLAB_GENSHIN_UID", cassette, offline)
+
+        # One pooled HTTP/2 connection set for the Endfield API and every image download
+        http = create_http_client(cassette=cassette)
+
+        endfield_client = AsyncEndfieldClient(
+            cred=_env("ENDFIELD_CRED", offline),
+            sk_game_role=_env("ENDFIELD_GAME_ROLE", offline),
+            http=http,
+            session_cache=session_cache
         )
 
         # ---------------------------
         # Fetch Data
         # ---------------------------
-        hsr_data = await fetch_hsr_data(hoyolab_client, hsr_uid)
-        genshin_data = await fetch_genshin_data(hoyolab_client, genshin_uid)
-        hsr_diary = await update_diary_xlsx(hoyolab_client, hsr_uid, HSR_CONFIG)
-        genshin_diary = None
-        genshin_diary = await update_diary_xlsx(hoyolab_client, genshin_uid, GENSHIN_CONFIG)
-
-        endfield_attendance = endfield_client.claim_attendance()
-        endfield_data = endfield_client.fetch_endfield_data(old_data.get("endfield_data", {}) if old_data else {})
-
-        data = {
-            "last_updated": now().isoformat(),
-            "hsr_data": hsr_data,
-            "genshin_data": genshin_data,
-            "hsr_diary": hsr_diary,
-            "genshin_diary": genshin_diary,
-            "endfield_attendance": endfield_attendance,
-            "endfield_data": endfield_data
-        }
+        # The published sections plus when each of their parts was last fetched (.cache/fetched_at.json)
+        old_state = with_fetch_times(old_data)
+        old_endfield = old_state.get("endfield_data", {})
+        old_hsr = old_state.get("hsr_data", {})
+        old_genshin = old_state.get("genshin_data", {})
+
+        # Each game only refetches the parts past their TTL (constants.SECTION_TTLS);
+        # the HoYoLAB sections have no timeout of their own, RUN_DEADLINE bounds them
+        sources = [
+            Source("hsr_data", lambda: fetch_hsr_data(hoyolab_client, hsr_uid, old_hsr, response_cache), None, {}),
+            Source("genshin_data", lambda: fetch_genshin_data(hoyolab_client, genshin_uid, old_genshin, response_cache), None, {}),
+            Source("hsr_diary", lambda: update_diary_xlsx(hoyolab_client, hsr_uid, HSR_CONFIG), SOURCE_TIMEOUTS["hsr_diary"], None),
+            Source("genshin_diary", lambda: update_diary_xlsx(hoyolab_client, genshin_uid, GENSHIN_CONFIG), SOURCE_TIMEOUTS["genshin_diary"], None),
+            Source("endfield_attendance", endfield_client.claim_attendance, SOURCE_TIMEOUTS["endfield_attendance"], {}),
+            Source("endfield_data", lambda: endfield_client.fetch_endfield_data(old_endfield), SOURCE_TIMEOUTS["endfield_data"], {}),
+        ]
+
+        async with http:
+            with span("fetch sources", "stage"):
+                results = await run_sources(sources, deadline=RUN_DEADLINE)
+
+            # Replayed tokens are placeholders, never worth keeping
+            if not offline:
+                save_hoyolab_session(hoyolab_client, hoyolab_cookies, session_cache)
+                session_cache.save()
+            if response_cache:
+                response_cache.save()
+
+            # A failed game keeps yesterday's section instead of publishing an empty one
+            for name in CARRY_FORWARD_SECTIONS:
+                if not results[name].ok and old_state.get(name):
+                    logger.warning(f"{name} failed, keeping the previous values")
+                    results[name].value = old_state[name]
+
+            hsr_data = results["hsr_data"].value
+            genshin_data = results["genshin_data"].value
+            hsr_diary = results["hsr_diary"].value
+            genshin_diary = results["genshin_diary"].value
+            endfield_attendance = results["endfield_attendance"].value
+            endfield_data = results["endfield_data"].value
+
+            data = {
+                "last_updated": now().isoformat(),
+                "hsr_data": hsr_data,
+                "genshin_data": genshin_data,
+                "hsr_diary": hsr_diary,
+                "genshin_diary": genshin_diary,
+                "endfield_attendance": endfield_attendance,
+                "endfield_data": endfield_data
+            }
+
+            # Fetch times are run state, not site data: kept in .cache/ so a run whose
+            # refreshed parts changed nothing still remembers them without publishing
+            data, fetch_times = split_fetch_times(data)
+            if not offline:
+                save_fetch_times(fetch_times)
+
+            # Swap every game's remote icon URLs for copies in data/images/<game>/
+            with span("localize images", "stage"):
+                data = await localize_snapshot(data, http)
+
+        # Pixel sizes and WebP/AVIF variants of every local icon, for the frontend
+        with span("describe images", "stage"):
+            data["images"] = describe_images(referenced_images(data), load_manifest())
 
         os.makedirs("data", exist_ok=True)
 
-        with open("data/stats.json", "w") as f:
-            json.dump(data, f, indent=2)
+        # Nothing new since the last run (ignoring the timestamp): leave every published file alone
+        if content_hash(data) == content_hash(old_data):
+            logger.info("No changes since the last run, published files left untouched")
+        else:
+            with span("publish", "stage"):
+                # Pretty stats.json plus minified .json/.gz/.br copies
+                publish_stats(data)
+
+                # Per-section shards under data/stats/, so the site only refetches what changed
+                publish_shards(data)
+
+                # JSON Patch from the previous snapshot, for clients that already hold it
+                publish_delta(old_data, data)
+
+        # Append the snapshot to the SQLite history (data/history.sqlite)
+        with span("history", "stage"):
+            history = HistoryStore()
+            history.record(data)
 
         # ---------------------------
         # SUCCESS NOTIFICATION
@@ -85,31 +205,60 @@ async def main():
         elapsed = time.perf_counter() - start_time
         logger.info(f"Stats update completed in {elapsed:.2f}s")
 
-        notifier.send_hoyolab(
-            elapsed=elapsed,
-            embeds=[
-                hoyolab_embed(
-                    old_data=old_data,
-                    genshin_data=genshin_data,
-                    hsr_data=hsr_data
-                ),
-                hoyolab_diary_embed(
-                    hsr_diary=hsr_diary,
-                    genshin_diary=genshin_diary
-                )
-            ]
-        )
+        # Latency and traffic of this run against the p50/p95 of earlier ones
+        # (kept in .cache/runs.sqlite, so an unchanged run still writes nothing under data/)
+        metrics = run_metrics.collect(results, elapsed)
+        with run_metrics.RunStore() as runs:
+            baselines = run_metrics.baselines(runs, metrics)
+            slow = run_metrics.regressions(metrics, baselines)
 
-        notifier.send_endfield(
-            elapsed=elapsed,
-            embeds=[
-                *endfield_attendance_embed(endfield_attendance), # spread the list
-                endfield_embed(
-                    old_data=old_data,
-                    endfield_data=endfield_data
-                ),
-            ]
-        )
+            # Replayed timings say nothing about the live APIs
+            if not offline:
+                runs.record(metrics)
+
+        # Everything that moved since the last snapshot, in one pass per game
+        changes = snapshot_changes(old_data, data, ["genshin_data", "hsr_data", "endfield_data"])
+
+        hoyolab_embeds = [
+            hoyolab_embed(
+                genshin=changes["genshin_data"],
+                hsr=changes["hsr_data"],
+                history=history
+            ),
+            hoyolab_diary_embed(
+                hsr_diary=hsr_diary,
+                genshin_diary=genshin_diary
+            ),
+            performance_embed(
+                metrics=metrics,
+                baselines=baselines,
+                slow=slow
+            )
+        ]
+
+        endfield_embeds = [
+            *endfield_attendance_embed(endfield_attendance), # spread the list
+            endfield_embed(changes["endfield_data"]),
+        ]
+
+        history.close()
+
+        # Queued in .cache/outbox.jsonl and delivered in the background; flushed at the end of the run
+        notifier.send_hoyolab(elapsed=elapsed, embeds=hoyolab_embeds)
+        notifier.send_endfield(elapsed=elapsed, embeds=endfield_embeds)
+
+        # ---------------------------
+        # PARTIAL FAILURE NOTIFICATION
+        # ---------------------------
+        failed = [r for r in results.values() if not r.ok]
+
+        if failed:
+            notifier.send_failure(
+                task_name=", ".join(r.name for r in failed),
+                error_message="\n".join(f"{r.name}: {r.error}" for r in failed)
+            )
+
+        return results
 
     except Exception as e:
         # ---------------------------
@@ -122,12 +271,23 @@ async def main():
         )
         raise
 
+    finally:
+        # Delivery problems are logged, never raised; leftovers wait in the outbox for the next run
+        with span("notify", "stage"):
+            await notifier.flush()
+        if cassette:
+            cassette.save()
+        # Timeline of every span in this run, next to automation.log
+        export_trace()
+
 if __name__ == "__main__":
     setup_logging(debug=True)
     logging.info("Starting Stats Update Script")
 
     try:
-        asyncio.run(main())
+        # --profile or PROFILE=1: cProfile + tracemalloc reports in profile/
+        with profiled() if profiling_enabled() else contextlib.nullcontext():
+            asyncio.run(main())
         logging.info("Script finished successfully.")
     except Exception:
         logging.exception("Script crashed.")
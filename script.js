@@ -9,6 +9,33 @@ function showPage(pageId) {
   document.getElementById(pageId).classList.add("active");
 }
 
+/* =========================
+   Images
+========================= */
+
+// Local image path -> { width, height, derivatives } from stats.json
+let IMAGES = {};
+
+// Render an <img>, upgraded to a <picture> with resized AVIF/WebP variants
+// when the image has derivatives. `size` is the CSS pixel width it is shown at.
+function imgTag(src, alt, size, attrs = "") {
+  const info = IMAGES[src];
+  if (!info || !info.derivatives?.length) {
+    return `<img src="${src}" alt="${alt}" ${attrs}>`;
+  }
+
+  const srcsets = {};
+  info.derivatives.forEach((d) => {
+    (srcsets[d.type] ??= []).push(`${d.path} ${d.width}w`);
+  });
+
+  const sources = Object.entries(srcsets)
+    .map(([type, set]) => `<source type="${type}" srcset="${set.join(", ")}" sizes="${size}px">`)
+    .join("");
+
+  return `<picture>${sources}<img src="${src}" alt="${alt}" width="${info.width}" height="${info.height}" ${attrs}></picture>`;
+}
+
 /* =========================
    Memory of Chaos
 ========================= */
@@ -97,7 +124,7 @@ function renderHSR(data) {
   container.innerHTML = `
     <div class="card">
       <div class="avatar">
-        <img src="${sr.avatar_url}" alt="${sr.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+        ${imgTag(sr.avatar_url, sr.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
       </div>
       <div class="nickname">${sr.nickname}</div>
       <div class="server-level">NA · Level ${sr.level}</div>
@@ -136,7 +163,7 @@ function renderGenshin(data) {
   container.innerHTML = `
     <div class="card">
       <div class="avatar">
-        <img src="${gi.avatar_url}" alt="${gi.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+        ${imgTag(gi.avatar_url, gi.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
       </div>
       <div class="nickname">${gi.nickname}</div>
       <div class="server-level">AR ${gi.level}</div>
@@ -176,7 +203,7 @@ function renderEndfield(data) {
   container.innerHTML = `
     <div class="card">
       <div class="avatar">
-        <img src="${ef.avatar_url}" alt="${ef.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+        ${imgTag(ef.avatar_url, ef.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
       </div>
       <div class="nickname">${ef.nickname}</div>
       <div class="server-level">Level ${ef.level}</div>
@@ -220,7 +247,7 @@ function renderEndfield(data) {
 
     card.innerHTML = `
       <div class="endfield-char-avatar">
-        <img src="${char.avatarSqUrl}" alt="${name}">
+        ${imgTag(char.avatarSqUrl, name, 72)}
         <div class="endfield-potential-badge">P${char.potential}</div>
       </div>
       <div class="endfield-char-info">
@@ -230,7 +257,7 @@ function renderEndfield(data) {
         ${
           char.weapon
             ? `<div class="endfield-char-weapon">
-          <img src="${char.weapon.iconUrl}" alt="${char.weapon.name}">
+          ${imgTag(char.weapon.iconUrl, char.weapon.name, 16)}
           <span>${char.weapon.name}</span>
         </div>`
             : ""
@@ -260,7 +287,7 @@ function renderHome(data) {
       <div class="card">
         <h2>Honkai: Star Rail</h2>
         <div class="avatar">
-          <img src="${sr.avatar_url}" alt="${sr.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+          ${imgTag(sr.avatar_url, sr.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
         </div>
         <div class="nickname">${sr.nickname}</div>
         <div class="server-level">Level ${sr.level}</div>
@@ -277,7 +304,7 @@ function renderHome(data) {
       <div class="card">
         <h2>Genshin Impact</h2>
         <div class="avatar">
-          <img src="${gi.avatar_url}" alt="${gi.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+          ${imgTag(gi.avatar_url, gi.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
         </div>
         <div class="nickname">${gi.nickname}</div>
         <div class="server-level">AR ${gi.level}</div>
@@ -294,7 +321,7 @@ function renderHome(data) {
       <div class="card">
         <h2>Arknights: Endfield</h2>
         <div class="avatar">
-          <img src="${ef.avatar_url}" alt="${ef.nickname}" style="width:100%;height:100%;border-radius:50%;object-fit:cover;">
+          ${imgTag(ef.avatar_url, ef.nickname, 76, 'style="width:100%;height:100%;border-radius:50%;object-fit:cover;"')}
         </div>
         <div class="nickname">${ef.nickname}</div>
         <div class="server-level">Level ${ef.level}</div>
@@ -311,12 +338,40 @@ function renderHome(data) {
    Load Everything
 ========================= */
 
-async function loadStats() {
+// Assemble the snapshot from the per-section shards listed in the manifest.
+// The manifest is always revalidated; shard URLs carry their content hash, so
+// unchanged shards come straight from the browser cache.
+async function loadShards() {
+  const response = await fetch("data/stats/manifest.json", { cache: "no-cache" });
+  if (!response.ok) throw new Error("Failed to fetch shard manifest");
+
+  const manifest = await response.json();
+  const shards = await Promise.all(
+    Object.values(manifest.shards).map(async (shard) => {
+      const res = await fetch(shard.path);
+      if (!res.ok) throw new Error(`Failed to fetch ${shard.path}`);
+      return res.json();
+    })
+  );
+
+  return Object.assign({ last_updated: manifest.last_updated }, ...shards);
+}
+
+async function fetchStats() {
   try {
+    return await loadShards();
+  } catch (err) {
+    console.warn("Shard load failed, falling back to stats.json:", err);
     const response = await fetch("data/stats.json");
     if (!response.ok) throw new Error("Failed to fetch JSON");
+    return response.json();
+  }
+}
 
-    const data = await response.json();
+async function loadStats() {
+  try {
+    const data = await fetchStats();
+    IMAGES = data.images ?? {};
 
     renderHome(data);
     renderHSR(data);
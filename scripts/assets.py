@@ -0,0 +1,395 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from scripts.constants import ASSET_NAMESPACES, IMAGE_CONCURRENCY, IMAGE_DIR, IMAGE_GC_GRACE_DAYS, IMAGE_REVALIDATE_DAYS, now
+from scripts.derivatives import make_derivatives
+from scripts.fileio import atomic_write
+from scripts.tracing import span, traced
+
+MANIFEST_FILE = IMAGE_DIR / "manifest.json"
+
+# Files in IMAGE_DIR that are not cache blobs
+RESERVED_FILES = {IMAGE_DIR / "README.md", MANIFEST_FILE}
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+# Manifest layout:
+#   namespaces: game -> {
+#       urls:  source url -> {"hash", "etag", "last_modified", "checked", "last_referenced"}
+#       blobs: sha256     -> {"path", "size", "width", "height", "derivatives"}
+#   }
+#   orphans: relative path -> first time it was seen untracked under IMAGE_DIR
+#
+# Each namespace stores one file per distinct content under data/images/<game>/,
+# plus its resized WebP/AVIF variants in data/images/<game>/thumbs/.
+
+
+# ------------------------
+# Manifest
+# ------------------------
+
+def load_manifest() -> Dict[str, Any]:
+    """Load the asset index, or an empty one if missing/corrupt."""
+    try:
+        with open(MANIFEST_FILE, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    if "namespaces" not in manifest:
+        manifest = _migrate_manifest(manifest)
+
+    manifest.setdefault("orphans", {})
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any]) -> None:
+    atomic_write(MANIFEST_FILE, (json.dumps(manifest, indent=2, sort_keys=True) + "\n").encode())
+
+
+def _namespace(manifest: Dict[str, Any], name: str) -> Dict[str, Dict[str, Any]]:
+    return manifest["namespaces"].setdefault(name, {"urls": {}, "blobs": {}})
+
+
+def _migrate_manifest(old: Dict[str, Any]) -> Dict[str, Any]:
+    """Move the single-cache layouts (only ever used for Endfield) into the endfield namespace."""
+    manifest = {"namespaces": {}, "orphans": old.get("orphans", {})}
+    space = _namespace(manifest, "endfield")
+
+    if "urls" in old:
+        space.update(urls=old["urls"], blobs=old["blobs"])
+        return manifest
+
+    # Original url -> {"path", "etag", ...} index, before content addressing
+    for url, entry in old.items():
+        if _adopt(space, "endfield", url, Path(entry["path"])):
+            space["urls"][url].update(
+                etag=entry.get("etag"),
+                last_modified=entry.get("last_modified"),
+                checked=entry.get("checked"),
+            )
+
+    return manifest
+
+
+# ------------------------
+# Content-addressed blobs
+# ------------------------
+
+def _blob_path(namespace: str, digest: str, url: str) -> str:
+    suffix = Path(url.split("?")[0]).suffix or ".png"
+    return f"{IMAGE_DIR.as_posix()}/{namespace}/{digest[:32]}{suffix}"
+
+
+def _store(space: Dict[str, Dict[str, Any]], namespace: str, url: str, content: bytes) -> str:
+    """Store content once per distinct hash and return the digest."""
+    digest = hashlib.sha256(content).hexdigest()
+
+    # Also rewrite a blob the manifest lists but the disk lost (e.g. a partial cache restore)
+    if digest not in space["blobs"] or not Path(space["blobs"][digest]["path"]).is_file():
+        path = _blob_path(namespace, digest, url)
+        atomic_write(Path(path), content)
+        space["blobs"][digest] = {"path": path, "size": len(content)}
+
+    return digest
+
+
+def _adopt(space: Dict[str, Dict[str, Any]], namespace: str, url: str, path: Path) -> bool:
+    """Move a file saved under its url name into the blob store, deduplicating it."""
+    if not path.is_file():
+        return False
+
+    content = path.read_bytes()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if digest in space["blobs"]:
+        if Path(space["blobs"][digest]["path"]) != path:
+            path.unlink()
+    else:
+        blob = _blob_path(namespace, digest, url)
+        Path(blob).parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, blob)
+        space["blobs"][digest] = {"path": blob, "size": len(content)}
+
+    space["urls"][url] = {
+        "hash": digest,
+        "etag": None,
+        "last_modified": None,
+        "checked": None,
+        "last_referenced": now().isoformat(),
+    }
+    return True
+
+
+# ------------------------
+# Downloads
+# ------------------------
+
+def _legacy_path(url: str) -> Path:
+    return IMAGE_DIR / url.split("/")[-1]
+
+
+def _older_than(timestamp: Optional[str], days: float) -> bool:
+    return not timestamp or now() - datetime.fromisoformat(timestamp) >= timedelta(days=days)
+
+
+def _blob_missing(space: Dict[str, Dict[str, Any]], entry: Dict[str, Any]) -> bool:
+    blob = space["blobs"].get(entry["hash"])
+    return not blob or not Path(blob["path"]).is_file()
+
+
+def _local_path(space: Dict[str, Dict[str, Any]], url: str) -> Optional[str]:
+    entry = space["urls"].get(url)
+    return space["blobs"][entry["hash"]]["path"] if entry else None
+
+
+async def _download(url: str, space: Dict[str, Dict[str, Any]], namespace: str, http: httpx.AsyncClient, logger: logging.Logger) -> None:
+    """Fetch one image, revalidating with ETag/Last-Modified when we already hold a copy."""
+    entry = space["urls"].get(url)
+    headers = {}
+
+    # Without the file on disk a 304 would leave nothing to serve, so ask for the full image
+    if entry and not _blob_missing(space, entry):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    with span("image", "network", url=url, revalidate=bool(headers)) as attrs:
+        response = await http.get(url, headers=headers, follow_redirects=True)
+        attrs["status"] = response.status_code
+        attrs["bytes"] = len(response.content)
+
+    if response.status_code == 304 and entry:
+        logger.debug(f"Image not modified: {url}")
+        entry["checked"] = now().isoformat()
+        return
+
+    response.raise_for_status()
+    digest = _store(space, namespace, url, response.content)
+
+    if not entry or entry.get("hash") != digest:
+        logger.info(f"Downloaded image: {space['blobs'][digest]['path']}")
+
+    space["urls"][url] = {
+        **(entry or {}),
+        "hash": digest,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "checked": now().isoformat(),
+    }
+
+
+@traced(category="file")
+def _build_derivatives(manifest: Dict[str, Any], referenced: Dict[str, List[str]], logger: logging.Logger) -> None:
+    for namespace, urls in referenced.items():
+        space = _namespace(manifest, namespace)
+        for digest in {space["urls"][url]["hash"] for url in urls if url in space["urls"]}:
+            make_derivatives(digest, space["blobs"][digest], atomic_write, logger)
+
+
+def _touch(entry: Dict[str, Any]) -> None:
+    # Only refresh reference times once they are half way to eviction, so a
+    # daily run does not rewrite the manifest just to bump timestamps.
+    if _older_than(entry.get("last_referenced"), IMAGE_GC_GRACE_DAYS / 2):
+        entry["last_referenced"] = now().isoformat()
+
+
+def _touch_local_paths(manifest: Dict[str, Any], paths: Iterable[str]) -> None:
+    """Mark the urls behind local paths a snapshot still links to as referenced.
+
+    Sections carried forward from an earlier run already hold data/images/
+    paths instead of remote URLs, so nothing else would keep their blobs alive."""
+    paths = set(paths)
+    if not paths:
+        return
+
+    for space in manifest["namespaces"].values():
+        linked = {
+            digest for digest, blob in space["blobs"].items()
+            if blob["path"] in paths or any(d["path"] in paths for d in blob.get("derivatives", []))
+        }
+        for entry in space["urls"].values():
+            if entry["hash"] in linked:
+                _touch(entry)
+
+
+def collect_garbage(manifest: Dict[str, Any], grace_days: int = IMAGE_GC_GRACE_DAYS, logger: Optional[logging.Logger] = None,
+                    keep: Iterable[str] = ()) -> None:
+    """Evict urls not referenced for `grace_days`, then delete blobs and stray files nothing points to.
+
+    Files listed in `keep` (local paths still linked from stats.json) are never deleted."""
+    logger = logger or logging.getLogger("collect_garbage")
+    tracked = set(RESERVED_FILES)
+    keep = {Path(path) for path in keep}
+
+    for namespace, space in manifest["namespaces"].items():
+        for url, entry in list(space["urls"].items()):
+            if _older_than(entry.get("last_referenced"), grace_days):
+                logger.info(f"Evicting unreferenced {namespace} image: {url}")
+                del space["urls"][url]
+
+        live = {entry["hash"] for entry in space["urls"].values()}
+
+        for digest, blob in list(space["blobs"].items()):
+            if digest not in live and Path(blob["path"]) not in keep:
+                Path(blob["path"]).unlink(missing_ok=True)
+                for derivative in blob.get("derivatives", []):
+                    Path(derivative["path"]).unlink(missing_ok=True)
+                del space["blobs"][digest]
+                continue
+
+            tracked.add(Path(blob["path"]))
+            tracked.update(Path(d["path"]) for d in blob.get("derivatives", []))
+
+    # Untracked files (e.g. icons nothing has asked for since the manifest) get the
+    # same grace period; derivatives can always be rebuilt, so stray ones go at once.
+    orphans = {}
+
+    for path in IMAGE_DIR.rglob("*") if IMAGE_DIR.is_dir() else []:
+        if not path.is_file() or path in tracked or path in keep or path.name.startswith("."):
+            continue
+
+        if path.parent.name == "thumbs":
+            path.unlink()
+            continue
+
+        key = path.relative_to(IMAGE_DIR).as_posix()
+        first_seen = manifest["orphans"].get(key, now().isoformat())
+        if _older_than(first_seen, grace_days):
+            logger.info(f"Removing untracked image: {key}")
+            path.unlink()
+        else:
+            orphans[key] = first_seen
+
+    manifest["orphans"] = orphans
+
+
+async def download_images(referenced: Dict[str, Iterable[str]], http: httpx.AsyncClient, logger: Optional[logging.Logger] = None,
+                          local_paths: Iterable[str] = ()) -> Dict[str, Dict[str, str]]:
+    """Download image URLs into their per-game namespaces with bounded concurrency.
+
+    `referenced` maps a namespace (e.g. "hsr") to the URLs it uses this run.
+    Images are stored once per distinct content hash and looked up through the
+    manifest rather than the filesystem. Cached copies are trusted for
+    IMAGE_REVALIDATE_DAYS and then revalidated with a conditional request.
+    Returns namespace -> url -> local relative path; a URL that was never
+    fetched successfully falls back to the remote URL. `local_paths` are
+    data/images/ paths the snapshot already links to; they count as referenced
+    too and survive garbage collection."""
+    logger = logger or logging.getLogger("download_images")
+    manifest = load_manifest()
+    original = json.dumps(manifest, sort_keys=True)
+    semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    referenced = {
+        namespace: list(dict.fromkeys(url for url in urls if url))
+        for namespace, urls in referenced.items()
+    }
+
+    for namespace, urls in referenced.items():
+        space = _namespace(manifest, namespace)
+        for url in urls:
+            # Adopt icons saved under their url name before the manifest existed
+            if url not in space["urls"]:
+                _adopt(space, namespace, url, _legacy_path(url))
+
+    async def fetch(namespace: str, url: str) -> None:
+        space = _namespace(manifest, namespace)
+        entry = space["urls"].get(url)
+        if entry and not _older_than(entry.get("checked"), IMAGE_REVALIDATE_DAYS) and not _blob_missing(space, entry):
+            return
+
+        async with semaphore:
+            try:
+                await _download(url, space, namespace, http, logger)
+            except Exception as e:
+                logger.warning(f"Failed to download image {url}: {e}")
+
+    await asyncio.gather(*(
+        fetch(namespace, url)
+        for namespace, urls in referenced.items()
+        for url in urls
+    ))
+
+    # Resizing and encoding is CPU-bound, keep it off the event loop
+    await asyncio.to_thread(_build_derivatives, manifest, referenced, logger)
+
+    for namespace, urls in referenced.items():
+        space = _namespace(manifest, namespace)
+        for url in urls:
+            entry = space["urls"].get(url)
+            if entry:
+                _touch(entry)
+
+    local_paths = list(local_paths)
+    _touch_local_paths(manifest, local_paths)
+    collect_garbage(manifest, logger=logger, keep=local_paths)
+
+    if json.dumps(manifest, sort_keys=True) != original:
+        save_manifest(manifest)
+
+    return {
+        namespace: {url: _local_path(_namespace(manifest, namespace), url) or url for url in urls}
+        for namespace, urls in referenced.items()
+    }
+
+
+# ------------------------
+# Snapshots
+# ------------------------
+
+def _walk_strings(value: Any, visit) -> Any:
+    """Rebuild a JSON-like value with every string passed through `visit`."""
+    if isinstance(value, dict):
+        return {key: _walk_strings(item, visit) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_walk_strings(item, visit) for item in value]
+    if isinstance(value, str):
+        return visit(value)
+    return value
+
+
+def _is_image_url(value: str) -> bool:
+    return value.startswith(("http://", "https://")) and value.split("?")[0].lower().endswith(IMAGE_SUFFIXES)
+
+
+async def localize_snapshot(snapshot: Dict[str, Any], http: httpx.AsyncClient, logger: Optional[logging.Logger] = None) -> Dict[str, Any]:
+    """Return a copy of the stats snapshot with every remote image URL replaced by its local copy.
+
+    Sections are mapped to cache namespaces by ASSET_NAMESPACES; sections not
+    listed there (e.g. attendance rewards, which Discord embeds link to) are
+    left untouched."""
+    logger = logger or logging.getLogger("localize_snapshot")
+    referenced: Dict[str, List[str]] = {}
+
+    for section, namespace in ASSET_NAMESPACES.items():
+        urls = referenced.setdefault(namespace, [])
+        _walk_strings(snapshot.get(section), lambda s: urls.append(s) if _is_image_url(s) else None)
+
+    # Carried-forward sections link to local copies already; keep those alive too
+    local = await download_images(referenced, http, logger, local_paths=referenced_images(snapshot))
+
+    localized = copy.copy(snapshot)
+    for section, namespace in ASSET_NAMESPACES.items():
+        if section in snapshot:
+            paths = local.get(namespace, {})
+            localized[section] = _walk_strings(snapshot[section], lambda s: paths.get(s, s))
+
+    return localized
+
+
+def referenced_images(snapshot: Any) -> List[str]:
+    """Every local data/images/ path mentioned anywhere in a stats snapshot."""
+    prefix = f"{IMAGE_DIR.as_posix()}/"
+    found = []
+    _walk_strings(snapshot, lambda s: found.append(s) if s.startswith(prefix) else None)
+    return list(dict.fromkeys(found))
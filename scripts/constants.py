@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
@@ -8,4 +8,118 @@ def now():
     """Return current time in the project timezone."""
     return datetime.now(TZ)
 
-IMAGE_DIR = Path("data/images")
\ No newline at end of file
+IMAGE_DIR = Path("data/images")
+
+# Deadline for the whole fan-out in main.main, and the tighter timeouts of the
+# sources that should give up before it (seconds). Every source starts at once,
+# so the deadline is what bounds the sources not listed here: the HoYoLAB
+# sections, which fetch several parts behind a shared request budget.
+RUN_DEADLINE = 90
+SOURCE_TIMEOUTS = {
+    "hsr_diary": 30,
+    "genshin_diary": 30,
+    "endfield_attendance": 30,
+    "endfield_data": 30,
+}
+
+# Maximum number of in-flight HoYoLAB requests shared by every stat fetcher
+HOYOLAB_CONCURRENCY = 4
+
+# Parallel image downloads, and how long a cached image is trusted before revalidating
+IMAGE_CONCURRENCY = 8
+IMAGE_REVALIDATE_DAYS = 7
+
+# Days an image may go unreferenced before it is evicted from data/images
+IMAGE_GC_GRACE_DAYS = 14
+
+# Widths of the WebP/AVIF thumbnails made for each cached image. The site shows
+# icons at 16px (weapons) and 72-76px (avatars), so these cover 1x and 2x screens.
+DERIVATIVE_WIDTHS = (32, 80, 160)
+DERIVATIVE_QUALITY = 80
+
+# stats.json sections whose image URLs are localized, and the cache namespace
+# (data/images/<namespace>/) each one downloads into
+ASSET_NAMESPACES = {
+    "hsr_data": "hsr",
+    "genshin_data": "genshin",
+    "endfield_data": "endfield",
+}
+
+# Untracked working state that persists between runs (restored by the workflow cache)
+CACHE_DIR = Path(".cache")
+
+# How long cached credentials are trusted; a rejected request re-authenticates anyway
+ENDFIELD_TOKEN_TTL_HOURS = 24
+HOYOLAB_COOKIE_TTL_DAYS = 30
+
+# Rolling windows (in diary rows, one per day) averaged by the diary analytics,
+# and the one the days-to-pity estimate is based on
+DIARY_WINDOWS = (7, 21, 30)
+DIARY_ESTIMATE_WINDOW = 21
+
+# How long each part of a game's stats.json section is trusted before it is
+# refetched; parts that are still fresh (or fail) keep their previous values.
+# Rosters are also refetched as soon as the character count moves. On live runs
+# rosters and endgame modes are read through the response cache instead, and
+# their TTL applies to the cache entry.
+SECTION_TTLS = {
+    "hsr_data": {
+        "profile": timedelta(hours=1),
+        "roster": timedelta(days=3),
+        "notes": timedelta(minutes=10),  # stamina, daily training
+        "anomaly_arbitration": timedelta(days=2),
+        "apocalyptic_shadow": timedelta(days=2),
+        "pure_fiction": timedelta(days=2),
+        "memory_of_chaos": timedelta(days=2),
+    },
+    "genshin_data": {
+        "profile": timedelta(hours=1),
+        "roster": timedelta(days=3),
+        "notes": timedelta(minutes=10),  # resin, commissions
+    },
+    "endfield_data": {
+        "card": timedelta(minutes=10),  # one request carries everything, incl. stamina
+    },
+}
+
+# Size bound of the parsed HoYoLAB responses in .cache/responses.json, trimmed
+# least recently used first. Cached parts (rosters, endgame modes) are read
+# through the cache every run and their SECTION_TTLS apply to the cache entry.
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 * 1024
+
+# stats.json sections that keep their previous value when their source fails
+CARRY_FORWARD_SECTIONS = ("hsr_data", "genshin_data", "endfield_data")
+
+# Time-series history of every snapshot, committed with the site data
+HISTORY_DB = Path("data/history.sqlite")
+
+# Per-section shards of stats.json, named by content hash, and their manifest
+STATS_DIR = Path("data/stats")
+
+# How many snapshot-to-snapshot JSON Patches are kept in data/stats/deltas/
+DELTA_WINDOW = 14
+
+# Run metrics: how many earlier runs the p50/p95 baseline covers, how many it
+# needs before flagging anything, and how far past it a timing must land to be
+# reported as a regression (above p95 and this many times p50, plus some slack
+# in seconds so sub-second jitter never alerts)
+RUN_METRICS_DB = CACHE_DIR / "runs.sqlite"  # kept out of data/ so runs never force a commit
+RUN_METRICS_WINDOW = 30
+RUN_METRICS_MIN_RUNS = 5
+RUN_REGRESSION_FACTOR = 2.0
+RUN_REGRESSION_SLACK = 1.0
+
+# `python main.py --profile` (or PROFILE=1): where the cProfile/tracemalloc
+# reports go, and how many rows each top-N table lists
+PROFILE_DIR = Path("profile")
+PROFILE_TOP = 30
+
+# Discord webhooks: attempts per message within a run, the first retry delay
+# (doubled on each attempt), the longest rate-limit wait worth sitting out, and
+# how long the end of a run waits for delivery (seconds). Undelivered messages
+# stay in the outbox and are retried by later runs for up to OUTBOX_MAX_AGE_DAYS.
+WEBHOOK_MAX_ATTEMPTS = 4
+WEBHOOK_BACKOFF = 2
+WEBHOOK_MAX_WAIT = 30
+WEBHOOK_FLUSH_TIMEOUT = 60
+OUTBOX_MAX_AGE_DAYS = 7
@@ -0,0 +1,89 @@
+import io
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, features
+
+from scripts.constants import DERIVATIVE_QUALITY, DERIVATIVE_WIDTHS
+
+# (Pillow format, file suffix, MIME type); AVIF only when this Pillow build can encode it
+FORMATS = [("WEBP", ".webp", "image/webp")]
+if features.check("avif"):
+    FORMATS.insert(0, ("AVIF", ".avif", "image/avif"))
+
+
+def _widths(source_width: int) -> List[int]:
+    """Target widths that fit the source; anything larger is capped at the source width."""
+    return sorted({min(width, source_width) for width in DERIVATIVE_WIDTHS})
+
+
+def _encode(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=DERIVATIVE_QUALITY)
+    return buffer.getvalue()
+
+
+def make_derivatives(digest: str, blob: Dict[str, Any], write, logger: Optional[logging.Logger] = None) -> None:
+    """Render the resized WebP/AVIF variants of one blob and record them on it.
+
+    `write(path, content)` is the caller's atomic writer. Blobs that already
+    carry derivatives for every width and format are left alone, so this is
+    cheap to call on every run."""
+    logger = logger or logging.getLogger("make_derivatives")
+
+    expected = {(fmt, width) for fmt, _, _ in FORMATS for width in _widths(blob.get("width") or 0)}
+    existing = {(d["format"], d["width"]) for d in blob.get("derivatives", [])}
+    if blob.get("width") and expected <= existing:
+        return
+
+    try:
+        with Image.open(blob["path"]) as source:
+            source.load()
+    except Exception as e:
+        logger.warning(f"Cannot read {blob['path']} for derivatives: {e}")
+        return
+
+    image = source if source.mode in ("RGB", "RGBA") else source.convert("RGBA")
+    blob["width"], blob["height"] = image.size
+
+    derivatives = []
+    for width in _widths(image.width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+        for fmt, suffix, mime in FORMATS:
+            # Variants sit in a thumbs/ folder next to the blob they were made from
+            path = f"{Path(blob['path']).parent.as_posix()}/thumbs/{digest[:32]}-{width}{suffix}"
+            if not Path(path).exists():
+                write(Path(path), _encode(resized, fmt))
+            derivatives.append({"path": path, "format": fmt, "type": mime, "width": width, "height": height})
+
+    blob["derivatives"] = derivatives
+    logger.debug(f"Derivatives ready for {blob['path']}: {len(derivatives)}")
+
+
+def describe_images(paths, manifest: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Map each local image path to its pixel size and derivatives, for stats.json."""
+    by_path = {
+        blob["path"]: blob
+        for space in manifest.get("namespaces", {}).values()
+        for blob in space["blobs"].values()
+    }
+    images = {}
+
+    for path in paths:
+        blob = by_path.get(path)
+        if not blob or not blob.get("width"):
+            continue
+
+        images[path] = {
+            "width": blob["width"],
+            "height": blob["height"],
+            "derivatives": [
+                {key: d[key] for key in ("path", "type", "width", "height")}
+                for d in blob.get("derivatives", [])
+            ],
+        }
+
+    return images
@@ -0,0 +1,177 @@
+import copy
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+Patch = List[Dict[str, Any]]
+
+
+def _escape(token: Any) -> str:
+    """JSON Pointer escaping (RFC 6901): "~" -> "~0", "/" -> "~1"."""
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def json_patch(old: Any, new: Any, path: str = "") -> Patch:
+    """RFC 6902 operations that turn `old` into `new`.
+
+    Objects are diffed key by key and arrays index by index (extra items are
+    appended or removed from the end), so one changed stat is one operation."""
+    if type(old) is not type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+
+    if isinstance(old, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                ops.extend(json_patch(old[key], value, f"{path}/{_escape(key)}"))
+        return ops
+
+    if isinstance(old, list):
+        ops = []
+        for i in range(min(len(old), len(new))):
+            ops.extend(json_patch(old[i], new[i], f"{path}/{i}"))
+        for i in range(len(old) - 1, len(new) - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+        for value in new[len(old):]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+        return ops
+
+    return [] if old == new else [{"op": "replace", "path": path, "value": new}]
+
+
+def apply_patch(document: Any, patch: Patch) -> Any:
+    """Apply the add/remove/replace operations produced by json_patch to a copy of `document`."""
+    document = copy.deepcopy(document)
+
+    for op in patch:
+        if not op["path"]:
+            document = copy.deepcopy(op["value"])
+            continue
+
+        *parents, last = [_unescape(token) for token in op["path"].split("/")[1:]]
+        target = document
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+
+        if isinstance(target, list):
+            if op["op"] == "add":
+                target.insert(len(target) if last == "-" else int(last), copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del target[int(last)]
+            else:
+                target[int(last)] = copy.deepcopy(op["value"])
+        elif op["op"] == "remove":
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(op["value"])
+
+    return document
+
+
+# ------------------------
+# Change sets (notifier)
+# ------------------------
+
+Path = Tuple[str, ...]
+
+
+def _number(value: Any) -> Optional[float]:
+    """The numeric value of a leaf, including numeric strings like Endfield's "38"; None otherwise."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else number
+    return None
+
+
+@dataclass(frozen=True)
+class Change:
+    path: Path
+    kind: str  # "added", "removed" or "changed"
+    old: Any = None
+    new: Any = None
+
+    @property
+    def delta(self) -> Optional[float]:
+        """new - old for a changed numeric leaf, None for anything else."""
+        if self.kind != "changed":
+            return None
+        old, new = _number(self.old), _number(self.new)
+        return None if old is None or new is None else new - old
+
+
+class ChangeSet:
+    """Every difference between two versions of a snapshot section, found in one walk.
+
+    Objects are compared key by key down to the leaves; a key present on one
+    side only (a newly pulled character) is a single added/removed change, and
+    lists are compared whole. Numeric strings compare by value, so "38" -> 38
+    is not a change. An empty new section (a failed fetch) has no changes."""
+
+    def __init__(self, old: Any, new: Any):
+        self.old = old or {}
+        self.new = new or {}
+        self.changes: Dict[Path, Change] = {}
+        if self.new:
+            self._walk(self.old, self.new, ())
+
+    def _walk(self, old: Any, new: Any, path: Path) -> None:
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in old:
+                if key not in new:
+                    self.changes[path + (key,)] = Change(path + (key,), "removed", old=old[key])
+            for key, value in new.items():
+                if key not in old:
+                    self.changes[path + (key,)] = Change(path + (key,), "added", new=value)
+                else:
+                    self._walk(old[key], value, path + (key,))
+            return
+
+        if old != new:
+            numbers = _number(old), _number(new)
+            if None in numbers or numbers[0] != numbers[1]:
+                self.changes[path] = Change(path, "changed", old, new)
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def __iter__(self) -> Iterator[Change]:
+        return iter(self.changes.values())
+
+    def get(self, *path: str) -> Optional[Change]:
+        return self.changes.get(path)
+
+    def stat(self, key: str, default: str = "N/A") -> str:
+        """A top-level value with its change since last time, e.g. "1634 (+3)"."""
+        value = self.new.get(key, default)
+        change = self.get(key)
+        delta = change.delta if change else None
+        return f"{value} ({delta:+})" if delta else str(value)
+
+    def grouped(self, key: str) -> Dict[str, List[Change]]:
+        """Changes under one mapping (e.g. a character roster), grouped by entry, in snapshot order."""
+        groups: Dict[str, List[Change]] = {}
+        for change in self.changes.values():
+            if len(change.path) > 1 and change.path[0] == key:
+                groups.setdefault(change.path[1], []).append(change)
+        return groups
+
+
+def snapshot_changes(old: Optional[Dict[str, Any]], new: Dict[str, Any], sections: List[str]) -> Dict[str, ChangeSet]:
+    """ChangeSet per stats.json section."""
+    old = old or {}
+    return {section: ChangeSet(old.get(section), new.get(section)) for section in sections}
@@ -1,51 +1,38 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
 import hashlib
 import hmac
 import logging
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 
-from scripts.constants import IMAGE_DIR, now
+from scripts.constants import ENDFIELD_TOKEN_TTL_HOURS, SECTION_TTLS, now
+from scripts.freshness import merge_parts, stale_parts
+from scripts.http_client import create_http_client
+from scripts.session_cache import SessionCache, credential_key
+from scripts.tracing import span
 
-def download_image(url: str, http: httpx.Client, logger: logging.Logger) -> str:
-    """Download an image from a URL into data/images/, return the local relative path.
-    If the image already exists locally, skip the download. Returns the original URL on failure."""
-    if not url:
-        return url
+class _EndfieldBase:
+    """Signing, token caching and response parsing, kept apart from the transport in AsyncEndfieldClient."""
 
-    filename = url.split("/")[-1]
-    local_path = IMAGE_DIR / filename
-    relative_path = f"data/images/{filename}"
-
-    if local_path.exists():
-        logger.debug(f"Image already cached: {filename}")
-        return relative_path
-
-    try:
-        IMAGE_DIR.mkdir(parents=True, exist_ok=True)
-        response = http.get(url, follow_redirects=True)
-        response.raise_for_status()
-        local_path.write_bytes(response.content)
-        logger.info(f"Downloaded image: {filename}")
-        return relative_path
-    except Exception as e:
-        logger.warning(f"Failed to download image {url}: {e}")
-        return url  # fall back to remote URL
-
-
-class EndfieldClient:
     BASE_URL = "https://zonai.skport.com"
+    REFRESH_EXT = "/web/v1/auth/refresh"
     ATTENDANCE_EXT = "/web/v1/game/endfield/attendance"
     CARD_EXT = "/api/v1/game/endfield/card/detail"
 
-    def __init__(self, cred: str, sk_game_role: str, timeout: int = 15):
+    # Response codes for a token (or the signature made with it) that is no longer accepted:
+    # 10000 request rejected (stale sign), 10002 "用户未登录" (not logged in)
+    AUTH_ERROR_CODES = {10000, 10002}
+
+    def __init__(self, cred: str, sk_game_role: str, session_cache: Optional[SessionCache] = None):
         self.cred = cred
         self.sk_game_role = sk_game_role
-        self.logger = logging.getLogger("EndfieldClient")
+        self.logger = logging.getLogger(type(self).__name__)
         self._token: Optional[str] = None
-        self._http = httpx.Client(timeout=timeout)
+        self._token_cached = False
+        self._session_cache = session_cache
 
     # ------------------------
     # Internal helpers
@@ -76,33 +63,41 @@ class EndfieldClient:
         ).hexdigest()
 
         return hashlib.md5(hmac_digest.encode()).hexdigest()
-    
-    def _refresh_token(self) -> None:
-        self.logger.info("Refreshing token...")
 
-        headers = {
+    def _refresh_headers(self) -> Dict[str, str]:
+        return {
             "cred": self.cred,
             "platform": "3",
             "vName": "1.0.0"
         }
 
-        res = self._http.get(
-            f"{self.BASE_URL}/web/v1/auth/refresh",
-            headers=headers
-        )
+    def _token_key(self) -> str:
+        return credential_key("endfield_token", self.cred)
 
-        data = res.json()
+    def _load_cached_token(self) -> bool:
+        if self._session_cache is None:
+            return False
 
+        token = self._session_cache.get(self._token_key())
+        if not token:
+            return False
+
+        self.logger.info("Reusing cached token.")
+        self._token = token
+        self._token_cached = True
+        return True
+
+    def _set_token(self, data: Dict[str, Any]) -> None:
         if data.get("code") != 0:
             raise Exception(data.get("message"))
 
         self._token = data["data"]["token"]
+        self._token_cached = False
 
-    def _request(self, method: str, path: str, *, body: str = "", extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-
-        if not self._token:
-            self._refresh_token()
+        if self._session_cache is not None:
+            self._session_cache.set(self._token_key(), self._token, timedelta(hours=ENDFIELD_TOKEN_TTL_HOURS))
 
+    def _signed_headers(self, path: str, body: str, extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
         timestamp = self._timestamp()
         sign = self._generate_sign(path, body, timestamp)
 
@@ -127,27 +122,13 @@ class EndfieldClient:
         if extra_headers:
             headers.update(extra_headers)
 
-        response = self._http.request(
-            method,
-            f"{self.BASE_URL}{path}",
-            headers=headers,
-            content=body if body else None
-        )
-
-        data = response.json()
-
-        return data
+        return headers
     
     # ------------------------
     # Attendance
     # ------------------------
     
-    def _check_attendance(self) -> Tuple[Dict[str, Any], bool]:
-        data = self._request(
-            "GET",
-            self.ATTENDANCE_EXT
-        )
-
+    def _parse_check(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
         if data.get("code") == 0:
             has_today = data.get("data", {}).get("hasToday", False)
 
@@ -161,12 +142,7 @@ class EndfieldClient:
             False
         )
     
-    def _claim_attendance(self):
-        data = self._request(
-            "POST",
-            self.ATTENDANCE_EXT
-        )
-
+    def _parse_claim(self, data: Dict[str, Any]):
         if data.get("code") == 0:
             self.logger.info("Successfully claimed attendance.")
 
@@ -190,10 +166,7 @@ class EndfieldClient:
         self.logger.error(f"Error: {data.get('message', 'Unknown error')}")
         return (False, [])
 
-        
-    def claim_attendance(self) -> Dict[str, Any]:
-        self.logger.info("Starting attendance claim...")
-
+    def _attendance_result(self, attendanceData: Dict[str, Any], canClaim: bool) -> Dict[str, Any]:
         result = {
             "status": "Error",
             "rewards": [],
@@ -203,8 +176,6 @@ class EndfieldClient:
             "error": None
         }
 
-        attendanceData, canClaim = self._check_attendance()
-
         if attendanceData.get("code") == 0 and attendanceData.get("data") is not None:
             data = attendanceData.get("data", {})
             calendar = data.get("calendar", [])
@@ -241,121 +212,240 @@ class EndfieldClient:
                             "icon": info["icon"]
                         }
 
-        if canClaim:
-            success, rewards = self._claim_attendance()
-
-            if success:
-                result["status"] = "Check-in Successful"
-                result["rewards"] = rewards
-                if result["attendance"]:
-                    if result.get("attendance", {}).get("totalSignIns") is not None:
-                        result["attendance"]["totalSignIns"] += 1
-                    
-                    firstNotDone = next(
-                        (r for r in result["attendance"]["calendar"] if not r.get("done")),
-                        None
-                    )
-                    if firstNotDone:
-                        firstNotDone["done"] = True
-
-                    # after marking the claimed day as done, find the new next award
-                    data = attendanceData.get("data", {})
-                    nextNotDone = next(
-                        (r for r in result["attendance"]["calendar"] if not r.get("done")),
-                        None
-                    )
-                    if nextNotDone:
-                        info = data.get("resourceInfoMap", {}).get(nextNotDone.get("awardId"))
-                        if info:
-                            result["nextAward"] = {
-                                "name": info["name"],
-                                "count": info["count"],
-                                "icon": info["icon"]
-                            }
-            else:
-                result["status"] = "Error"
-                result["error"] = "Failed to claim attendance"
-        
-        elif attendanceData.get("code") == 0:
+        return result
+
+    def _apply_claim(self, result: Dict[str, Any], attendanceData: Dict[str, Any], success: bool, rewards: List[Dict[str, Any]]) -> None:
+        if success:
+            result["status"] = "Check-in Successful"
+            result["rewards"] = rewards
+            if result["attendance"]:
+                if result.get("attendance", {}).get("totalSignIns") is not None:
+                    result["attendance"]["totalSignIns"] += 1
+                
+                firstNotDone = next(
+                    (r for r in result["attendance"]["calendar"] if not r.get("done")),
+                    None
+                )
+                if firstNotDone:
+                    firstNotDone["done"] = True
+
+                # after marking the claimed day as done, find the new next award
+                data = attendanceData.get("data", {})
+                nextNotDone = next(
+                    (r for r in result["attendance"]["calendar"] if not r.get("done")),
+                    None
+                )
+                if nextNotDone:
+                    info = data.get("resourceInfoMap", {}).get(nextNotDone.get("awardId"))
+                    if info:
+                        result["nextAward"] = {
+                            "name": info["name"],
+                            "count": info["count"],
+                            "icon": info["icon"]
+                        }
+        else:
+            result["status"] = "Error"
+            result["error"] = "Failed to claim attendance"
+
+    def _finish_attendance(self, result: Dict[str, Any], attendanceData: Dict[str, Any]) -> None:
+        if attendanceData.get("code") == 0:
             self.logger.info("Already signed in today. Nothing to claim.")
             result["status"] = "Already Claimed"
         
         else:
             self.logger.warning("Could not determine attendance status.")
             result["error"] = "Could not determine attendance status"
-        
-        return result
     
     # ------------------------
     # Data retrieval
     # ------------------------
-    def fetch_endfield_data(self, old_endfield):
-        self.logger.info("Starting to fetch endfield cards...")
-
-        data = self._request(
-            "GET",
-            self.CARD_EXT
-        )
 
+    def _card_detail(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         code = data.get("code")
 
         if code == 0:
-            detail = data.get("data", {}).get("detail", {})
-
-            def dl(url):
-                return download_image(url, self._http, self.logger)
-
-            six_stars = {
-                char.get("charData").get("name"): {
-                    "avatarSqUrl": dl(char.get("charData").get("avatarSqUrl")),
-                    "rarity": char.get("charData").get("rarity").get("value"),
-                    "potential": char.get("potentialLevel"),
-                    "profession": char.get("charData").get("profession").get("value"),
-                    "property": char.get("charData").get("property").get("value"),
-                    "weaponType": char.get("charData").get("weaponType").get("value"),
-                    "level": char.get("level"),
-                    "weapon": {
-                        "name": char.get("weapon").get("weaponData").get("name"),
-                        "iconUrl": dl(char.get("weapon").get("weaponData").get("iconUrl")),
-                        "rarity": char.get("weapon").get("weaponData").get("rarity").get("value"),
-                        "type": char.get("weapon").get("weaponData").get("type").get("value"),
-                        "level": char.get("weapon").get("level"),
-                        "refineLevel": char.get("weapon").get("refineLevel"),
-                    } if char.get("weapon") else None
-                }
-                for char in detail.get("chars")
+            return data.get("data", {}).get("detail", {})
+
+        self.logger.warning(f"Unexpected response code: {code}")
+        return None
+
+    def _parse_card(self, detail: Dict[str, Any], old_endfield) -> Dict[str, Any]:
+        six_stars = {
+            char.get("charData").get("name"): {
+                "avatarSqUrl": char.get("charData").get("avatarSqUrl"),
+                "rarity": char.get("charData").get("rarity").get("value"),
+                "potential": char.get("potentialLevel"),
+                "profession": char.get("charData").get("profession").get("value"),
+                "property": char.get("charData").get("property").get("value"),
+                "weaponType": char.get("charData").get("weaponType").get("value"),
+                "level": char.get("level"),
+                "weapon": {
+                    "name": char.get("weapon").get("weaponData").get("name"),
+                    "iconUrl": char.get("weapon").get("weaponData").get("iconUrl"),
+                    "rarity": char.get("weapon").get("weaponData").get("rarity").get("value"),
+                    "type": char.get("weapon").get("weaponData").get("type").get("value"),
+                    "level": char.get("weapon").get("level"),
+                    "refineLevel": char.get("weapon").get("refineLevel"),
+                } if char.get("weapon") else None
             }
+            for char in detail.get("chars")
+        }
 
-            domains = detail.get("domain")
-            aurylenes = 0
-            crates = 0
-
-            for domain in domains:
-                levels = domain.get("levels", {})
-                for level in levels:
-                    aurylenes += level.get("puzzleCount", {}).get("count", 0)
-                    crates += level.get("trchestCount", {}).get("count", 0)
-
-            return {
-                "nickname": detail.get("base").get("name"),
-                "level": detail.get("base").get("level"),
-                "avatar_url": dl(detail.get("base").get("avatarUrl")),
-
-                "achievements": detail.get("achieve").get("count"),
-                "active_days": get_total_days_login(old_endfield, detail.get("dailyMission").get("dailyActivation")),
-                "avatar_count": detail.get("base").get("charNum"),
-                "aurylenes": aurylenes,
-                "chest_count": crates,
-                "six_star_characters": six_stars,
-
-                "stamina": detail.get("dungeon").get("curStamina"),
-                "daily_mission": detail.get("dailyMission").get("dailyActivation"),
-                "last_updated": get_last_updated(old_endfield, detail.get("dailyMission").get("dailyActivation"))
-            }
-        
+        domains = detail.get("domain")
+        aurylenes = 0
+        crates = 0
+
+        for domain in domains:
+            levels = domain.get("levels", {})
+            for level in levels:
+                aurylenes += level.get("puzzleCount", {}).get("count", 0)
+                crates += level.get("trchestCount", {}).get("count", 0)
+
+        return {
+            "nickname": detail.get("base").get("name"),
+            "level": detail.get("base").get("level"),
+            "avatar_url": detail.get("base").get("avatarUrl"),
+
+            "achievements": detail.get("achieve").get("count"),
+            "active_days": get_total_days_login(old_endfield, detail.get("dailyMission").get("dailyActivation")),
+            "avatar_count": detail.get("base").get("charNum"),
+            "aurylenes": aurylenes,
+            "chest_count": crates,
+            "six_star_characters": six_stars,
+
+            "stamina": detail.get("dungeon").get("curStamina"),
+            "daily_mission": detail.get("dailyMission").get("dailyActivation"),
+            "last_updated": get_last_updated(old_endfield, detail.get("dailyMission").get("dailyActivation"))
+        }
+
+
+class AsyncEndfieldClient(_EndfieldBase):
+    """Non-blocking Endfield client on a pooled HTTP/2 connection.
+
+    Use it as an async context manager so the connection pool is always closed:
+
+        async with AsyncEndfieldClient(cred, role) as client:
+            attendance = await client.claim_attendance()
+    """
+
+    def __init__(self, cred: str, sk_game_role: str, timeout: int = 15, http: Optional[httpx.AsyncClient] = None, session_cache: Optional[SessionCache] = None):
+        super().__init__(cred, sk_game_role, session_cache)
+        self._token_lock = asyncio.Lock()
+        # Only close the pool on exit if we created it
+        self._owns_http = http is None
+        self._http = http or create_http_client(timeout)
+
+    async def __aenter__(self) -> "AsyncEndfieldClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._owns_http:
+            await self._http.aclose()
+
+    async def _refresh_token(self) -> None:
+        self.logger.info("Refreshing token...")
+
+        with span(self.REFRESH_EXT, "network") as attrs:
+            res = await self._http.get(
+                f"{self.BASE_URL}{self.REFRESH_EXT}",
+                headers=self._refresh_headers()
+            )
+            attrs["bytes"] = len(res.content)
+
+        self._set_token(res.json())
+
+    async def _send(self, method: str, path: str, body: str, extra_headers: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        with span(f"{method} {path}", "network") as attrs:
+            response = await self._http.request(
+                method,
+                f"{self.BASE_URL}{path}",
+                headers=self._signed_headers(path, body, extra_headers),
+                content=body if body else None
+            )
+            attrs["status"] = response.status_code
+            attrs["http_version"] = response.http_version
+            attrs["bytes"] = len(response.content)
+
+        with span(f"parse {path}", "parse"):
+            return response.json()
+
+    async def _request(self, method: str, path: str, *, body: str = "", extra_headers: Optional[Dict[str, str]] = None,
+                       resend: bool = True) -> Dict[str, Any]:
+        """Signed request. `resend=False` for non-idempotent calls: a rejected cached token is
+        still replaced, but the request itself is not sent a second time."""
+
+        # Attendance and card fetches run as concurrent tasks; refresh only once
+        async with self._token_lock:
+            if not self._token and not self._load_cached_token():
+                await self._refresh_token()
+
+        token, cached = self._token, self._token_cached
+        data = await self._send(method, path, body, extra_headers)
+
+        # A token from an earlier run may have been revoked; re-authenticate once and retry.
+        # Other errors (e.g. 10001 "already signed in") are answers, not auth problems.
+        if data.get("code") in self.AUTH_ERROR_CODES and cached:
+            async with self._token_lock:
+                if self._token == token:
+                    self.logger.info(f"Cached token rejected ({data.get('message')}), re-authenticating...")
+                    self._session_cache.invalidate(self._token_key())
+                    await self._refresh_token()
+
+            if not resend:
+                self.logger.warning(f"Not resending {method} {path} after the token was rejected")
+                return data
+
+            with span(f"retry {path}", "retry"):
+                data = await self._send(method, path, body, extra_headers)
+
+        return data
+
+    # ------------------------
+    # Attendance
+    # ------------------------
+
+    async def _check_attendance(self) -> Tuple[Dict[str, Any], bool]:
+        return self._parse_check(await self._request("GET", self.ATTENDANCE_EXT))
+
+    async def _claim_attendance(self):
+        # Claiming is not idempotent: never sent twice automatically
+        return self._parse_claim(await self._request("POST", self.ATTENDANCE_EXT, resend=False))
+
+    async def claim_attendance(self) -> Dict[str, Any]:
+        self.logger.info("Starting attendance claim...")
+
+        attendanceData, canClaim = await self._check_attendance()
+        result = self._attendance_result(attendanceData, canClaim)
+
+        if canClaim:
+            success, rewards = await self._claim_attendance()
+            self._apply_claim(result, attendanceData, success, rewards)
         else:
-            self.logger.warning(f"Unexpected response code: {code}")
-            return {}
+            self._finish_attendance(result, attendanceData)
+
+        return result
+
+    # ------------------------
+    # Data retrieval
+    # ------------------------
+    async def fetch_endfield_data(self, old_endfield):
+        if not stale_parts(old_endfield, SECTION_TTLS["endfield_data"]):
+            self.logger.info("Endfield card fetched recently, keeping it")
+            return old_endfield
+
+        self.logger.info("Starting to fetch endfield cards...")
+
+        detail = self._card_detail(await self._request("GET", self.CARD_EXT))
+        if detail is None:
+            # Reported as a failed source; main.py keeps the previous card
+            raise RuntimeError("Endfield card request was rejected")
+
+        with span("parse card", "parse"):
+            return merge_parts(old_endfield, {"card": self._parse_card(detail, old_endfield)})
+
         
 def get_last_updated(old_endfield, daily_mission):
     """Update last_updated timestamp only if we're counting a new active day."""
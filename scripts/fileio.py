@@ -0,0 +1,31 @@
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write(path: Path, content: bytes, mode: int = 0o644) -> None:
+    """Write through a temp file in the same folder and rename, so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.chmod(tmp, mode)  # mkstemp creates 0600 files, the site needs them readable
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_if_changed(path: Path, content: bytes) -> bool:
+    """Atomically write `path` unless it already holds exactly `content`; returns whether it wrote."""
+    path = Path(path)
+    try:
+        if path.stat().st_size == len(content) and path.read_bytes() == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    atomic_write(path, content)
+    return True
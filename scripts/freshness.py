@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from scripts.constants import CACHE_DIR, now
+from scripts.fileio import write_if_changed
+
+# Key inside a game's section recording when each of its parts was last fetched
+FETCHED_AT = "fetched_at"
+
+# Where those fetch times are kept between runs. They are not published: a run
+# that only refreshed parts whose values did not change must not rewrite (and
+# commit) stats.json, yet has to remember that the parts are fresh again.
+FETCH_TIMES_FILE = CACHE_DIR / "fetched_at.json"
+
+
+def stale_parts(old_section: Optional[Dict[str, Any]], ttls: Dict[str, timedelta],
+                when: Optional[datetime] = None) -> List[str]:
+    """Parts of a section whose last fetch is older than their TTL (or that were never fetched)."""
+    when = when or now()
+    fetched_at = (old_section or {}).get(FETCHED_AT, {})
+    stale = []
+
+    for part, ttl in ttls.items():
+        last = fetched_at.get(part)
+        if not last or when - datetime.fromisoformat(last) >= ttl:
+            stale.append(part)
+
+    return stale
+
+
+async def fetch_parts(fetchers: Dict[str, Callable[[], Awaitable[Dict[str, Any]]]], parts: Iterable[str],
+                      logger: logging.Logger) -> Dict[str, Dict[str, Any]]:
+    """Run the requested part fetchers concurrently. A part that fails is logged and left out."""
+    names = [part for part in fetchers if part in parts]
+    results = await asyncio.gather(*(fetchers[part]() for part in names), return_exceptions=True)
+    fetched = {}
+
+    for part, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to fetch {part}, keeping the last good values", exc_info=result)
+        else:
+            fetched[part] = result
+
+    return fetched
+
+
+def merge_parts(old_section: Optional[Dict[str, Any]], fetched: Dict[str, Dict[str, Any]],
+                when: Optional[datetime] = None) -> Dict[str, Any]:
+    """The previous section with every freshly fetched part laid over it and tagged with its fetch time."""
+    when = (when or now()).isoformat()
+    section = dict(old_section or {})
+    fetched_at = dict(section.get(FETCHED_AT, {}))
+
+    for part, values in fetched.items():
+        section.update(values)
+        fetched_at[part] = when
+
+    section[FETCHED_AT] = fetched_at
+    return section
+
+
+# ------------------------
+# Persistence
+# ------------------------
+
+def split_fetch_times(snapshot: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, str]]]:
+    """The snapshot without any section's fetch times, and those times by section."""
+    published, times = dict(snapshot), {}
+    for name, section in snapshot.items():
+        if isinstance(section, dict) and FETCHED_AT in section:
+            times[name] = section[FETCHED_AT]
+            published[name] = {key: value for key, value in section.items() if key != FETCHED_AT}
+    return published, times
+
+
+def with_fetch_times(snapshot: Optional[Dict[str, Any]], path: Path = FETCH_TIMES_FILE) -> Dict[str, Any]:
+    """The published snapshot with the fetch times saved by the last run put back into its sections."""
+    try:
+        with open(path, "r") as f:
+            times = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        times = {}
+
+    state = dict(snapshot or {})
+    for name, fetched_at in times.items():
+        if isinstance(state.get(name), dict):
+            state[name] = {**state[name], FETCHED_AT: fetched_at}
+    return state
+
+
+def save_fetch_times(times: Dict[str, Dict[str, str]], path: Path = FETCH_TIMES_FILE) -> None:
+    write_if_changed(path, json.dumps(times, indent=2, sort_keys=True).encode())
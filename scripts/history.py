@@ -0,0 +1,155 @@
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from scripts.constants import HISTORY_DB, TZ, now
+
+# stats.json section -> (game, metric prefix) it is recorded under
+HISTORY_SECTIONS = {
+    "hsr_data": ("hsr", ""),
+    "hsr_diary": ("hsr", "diary/"),
+    "genshin_data": ("genshin", ""),
+    "genshin_diary": ("genshin", "diary/"),
+    "endfield_data": ("endfield", ""),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    game   TEXT    NOT NULL,
+    metric TEXT    NOT NULL,
+    ts     INTEGER NOT NULL,  -- unix seconds
+    value  REAL    NOT NULL,
+    PRIMARY KEY (game, metric, ts)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS samples_by_time ON samples (game, ts);
+"""
+
+Sample = Tuple[datetime, float]
+
+
+def flatten_metrics(section: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """Yield (metric, value) for every numeric leaf, e.g. "five_star_characters/Robin/eidolon".
+
+    Lists (floor line-ups, calendars) are skipped: they are not a time series."""
+    if isinstance(section, dict):
+        for key, value in section.items():
+            yield from flatten_metrics(value, f"{prefix}{key}/")
+    elif isinstance(section, (int, float)) and not isinstance(section, bool):
+        yield prefix.rstrip("/"), float(section)
+
+
+def _ts(when: Optional[datetime]) -> int:
+    return int((when or now()).timestamp())
+
+
+def _datetime(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, TZ)
+
+
+class HistoryStore:
+    """SQLite history of every numeric stat, keyed by game, metric and time.
+
+    Only changes are stored: a sample is written when a metric differs from
+    its latest value, so a metric's history is the list of points where it
+    moved and its value at any time is the latest sample at or before it."""
+
+    def __init__(self, path: Path = HISTORY_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger("HistoryStore")
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------
+    # Writes
+    # ------------------------
+
+    def record(self, snapshot: Dict[str, Any], when: Optional[datetime] = None) -> int:
+        """Append one snapshot; returns how many samples changed. Empty (failed) sections are skipped."""
+        ts = _ts(when)
+        latest = self._latest_values()
+        rows = []
+
+        for section, (game, prefix) in HISTORY_SECTIONS.items():
+            if not snapshot.get(section):
+                continue
+
+            for metric, value in flatten_metrics(snapshot[section], prefix):
+                if latest.get((game, metric)) != value:
+                    rows.append((game, metric, ts, value))
+
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)", rows)
+
+        self.logger.info(f"Recorded {len(rows)} changed metrics")
+        return len(rows)
+
+    def _latest_values(self) -> Dict[Tuple[str, str], float]:
+        query = """
+            SELECT game, metric, value FROM samples AS s
+            WHERE ts = (SELECT MAX(ts) FROM samples WHERE game = s.game AND metric = s.metric)
+        """
+        return {(game, metric): value for game, metric, value in self.db.execute(query)}
+
+    # ------------------------
+    # Queries
+    # ------------------------
+
+    def metrics(self, game: str, prefix: str = "") -> List[str]:
+        query = "SELECT DISTINCT metric FROM samples WHERE game = ? AND metric LIKE ? ORDER BY metric"
+        return [row[0] for row in self.db.execute(query, (game, f"{prefix}%"))]
+
+    def range(self, game: str, metric: str, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[Sample]:
+        """Samples of one metric between `start` and `end` (inclusive), oldest first."""
+        query = "SELECT ts, value FROM samples WHERE game = ? AND metric = ? AND ts BETWEEN ? AND ? ORDER BY ts"
+        bounds = (_ts(start) if start else 0, _ts(end) if end else 2**62)
+        return [(_datetime(ts), value) for ts, value in self.db.execute(query, (game, metric, *bounds))]
+
+    def latest(self, game: str, metric: str, n: int = 1) -> List[Sample]:
+        """The last `n` samples of one metric, newest first."""
+        query = "SELECT ts, value FROM samples WHERE game = ? AND metric = ? ORDER BY ts DESC LIMIT ?"
+        return [(_datetime(ts), value) for ts, value in self.db.execute(query, (game, metric, n))]
+
+    def value_at(self, game: str, metric: str, when: datetime) -> Optional[float]:
+        query = "SELECT value FROM samples WHERE game = ? AND metric = ? AND ts <= ? ORDER BY ts DESC LIMIT 1"
+        row = self.db.execute(query, (game, metric, _ts(when))).fetchone()
+        return row[0] if row else None
+
+    def delta(self, game: str, metric: str, since: datetime) -> Optional[float]:
+        """How much a metric moved since `since`; None if it has no history at all.
+
+        A metric first seen after `since` is measured from its first sample."""
+        latest = self.latest(game, metric)
+        if not latest:
+            return None
+        before = self.value_at(game, metric, since)
+        if before is None:
+            before = self.range(game, metric, start=since)[0][1]
+        return latest[0][1] - before
+
+    def deltas(self, game: str, metrics: List[str], since: datetime) -> Dict[str, Optional[float]]:
+        return {metric: self.delta(game, metric, since) for metric in metrics}
+
+
+if __name__ == "__main__":
+    # Seed the history from the committed snapshot:
+    #   python -m scripts.history
+    with open("data/stats.json", "r") as f:
+        snapshot = json.load(f)
+
+    with HistoryStore() as history:
+        history.record(snapshot, datetime.fromisoformat(snapshot["last_updated"]))
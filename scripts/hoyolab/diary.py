@@ -1,19 +1,25 @@
+import asyncio
+import csv
+import io
 import logging
 import os
 from dataclasses import dataclass
+from datetime import datetime
 
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
-from scripts.constants import now
-
-THREE_WEEKS = 21
+from scripts.constants import DIARY_ESTIMATE_WINDOW, DIARY_WINDOWS, now
+from scripts.fileio import write_if_changed
+from scripts.hoyolab.diary_analytics import compute_analytics
+from scripts.hoyolab.diary_store import DiaryStore
+from scripts.tracing import span, traced
 
 HEADER_FILL = PatternFill("solid", start_color="1F4E79")
 HEADER_FONT = Font(bold=True, color="FFFFFF", name="Arial")
-INPUT_FONT = Font(color="0000FF", name="Arial")  # Blue = user-editable input
-FORMULA_FONT = Font(color="000000", name="Arial")  # Black = formula
+VALUE_FONT = Font(color="000000", name="Arial")
 ALT_FILL = PatternFill("solid", start_color="D6E4F0")
 THIN_BORDER = Border(
     left=Side(style="thin"),
@@ -27,6 +33,8 @@ THIN_BORDER = Border(
 class GameConfig:
     name: str
     xlsx_file: str
+    store_file: str
+    export_file: str
     currency_name: str
     pull_item_name: str
     pull_cost: int
@@ -38,6 +46,8 @@ class GameConfig:
 HSR_CONFIG = GameConfig(
     name="HSR",
     xlsx_file="data/hsr_diary_log.xlsx",
+    store_file="data/hsr_diary.csv",
+    export_file="data/hsr_diary_log.csv",
     currency_name="Stellar Jades",
     pull_item_name="Passes",
     pull_cost=160,
@@ -49,6 +59,8 @@ HSR_CONFIG = GameConfig(
 GENSHIN_CONFIG = GameConfig(
     name="Genshin",
     xlsx_file="data/genshin_diary_log.xlsx",
+    store_file="data/genshin_diary.csv",
+    export_file="data/genshin_diary_log.csv",
     currency_name="Primogems",
     pull_item_name="Fates",
     pull_cost=160,
@@ -57,9 +69,15 @@ GENSHIN_CONFIG = GameConfig(
     currency_attr="current_primogems",
 )
 
+# The CSV store (see diary_store.py) is the source of truth and the only file to
+# edit by hand (pull gains, pinned totals); the workbook and the flat CSV export
+# are views regenerated from it, with the rolling averages precomputed by
+# diary_analytics.py, so edits made in them are overwritten by the next run.
+#
 # Column layout (1-indexed):
 # A=Date, B=Net Currency Gain, C=Pulls Net Gain, D=currency_name, E=Pulls,
-# F=Total Pulls, G=Currency Needed for 5 Star, H=3-Week Avg Gain, I=Estimated Days Til 5 Star
+# F=Total Pulls, G=Currency Needed for 5 Star, H=3-Week Avg Gain, I=Estimated Days Til 5 Star,
+# then one "<n>-Day Avg Gain" column for each other window in DIARY_WINDOWS
 
 COL_DATE = 1
 COL_NET_CURRENCY = 2
@@ -71,13 +89,30 @@ COL_CURRENCY_NEEDED = 7
 COL_AVG_GAIN = 8
 COL_EST_DAYS = 9
 
+EXTRA_WINDOWS = [window for window in DIARY_WINDOWS if window != DIARY_ESTIMATE_WINDOW]
+
 
 def _col(n):
     return get_column_letter(n)
 
 
-def _apply_header(ws, currency_name):
-    headers = [
+def _styled(ws, value, font=None, fill=None, border=None, number_format=None, alignment=None):
+    cell = WriteOnlyCell(ws, value=value)
+    if font:
+        cell.font = font
+    if fill:
+        cell.fill = fill
+    if border:
+        cell.border = border
+    if number_format:
+        cell.number_format = number_format
+    if alignment:
+        cell.alignment = alignment
+    return cell
+
+
+def _headers(currency_name):
+    return [
         "Date",
         "Net Currency Gain",
         "Pulls Net Gain",
@@ -87,157 +122,251 @@ def _apply_header(ws, currency_name):
         "Currency Needed for 5 Star",
         "3-Week Avg Gain",
         "Estimated Days Til 5 Star",
+    ] + [f"{window}-Day Avg Gain" for window in EXTRA_WINDOWS]
+
+
+def _header_cells(ws, currency_name):
+    return [
+        _styled(ws, header, font=HEADER_FONT, fill=HEADER_FILL, border=THIN_BORDER, alignment=Alignment(horizontal="center"))
+        for header in _headers(currency_name)
     ]
-    for col, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = HEADER_FONT
-        cell.fill = HEADER_FILL
-        cell.alignment = Alignment(horizontal="center")
-        cell.border = THIN_BORDER
-
-    col_widths = [12, 20, 16, 18, 8, 14, 28, 18, 26]
-    for col, width in enumerate(col_widths, start=1):
-        ws.column_dimensions[_col(col)].width = width
 
 
-def _write_row_formulas(ws, row, pull_cost, five_star_pity):
+def _row_cells(ws, r, row, stats, pull_cost, five_star_pity):
     """
-    Write Excel formulas for a given data row.
-    Columns B (Net Currency Gain) and C (Pulls Net Gain) are left as plain
-    values (blue, user-editable inputs). All other calculated columns use
-    Excel formulas that auto-update when B or C is changed.
+    Build the cells for data row `r`.
+    Columns B (Net Currency Gain) and C (Pulls Net Gain) are plain values
+    copied from the store. D and E are pinned values when the store has a total for
+    that day, otherwise running-total formulas. The rolling averages (H and
+    the extra window columns) are values from compute_analytics; the other
+    columns stay cheap single-row formulas.
     """
-    r = row
-    prev_r = r - 1  # previous data row (or 0 if this is the first)
+    prev_r = r - 1  # previous data row (or 1 if this is the first)
+    values = {COL_DATE: row["Date"], COL_NET_CURRENCY: row["Net Currency Gain"], COL_PULLS_NET: row["Pulls Net Gain"]}
 
     # D: currency_name total = previous total + Net Currency Gain
-    if prev_r < 2:
-        ws.cell(r, COL_CURRENCY_TOTAL).value = f"={_col(COL_NET_CURRENCY)}{r}"
+    if row["Currency Total"] is not None:
+        values[COL_CURRENCY_TOTAL] = row["Currency Total"]
+    elif prev_r < 2:
+        values[COL_CURRENCY_TOTAL] = f"={_col(COL_NET_CURRENCY)}{r}"
     else:
-        ws.cell(r, COL_CURRENCY_TOTAL).value = (
-            f"={_col(COL_CURRENCY_TOTAL)}{prev_r}+{_col(COL_NET_CURRENCY)}{r}"
-        )
+        values[COL_CURRENCY_TOTAL] = f"={_col(COL_CURRENCY_TOTAL)}{prev_r}+{_col(COL_NET_CURRENCY)}{r}"
 
     # E: Pulls total = previous pulls total + Pulls Net Gain
-    if prev_r < 2:
-        ws.cell(r, COL_PULLS_TOTAL).value = f"={_col(COL_PULLS_NET)}{r}"
+    if row["Pulls Total"] is not None:
+        values[COL_PULLS_TOTAL] = row["Pulls Total"]
+    elif prev_r < 2:
+        values[COL_PULLS_TOTAL] = f"={_col(COL_PULLS_NET)}{r}"
     else:
-        ws.cell(r, COL_PULLS_TOTAL).value = (
-            f"={_col(COL_PULLS_TOTAL)}{prev_r}+{_col(COL_PULLS_NET)}{r}"
-        )
+        values[COL_PULLS_TOTAL] = f"={_col(COL_PULLS_TOTAL)}{prev_r}+{_col(COL_PULLS_NET)}{r}"
 
     # F: Total Pulls = D/pull_cost + E
-    ws.cell(r, COL_TOTAL_PULLS).value = (
-        f"={_col(COL_CURRENCY_TOTAL)}{r}/{pull_cost}+{_col(COL_PULLS_TOTAL)}{r}"
-    )
+    values[COL_TOTAL_PULLS] = f"={_col(COL_CURRENCY_TOTAL)}{r}/{pull_cost}+{_col(COL_PULLS_TOTAL)}{r}"
 
     # G: Currency Needed = MAX((pity - Total Pulls) * pull_cost, 0)
-    ws.cell(r, COL_CURRENCY_NEEDED).value = (
-        f"=MAX(({five_star_pity}-{_col(COL_TOTAL_PULLS)}{r})*{pull_cost},0)"
-    )
+    values[COL_CURRENCY_NEEDED] = f"=MAX(({five_star_pity}-{_col(COL_TOTAL_PULLS)}{r})*{pull_cost},0)"
 
-    # H: 3-Week Avg Gain (average of last THREE_WEEKS combined daily gains)
-    # Combined daily gain for each row = Net Currency Gain + Pulls Net Gain * pull_cost
-    # We build a helper column approach using SUMPRODUCT over the last 21 rows.
-    start_r = max(2, r - THREE_WEEKS + 1)
-    b_range = f"{_col(COL_NET_CURRENCY)}{start_r}:{_col(COL_NET_CURRENCY)}{r}"
-    c_range = f"{_col(COL_PULLS_NET)}{start_r}:{_col(COL_PULLS_NET)}{r}"
-    count = r - start_r + 1
-    ws.cell(r, COL_AVG_GAIN).value = (
-        f"=IF({count}>={THREE_WEEKS},"
-        f"SUMPRODUCT({b_range}+{c_range}*{pull_cost})/{THREE_WEEKS},"
-        f"0)"
-    )
+    # H: 3-Week Avg Gain, precomputed from a prefix sum of the daily gains
+    # (Net Currency Gain + Pulls Net Gain * pull_cost) instead of a per-row SUMPRODUCT
+    values[COL_AVG_GAIN] = stats["Avg Gain"][f"{DIARY_ESTIMATE_WINDOW}d"]
 
     # I: Estimated Days = Currency Needed / Avg Gain (guarded against div/0)
-    ws.cell(r, COL_EST_DAYS).value = (
+    values[COL_EST_DAYS] = (
         f"=IF({_col(COL_AVG_GAIN)}{r}>0,"
         f"{_col(COL_CURRENCY_NEEDED)}{r}/{_col(COL_AVG_GAIN)}{r},"
         f"0)"
     )
 
-    # Style calculated columns as black formula cells
-    for col in [
-        COL_CURRENCY_TOTAL,
-        COL_PULLS_TOTAL,
-        COL_TOTAL_PULLS,
-        COL_CURRENCY_NEEDED,
-        COL_AVG_GAIN,
-        COL_EST_DAYS,
-    ]:
-        cell = ws.cell(r, col)
-        cell.font = FORMULA_FONT
-        cell.border = THIN_BORDER
-        cell.number_format = "0.00"
-
-    # Style input columns as blue
-    for col in [COL_NET_CURRENCY, COL_PULLS_NET]:
-        cell = ws.cell(r, col)
-        cell.font = INPUT_FONT
-        cell.border = THIN_BORDER
-
     # Alternate row shading
-    if r % 2 == 0:
-        for col in range(1, 10):
-            ws.cell(r, col).fill = ALT_FILL
+    fill = ALT_FILL if r % 2 == 0 else None
 
-    # Date cell
-    ws.cell(r, COL_DATE).border = THIN_BORDER
+    # J onwards: the other rolling windows
+    for offset, window in enumerate(EXTRA_WINDOWS, start=1):
+        values[COL_EST_DAYS + offset] = stats["Avg Gain"][f"{window}d"]
 
-
-def _load_or_create_workbook(xlsx_file, currency_name):
-    if os.path.exists(xlsx_file):
-        return load_workbook(xlsx_file)
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Diary Log"
-    ws.freeze_panes = "A2"
-    _apply_header(ws, currency_name)
-    return wb
+    cells = []
+    for col in range(1, COL_EST_DAYS + len(EXTRA_WINDOWS) + 1):
+        number_format = None if col in (COL_DATE, COL_NET_CURRENCY, COL_PULLS_NET) else "0.00"
+        cells.append(_styled(ws, values[col], font=VALUE_FONT, fill=fill, border=THIN_BORDER, number_format=number_format))
+    return cells
 
 
-def _find_today_row(ws, today):
-    for row in ws.iter_rows(min_row=2, max_col=1, values_only=False):
-        cell = row[0]
-        if str(cell.value) == today:
-            return cell.row
-    return None
+@traced(category="file")
+def export_diary_xlsx(config: GameConfig, rows, analytics) -> None:
+    """Regenerate the styled workbook from the store rows in streaming (write-only) mode."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Diary Log")
+    ws.freeze_panes = "A2"
 
+    col_widths = [12, 20, 16, 18, 8, 14, 28, 18, 26] + [18] * len(EXTRA_WINDOWS)
+    for col, width in enumerate(col_widths, start=1):
+        ws.column_dimensions[_col(col)].width = width
 
-def _last_data_row(ws):
-    for r in range(ws.max_row, 1, -1):
-        if ws.cell(r, COL_DATE).value is not None:
-            return r
-    return 1  # only header exists
+    ws.append(_header_cells(ws, config.currency_name))
+    for r, (row, stats) in enumerate(zip(rows, analytics), start=2):
+        ws.append(_row_cells(ws, r, row, stats, config.pull_cost, config.five_star_pity))
+
+    tmp = f"{config.xlsx_file}.tmp"
+    wb.save(tmp)
+    os.replace(tmp, config.xlsx_file)
+
+
+@traced(category="file")
+def export_diary_csv(config: GameConfig, rows, analytics) -> None:
+    """Flat export with every column evaluated, for tools that cannot run the workbook formulas."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(_headers(config.currency_name))
+    for row, stats in zip(rows, analytics):
+        writer.writerow([
+            row["Date"],
+            row["Net Currency Gain"],
+            row["Pulls Net Gain"],
+            stats["Currency Total"],
+            stats["Pulls Total"],
+            stats["Total Pulls"],
+            stats["Currency Needed for 5 Star"],
+            stats["Avg Gain"][f"{DIARY_ESTIMATE_WINDOW}d"],
+            stats["Estimated Days Til 5 Star"],
+        ] + [stats["Avg Gain"][f"{window}d"] for window in EXTRA_WINDOWS])
+    write_if_changed(config.export_file, buffer.getvalue().encode())
+
+
+def export_diary(config: GameConfig, rows) -> list:
+    analytics = compute_analytics(rows, config.pull_cost, config.five_star_pity)
+    export_diary_xlsx(config, rows, analytics)
+    export_diary_csv(config, rows, analytics)
+    return analytics
+
+
+@traced(category="file")
+def _import_xlsx(config: GameConfig, store: DiaryStore) -> None:
+    """Seed the store from the legacy workbook, keeping any totals typed in as values."""
+    logger = logging.getLogger(f"update_{config.name.lower()}_diary")
+    wb = load_workbook(config.xlsx_file, read_only=True)
+    rows = {}
+
+    def pinned(value):
+        return None if value is None or isinstance(value, str) and value.startswith("=") else value
+
+    for values in wb.active.iter_rows(min_row=2, max_col=COL_PULLS_TOTAL, values_only=True):
+        date, currency_gain, pulls_gain, currency_total, pulls_total = values
+        if date is None:
+            continue
+        if isinstance(date, datetime):
+            date = date.strftime("%Y-%m-%d")
+
+        rows[str(date)] = {
+            "Date": str(date),
+            "Net Currency Gain": currency_gain or 0,
+            "Pulls Net Gain": pulls_gain or 0,
+            "Currency Total": pinned(currency_total),
+            "Pulls Total": pinned(pulls_total),
+        }
+
+    wb.close()
+    store.write_all(list(rows.values()))
+    logger.info(f"Imported {len(rows)} rows from {config.xlsx_file} into {config.store_file}.")
+
+
+@traced(category="file")
+def _import_legacy_export(config: GameConfig, store: DiaryStore) -> bool:
+    """Merge the rows of a pre-store CSV export (the 9-column layout without the
+    extra window columns) into the store before the export is regenerated over it.
+
+    Only dates the store lacks are added. Their totals are pinned wherever they
+    do not follow from the previous day, so the history reads exactly as it was
+    logged. Returns whether the store changed."""
+    if not os.path.exists(config.export_file):
+        return False
+
+    with open(config.export_file, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != _headers(config.currency_name)[:COL_EST_DAYS]:
+            return False  # already in the current layout
+        legacy = list(reader)
+
+    def number(value):
+        value = float(value or 0)
+        return int(value) if value.is_integer() else value
+
+    rows = {row["Date"]: row for row in store.rows()}
+    currency_total = pulls_total = 0
+    added = 0
+
+    for values in sorted(legacy):
+        date, currency_gain, pulls_gain, currency, pulls = values[:COL_PULLS_TOTAL]
+        currency_gain, pulls_gain, currency, pulls = map(number, (currency_gain, pulls_gain, currency, pulls))
+
+        if date not in rows:
+            rows[date] = {
+                "Date": date,
+                "Net Currency Gain": currency_gain,
+                "Pulls Net Gain": pulls_gain,
+                "Currency Total": None if currency == currency_total + currency_gain else currency,
+                "Pulls Total": None if pulls == pulls_total + pulls_gain else pulls,
+            }
+            added += 1
+        currency_total, pulls_total = currency, pulls
+
+    if not added:
+        return False
+
+    store.write_all(list(rows.values()))
+    logging.getLogger(f"update_{config.name.lower()}_diary").info(
+        f"Imported {added} rows from the legacy {config.export_file} into {config.store_file}."
+    )
+    return True
 
 
 async def update_diary_xlsx(client, uid, config: GameConfig):
-    logger = logging.getLogger(f"update_{config.name.lower()}_diary")
     os.makedirs("data", exist_ok=True)
 
-    diary = await config.diary_fetcher(client, uid)
-    day_data = diary.day_data
+    with span(f"get_{config.name.lower()}_diary", "network"):
+        diary = await config.diary_fetcher(client, uid)
     today = now().strftime("%Y-%m-%d")
-    currency_gain = getattr(day_data, config.currency_attr)
-
-    wb = _load_or_create_workbook(config.xlsx_file, config.currency_name)
-    ws = wb.active
-
-    # Remove today's row if it already exists (re-run scenario)
-    existing_today_row = _find_today_row(ws, today)
-    if existing_today_row:
-        ws.delete_rows(existing_today_row)
+    currency_gain = getattr(diary.day_data, config.currency_attr)
 
-    new_row = _last_data_row(ws) + 1
+    # Store update and workbook export are blocking file work (openpyxl); keep them off
+    # the event loop so the other sources keep running and the source timeout can fire
+    return await asyncio.to_thread(_record_day, config, today, currency_gain)
 
-    # Write date and the two user-editable input values
-    ws.cell(new_row, COL_DATE).value = today
-    ws.cell(new_row, COL_NET_CURRENCY).value = currency_gain
-    ws.cell(new_row, COL_PULLS_NET).value = 0
 
-    # Write all formula-driven columns
-    _write_row_formulas(ws, new_row, config.pull_cost, config.five_star_pity)
-
-    wb.save(config.xlsx_file)
-    logger.info(f"{config.name} diary updated successfully (row {new_row}).")
-    return {"Date": today, "Net Currency Gain": currency_gain, "Pulls Net Gain": 0}
\ No newline at end of file
+def _record_day(config: GameConfig, today: str, currency_gain):
+    """Upsert today's row, regenerate the views if anything moved, and return today's analytics."""
+    logger = logging.getLogger(f"update_{config.name.lower()}_diary")
+    store = DiaryStore(config.store_file)
+    if not store.exists() and os.path.exists(config.xlsx_file):
+        _import_xlsx(config, store)
+    imported = _import_legacy_export(config, store)
+
+    with span(f"{config.name} diary store", "file"):
+        row, changed = store.upsert(today, currency_gain)
+        rows = store.rows()
+    changed = changed or imported
+
+    # The workbook and export are derived: only rebuild them when the store moved or one is missing
+    if changed or not os.path.exists(config.xlsx_file) or not os.path.exists(config.export_file):
+        analytics = export_diary(config, rows)
+        logger.info(f"{config.name} diary updated successfully ({today}).")
+    else:
+        analytics = compute_analytics(rows, config.pull_cost, config.five_star_pity)
+        logger.info(f"{config.name} diary unchanged ({today}).")
+
+    return {
+        "Date": today,
+        "Net Currency Gain": row["Net Currency Gain"],
+        "Pulls Net Gain": row["Pulls Net Gain"],
+        **{key: value for key, value in analytics[-1].items() if key != "Date"},
+    }
+
+
+if __name__ == "__main__":
+    # Rebuild both workbooks on request, e.g. after editing a store by hand
+    # (data/<game>_diary.csv; the workbooks themselves are not read back):
+    #   python -m scripts.hoyolab.diary
+    for game in (HSR_CONFIG, GENSHIN_CONFIG):
+        store = DiaryStore(game.store_file)
+        _import_legacy_export(game, store)
+        export_diary(game, store.rows())
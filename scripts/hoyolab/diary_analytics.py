@@ -0,0 +1,49 @@
+from typing import Dict, List, Optional
+
+from scripts.constants import DIARY_ESTIMATE_WINDOW, DIARY_WINDOWS
+from scripts.tracing import traced
+
+
+def _round(value: float) -> float:
+    return round(value, 2)
+
+
+@traced(category="parse")
+def compute_analytics(rows: List[Dict[str, Optional[float]]], pull_cost: int, five_star_pity: int,
+                      windows=DIARY_WINDOWS) -> List[Dict[str, object]]:
+    """Running totals, rolling gains and days-to-pity for every diary row in one pass.
+
+    A day's gain is its currency gain plus its pull gain priced in currency.
+    Rolling averages come from a prefix sum of those gains, so each window costs
+    O(1) per row; a window that is not full yet reports 0, like the workbook
+    always has. Pinned totals in the store reset the running totals."""
+    prefix = [0]
+    currency_total = pulls_total = 0
+    analytics = []
+
+    for i, row in enumerate(rows):
+        prefix.append(prefix[-1] + row["Net Currency Gain"] + row["Pulls Net Gain"] * pull_cost)
+
+        currency_total = row["Currency Total"] if row["Currency Total"] is not None else currency_total + row["Net Currency Gain"]
+        pulls_total = row["Pulls Total"] if row["Pulls Total"] is not None else pulls_total + row["Pulls Net Gain"]
+
+        total_pulls = currency_total / pull_cost + pulls_total
+        currency_needed = max((five_star_pity - total_pulls) * pull_cost, 0)
+
+        averages = {
+            window: (prefix[i + 1] - prefix[i + 1 - window]) / window if i + 1 >= window else 0
+            for window in windows
+        }
+        average = averages.get(DIARY_ESTIMATE_WINDOW, 0)
+
+        analytics.append({
+            "Date": row["Date"],
+            "Currency Total": currency_total,
+            "Pulls Total": pulls_total,
+            "Total Pulls": _round(total_pulls),
+            "Currency Needed for 5 Star": _round(currency_needed),
+            "Avg Gain": {f"{window}d": _round(value) for window, value in averages.items()},
+            "Estimated Days Til 5 Star": _round(currency_needed / average) if average > 0 else 0,
+        })
+
+    return analytics
@@ -0,0 +1,180 @@
+import csv
+import io
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Date, the two daily inputs, and optional pinned running totals. A blank total
+# is derived from the previous row; a value pins it (opening balances, or
+# corrections after spending currency on pulls).
+FIELDS = ["Date", "Net Currency Gain", "Pulls Net Gain", "Currency Total", "Pulls Total"]
+
+# Bytes read per step when scanning backwards for the last line
+_TAIL_CHUNK = 1024
+
+
+def _parse(row: Dict[str, str]) -> Dict[str, Optional[float]]:
+    def number(value):
+        if value in (None, ""):
+            return None
+        value = float(value)
+        return int(value) if value.is_integer() else value
+
+    return {
+        "Date": row["Date"],
+        "Net Currency Gain": number(row["Net Currency Gain"]) or 0,
+        "Pulls Net Gain": number(row["Pulls Net Gain"]) or 0,
+        "Currency Total": number(row.get("Currency Total")),
+        "Pulls Total": number(row.get("Pulls Total")),
+    }
+
+
+def _format(row: Dict[str, Optional[float]]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(
+        "" if row.get(field) is None else row[field] for field in FIELDS
+    )
+    return buffer.getvalue()
+
+
+class DiaryStore:
+    """Line-oriented CSV diary, one row per day in date order.
+
+    Today's row is always the last line, so an upsert only has to look at the
+    tail of the file: it either appends or rewrites that single line. Reads of
+    arbitrary dates go through a date -> byte offset index built on first use."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.logger = logging.getLogger("DiaryStore")
+        self._index: Optional[Dict[str, int]] = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    # ------------------------
+    # Reads
+    # ------------------------
+
+    def rows(self) -> List[Dict[str, Optional[float]]]:
+        if not self.path.exists():
+            return []
+        with open(self.path, "r", newline="") as f:
+            return [_parse(row) for row in csv.DictReader(f)]
+
+    def index(self) -> Dict[str, int]:
+        """Map each date to the byte offset of its line."""
+        if self._index is None:
+            self._index = {}
+            if self.path.exists():
+                with open(self.path, "rb") as f:
+                    f.readline()  # header
+                    offset = f.tell()
+                    for line in iter(f.readline, b""):
+                        self._index[line.split(b",", 1)[0].decode()] = offset
+                        offset = f.tell()
+        return self._index
+
+    def get(self, date: str) -> Optional[Dict[str, Optional[float]]]:
+        offset = self.index().get(date)
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            line = f.readline().decode()
+        return _parse(dict(zip(FIELDS, next(csv.reader([line])))))
+
+    def _tail(self) -> Optional[Tuple[int, Dict[str, Optional[float]]]]:
+        """Offset and contents of the last data line, reading only the end of the file."""
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position, data = end, b""
+
+            # Grow the window backwards until it holds a full line before the trailing newline
+            while position > 0 and data.rstrip(b"\n").count(b"\n") < 1:
+                step = min(_TAIL_CHUNK, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+
+        body = data.rstrip(b"\n")
+        start = body.rfind(b"\n") + 1
+        line = body[start:].decode()
+
+        if position + start == 0 or line.startswith(FIELDS[0]):
+            return None  # only the header is present
+
+        return position + start, _parse(dict(zip(FIELDS, next(csv.reader([line])))))
+
+    # ------------------------
+    # Writes
+    # ------------------------
+
+    def write_all(self, rows: List[Dict[str, Optional[float]]]) -> None:
+        """Replace the whole store (used for migrations and out-of-order dates)."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".csv.tmp")
+        with open(tmp, "w", newline="") as f:
+            f.write(_format(dict(zip(FIELDS, FIELDS))))
+            for row in sorted(rows, key=lambda r: r["Date"]):
+                f.write(_format(row))
+        os.replace(tmp, self.path)
+        self._index = None
+
+    def upsert(self, date: str, currency_gain, pulls_gain=None) -> Tuple[Dict[str, Optional[float]], bool]:
+        """Insert or update the row for `date`, returning the row and whether the file changed.
+
+        Re-running on the same day only refreshes the currency gain; pulls and
+        pinned totals someone typed into the store are kept."""
+        if not self.path.exists():
+            self.write_all([])
+
+        tail = self._tail()
+        offset, last = tail if tail else (None, None)
+
+        if last and last["Date"] > date:
+            # Out of order (clock or timezone change): rare, fall back to a full rewrite
+            rows = {row["Date"]: row for row in self.rows()}
+            existing = rows.get(date)
+            row = self._merge(date, existing, currency_gain, pulls_gain)
+            if row == existing:
+                return row, False
+            rows[date] = row
+            self.write_all(list(rows.values()))
+            return row, True
+
+        existing = last if last and last["Date"] == date else None
+        row = self._merge(date, existing, currency_gain, pulls_gain)
+
+        if row == existing:
+            return row, False
+
+        with open(self.path, "r+b") as f:
+            if existing:
+                f.truncate(offset)
+            f.seek(0, os.SEEK_END)
+            # A hand-edited file may have lost its trailing newline; do not glue two rows together
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(_format(row).encode())
+
+        self._index = None
+        return row, True
+
+    @staticmethod
+    def _merge(date, existing, currency_gain, pulls_gain) -> Dict[str, Optional[float]]:
+        row = dict(existing) if existing else {
+            "Date": date,
+            "Net Currency Gain": 0,
+            "Pulls Net Gain": 0,
+            "Currency Total": None,
+            "Pulls Total": None,
+        }
+        row["Net Currency Gain"] = currency_gain
+        if pulls_gain is not None:
+            row["Pulls Net Gain"] = pulls_gain
+        return row
@@ -0,0 +1,70 @@
+import functools
+import logging
+from datetime import timedelta
+from typing import Any, Optional
+
+import genshin
+from genshin.client.manager import CookieManager, parse_cookie
+
+from scripts.constants import HOYOLAB_COOKIE_TTL_DAYS
+from scripts.session_cache import SessionCache, credential_key
+from scripts.tracing import span
+
+
+class PersistentCookieManager(CookieManager):
+    """Cookie manager that starts from cookies saved by an earlier run.
+
+    HoYoLAB hands out refreshed cookies on some responses; genshin.py merges
+    them into `cookies` in place. If the saved set is rejected we fall back to
+    the configured cookies and retry the request once."""
+
+    def __init__(self, cookies: str, cached: Optional[dict] = None, cassette=None):
+        self.base_cookies = parse_cookie(cookies)
+        self.using_cached = bool(cached)
+        super().__init__({**self.base_cookies, **cached} if cached else self.base_cookies)
+        self.logger = logging.getLogger("PersistentCookieManager")
+        self.cassette = cassette
+
+    def create_session(self, **kwargs: Any):
+        # genshin.py opens a session per request; a cassette records or replays each one
+        if self.cassette:
+            return self.cassette.wrap_session(functools.partial(super().create_session, **kwargs))
+        return super().create_session(**kwargs)
+
+    async def request(self, url, *, method: str = "GET", **kwargs: Any) -> Any:
+        try:
+            return await super().request(url, method=method, **kwargs)
+        except genshin.errors.InvalidCookies:
+            if not self.using_cached:
+                raise
+
+            self.logger.info("Cached HoYoLAB cookies rejected, falling back to the configured cookies.")
+            self.using_cached = False
+            self.cookies = dict(self.base_cookies)
+            with span("retry hoyolab cookies", "retry"):
+                return await super().request(url, method=method, **kwargs)
+
+
+def create_hoyolab_client(cookies: str, session_cache: SessionCache, cassette=None) -> genshin.Client:
+    """Build the genshin client, warmed with any cookies a previous run picked up."""
+    client = genshin.Client()
+    cached = session_cache.get(credential_key("hoyolab_cookies", cookies))
+
+    if cached:
+        logging.getLogger("create_hoyolab_client").info("Reusing cached HoYoLAB cookies.")
+
+    client.cookie_manager = PersistentCookieManager(cookies, cached, cassette)
+    return client
+
+
+def save_hoyolab_session(client: genshin.Client, cookies: str, session_cache: SessionCache) -> None:
+    """Remember cookies that differ from the configured ones for the next run."""
+    manager = client.cookie_manager
+    key = credential_key("hoyolab_cookies", cookies)
+
+    if manager.cookies == manager.base_cookies:
+        session_cache.invalidate(key)
+        return
+
+    if session_cache.get(key) != dict(manager.cookies):
+        session_cache.set(key, dict(manager.cookies), timedelta(days=HOYOLAB_COOKIE_TTL_DAYS))
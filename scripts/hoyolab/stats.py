@@ -1,40 +1,80 @@
+import asyncio
+import functools
 import logging
+import time
 
+from scripts.constants import HOYOLAB_CONCURRENCY, SECTION_TTLS
+from scripts.freshness import fetch_parts, merge_parts, stale_parts
+from scripts.tracing import span, traced
 
-async def fetch_hsr_data(client, uid):
-    logger = logging.getLogger("fetch_hsr_data")
+# Shared by every fetcher so concurrent HSR and Genshin fetches stay within the
+# same request budget against the battle chronicle endpoints.
+_semaphore = asyncio.Semaphore(HOYOLAB_CONCURRENCY)
 
-    try:
-        user = await client.get_starrail_user(uid)
-
-        # Fetch characters
-        character_response = await client.get_starrail_characters(uid)
-        characters = character_response.avatar_list
-
-        # Filter 5-star characters
-        five_stars = {
-            char.name: {
-                "icon": char.icon,
-                "eidolon": char.rank,
-                "element": char.element,
-                "path": char.path,
-                "level": char.level,
-                "lc": {
-                    "name": char.equip.name,
-                    "icon": char.equip.icon,
-                    "rarity": char.equip.rarity,
-                    "level": char.equip.level,
-                    "superimposition": char.equip.rank
-                } if char.equip else None
-            } for char in characters if char.rarity == 5
-        }
 
-        hsr_notes = await client.get_starrail_notes(uid=uid)
-        moc_data = await fetch_memory_of_chaos(client, uid)
-        apoc_data = await fetch_apocalyptic_shadow(client, uid)
-        pf_data = await fetch_pure_fiction(client, uid)
-        aa_data = await fetch_anomaly_arbitration(client, uid)
+async def _limited(name, coro):
+    """Await a client call once a slot in the shared request budget is free, traced as one network span."""
+    queued = time.perf_counter()
+    async with _semaphore:
+        with span(name, "network", queued_ms=round((time.perf_counter() - queued) * 1000, 1)):
+            return await coro
+
+
+async def _cached(cache, endpoint, uid, ttl, load, refresh=False):
+    """Return the cached result of `load()` for this endpoint and uid, or run it and cache what it builds for `ttl`.
+
+    `load` does the request and turns the model into plain values, so a hit
+    skips both. `refresh` bypasses (and replaces) the cached entry."""
+    if cache is None:
+        return await load()
+
+    if not refresh:
+        hit = cache.get(endpoint, uid)
+        if hit is not None:
+            with span(endpoint, "cache"):
+                return hit
+
+    result = await load()
+    cache.set(endpoint, uid, result, ttl)
+    return result
+
+
+async def _refresh(fetchers, old, ttls, logger, cached=()):
+    """Fetch the stale parts of a section and merge them over the previous one.
+
+    `cached` parts are read every run: the response cache decides (with the
+    same TTL) whether that costs a request. The roster is refetched early,
+    past the cache, whenever the character count moved. Raises when nothing
+    could be fetched, so the run reports the source as failed (main.py then
+    keeps the previous section)."""
+    expired = stale_parts(old, ttls)
+    stale = [part for part in ttls if part in cached or part in expired]
+    fetched = await fetch_parts(fetchers, stale, logger)
 
+    profile = fetched.get("profile")
+    previous_count = (old or {}).get("avatar_count")
+    roster_current = "roster" in stale and "roster" not in cached
+    if not roster_current and profile and previous_count is not None and profile["avatar_count"] != previous_count:
+        logger.info("Character count changed, refreshing the roster early")
+        fetched.update(await fetch_parts({"roster": functools.partial(fetchers["roster"], refresh=True)}, ["roster"], logger))
+
+    if stale and not fetched:
+        raise RuntimeError(f"every part failed: {', '.join(stale)}")
+
+    logger.info(f"Fetched {', '.join(fetched) or 'nothing'}; carried forward {', '.join(part for part in ttls if part not in fetched) or 'nothing'}")
+    return merge_parts(old, fetched)
+
+
+@traced(category="fetch")
+async def fetch_hsr_data(client, uid, old=None, cache=None):
+    """Refresh the parts of hsr_data that are past their TTL and carry the rest forward from `old`.
+
+    Slow-changing parts (roster, endgame modes) go through the response `cache` when one is given."""
+    logger = logging.getLogger("fetch_hsr_data")
+    ttls = SECTION_TTLS["hsr_data"]
+
+    async def profile():
+        user = await _limited("get_starrail_user", client.get_starrail_user(uid))
         return {
             "nickname": user.info.nickname,
             "level": user.info.level,
@@ -43,217 +83,224 @@ async def fetch_hsr_data(client, uid):
             "active_days": user.stats.active_days,
             "avatar_count": user.stats.avatar_num,
             "chest_count": user.stats.chest_num,
-            "five_star_characters": five_stars,
+        }
 
-            "stamina": hsr_notes.current_stamina,
-            "current_train_score": hsr_notes.current_train_score,
+    async def roster(refresh=False):
+        return await _cached(cache, "get_starrail_characters", uid, ttls["roster"], load_roster, refresh)
 
-            "anomaly_arbitration": aa_data,
-            "apocalyptic_shadow": apoc_data,
-            "pure_fiction": pf_data,
-            "memory_of_chaos": moc_data,
-        }
-    
-    except Exception:
-        logger.error("Failed to fetch HSR data", exc_info=True)
-        return {}
-    
-async def fetch_anomaly_arbitration(client, uid):
-    logger = logging.getLogger("fetch_anomaly_arbitration")
-    try:
-        challenge = await client.get_anomaly_arbitration(uid=uid)
-        if not challenge or not challenge.records:
-            return {}
-        
-        record = challenge.records[0]
-        if not record.has_data:
-            return {}
-        
-        boss_record = None
-        if record.boss_record and record.boss_record.has_data:
-            boss_record = {
-                "characters": [
-                    {"id": a.id,
-                     "level": a.level,
-                     "eidolon": a.rank}
-                     for a in record.boss_record.characters
-                ],
-                "cycles_used": record.boss_record.cycles_used,
-                "stars": record.boss_record.stars,
-                "medal_type": record.boss_record.medal_type,
-            }
+    async def load_roster():
+        character_response = await _limited("get_starrail_characters", client.get_starrail_characters(uid))
 
-        mini_boss_records = [
-            {
-                "characters": [
-                    {"id": a.id, "level": a.level, "eidolon": a.rank}
-                    for a in mb.characters
-                ],
-                "cycles_used": mb.cycles_used,
-                "stars": mb.stars,
+        with span("parse hsr_data", "parse"):
+            # Filter 5-star characters
+            five_stars = {
+                char.name: {
+                    "icon": char.icon,
+                    "eidolon": char.rank,
+                    "element": char.element,
+                    "path": char.path,
+                    "level": char.level,
+                    "lc": {
+                        "name": char.equip.name,
+                        "icon": char.equip.icon,
+                        "rarity": char.equip.rarity,
+                        "level": char.equip.level,
+                        "superimposition": char.equip.rank
+                    } if char.equip else None
+                } for char in character_response.avatar_list if char.rarity == 5
             }
-            for mb in record.mini_boss_records
-            if mb.has_data
-        ]
 
+        return {"five_star_characters": five_stars}
+
+    async def notes():
+        hsr_notes = await _limited("get_starrail_notes", client.get_starrail_notes(uid=uid))
         return {
-            "season": record.season.name if record.season else None,
-            "boss_stars": record.boss_stars,
-            "mini_boss_stars": record.mini_boss_stars,
-            "cycles_used": record.cycles_used,
-            "boss_record": boss_record,
-            "mini_boss_records": mini_boss_records,
+            "stamina": hsr_notes.current_stamina,
+            "current_train_score": hsr_notes.current_train_score,
         }
+
+    async def endgame(key, endpoint, fetcher):
+        return {key: await _cached(cache, endpoint, uid, ttls[key], lambda: fetcher(client, uid))}
+
+    fetchers = {
+        "profile": profile,
+        "roster": roster,
+        "notes": notes,
+        "anomaly_arbitration": lambda: endgame("anomaly_arbitration", "get_anomaly_arbitration", fetch_anomaly_arbitration),
+        "apocalyptic_shadow": lambda: endgame("apocalyptic_shadow", "get_starrail_apc_shadow", fetch_apocalyptic_shadow),
+        "pure_fiction": lambda: endgame("pure_fiction", "get_starrail_pure_fiction", fetch_pure_fiction),
+        "memory_of_chaos": lambda: endgame("memory_of_chaos", "get_starrail_challenge", fetch_memory_of_chaos),
+    }
+
+    cached = ("roster", "anomaly_arbitration", "apocalyptic_shadow", "pure_fiction", "memory_of_chaos") if cache else ()
+    return await _refresh(fetchers, old, ttls, logger, cached)
+
+
+@traced(category="fetch")
+async def fetch_anomaly_arbitration(client, uid):
+    challenge = await _limited("get_anomaly_arbitration", client.get_anomaly_arbitration(uid=uid))
+    if not challenge or not challenge.records:
+        return {}
     
-    except Exception:
-        logger.error("Failed to fetch Anomaly Arbitration", exc_info=True)
+    record = challenge.records[0]
+    if not record.has_data:
         return {}
     
-async def fetch_apocalyptic_shadow(client, uid):
-    logger = logging.getLogger("fetch_apocalyptic_shadow")
-    try:
-        challenge = await client.get_starrail_apc_shadow(uid=uid)
-        if not challenge or not challenge.has_data or not challenge.floors:
-            return {}
-        
-        floor_4 = challenge.floors[0]
-
-        floor_data = {
-            "floor": floor_4.name,
-            "score": floor_4.score,
-            "first_half": [],
-            "second_half": [],
+    boss_record = None
+    if record.boss_record and record.boss_record.has_data:
+        boss_record = {
+            "characters": [
+                {"id": a.id,
+                 "level": a.level,
+                 "eidolon": a.rank}
+                 for a in record.boss_record.characters
+            ],
+            "cycles_used": record.boss_record.cycles_used,
+            "stars": record.boss_record.stars,
+            "medal_type": record.boss_record.medal_type,
         }
 
-        for avatar in floor_4.node_1.avatars:
-            floor_data["first_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    mini_boss_records = [
+        {
+            "characters": [
+                {"id": a.id, "level": a.level, "eidolon": a.rank}
+                for a in mb.characters
+            ],
+            "cycles_used": mb.cycles_used,
+            "stars": mb.stars,
+        }
+        for mb in record.mini_boss_records
+        if mb.has_data
+    ]
 
-        for avatar in floor_4.node_2.avatars:
-            floor_data["second_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    return {
+        "season": record.season.name if record.season else None,
+        "boss_stars": record.boss_stars,
+        "mini_boss_stars": record.mini_boss_stars,
+        "cycles_used": record.cycles_used,
+        "boss_record": boss_record,
+        "mini_boss_records": mini_boss_records,
+    }
 
-        return {
-            "total_stars": challenge.total_stars,
-            "floor_data": floor_data
-        }
-    
-    except Exception:
-        logger.error("Failed to fetch Apocalyptic Shadow", exc_info=True)
+
+@traced(category="fetch")
+async def fetch_apocalyptic_shadow(client, uid):
+    challenge = await _limited("get_starrail_apc_shadow", client.get_starrail_apc_shadow(uid=uid))
+    if not challenge or not challenge.has_data or not challenge.floors:
         return {}
     
-async def fetch_pure_fiction(client, uid):
-    logger = logging.getLogger("fetch_pure_fiction")
-    try:
-        challenge = await client.get_starrail_pure_fiction(uid=uid)
-        if not challenge or not challenge.has_data or not challenge.floors:
-            return {}
-        
-        floor_4 = challenge.floors[0]
-        
-        floor_data = {
-            "floor": floor_4.name,
-            "score": floor_4.score,
-            "first_half": [],
-            "second_half": [],
-        }
+    floor_4 = challenge.floors[0]
 
-        for avatar in floor_4.node_1.avatars:
-            floor_data["first_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    floor_data = {
+        "floor": floor_4.name,
+        "score": floor_4.score,
+        "first_half": [],
+        "second_half": [],
+    }
 
-        for avatar in floor_4.node_2.avatars:
-            floor_data["second_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    for avatar in floor_4.node_1.avatars:
+        floor_data["first_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
 
-        return {
-            "season": challenge.name,
-            "total_stars": challenge.total_stars,
-            "floor_data": floor_data
-        }
-    
-    except Exception:
-        logger.error("Failed to fetch Memory of Chaos", exc_info=True)
+    for avatar in floor_4.node_2.avatars:
+        floor_data["second_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
+
+    return {
+        "total_stars": challenge.total_stars,
+        "floor_data": floor_data
+    }
+
+
+@traced(category="fetch")
+async def fetch_pure_fiction(client, uid):
+    challenge = await _limited("get_starrail_pure_fiction", client.get_starrail_pure_fiction(uid=uid))
+    if not challenge or not challenge.has_data or not challenge.floors:
         return {}
+    
+    floor_4 = challenge.floors[0]
+    
+    floor_data = {
+        "floor": floor_4.name,
+        "score": floor_4.score,
+        "first_half": [],
+        "second_half": [],
+    }
 
-async def fetch_memory_of_chaos(client, uid):
-    logger = logging.getLogger("fetch_memory_of_chaos")
-    try:
-        challenge = await client.get_starrail_challenge(uid=uid)
-
-        if not challenge:
-            return {}
-        
-        floor_12 = challenge.floors[0]
-
-        floor_data = {
-            "floor": floor_12.name,
-            "cycles": floor_12.round_num,
-            "first_half": [],
-            "second_half": [],
-        }
+    for avatar in floor_4.node_1.avatars:
+        floor_data["first_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
 
-        for avatar in floor_12.node_1.avatars:
-            floor_data["first_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    for avatar in floor_4.node_2.avatars:
+        floor_data["second_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
 
-        for avatar in floor_12.node_2.avatars:
-            floor_data["second_half"].append({
-                "id": avatar.id,
-                "level": avatar.level,
-                "eidolon": avatar.rank, 
-            })
+    return {
+        "season": challenge.name,
+        "total_stars": challenge.total_stars,
+        "floor_data": floor_data
+    }
 
-        return {
-            "season": challenge.name,
-            "total_stars": challenge.total_stars,
-            "floor_data": floor_data
-        }
-    
-    except Exception:
-        logger.error("Failed to fetch Memory of Chaos", exc_info=True)
+
+@traced(category="fetch")
+async def fetch_memory_of_chaos(client, uid):
+    challenge = await _limited("get_starrail_challenge", client.get_starrail_challenge(uid=uid))
+
+    if not challenge:
         return {}
     
-async def fetch_genshin_data(client, uid):
+    floor_12 = challenge.floors[0]
+
+    floor_data = {
+        "floor": floor_12.name,
+        "cycles": floor_12.round_num,
+        "first_half": [],
+        "second_half": [],
+    }
+
+    for avatar in floor_12.node_1.avatars:
+        floor_data["first_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
+
+    for avatar in floor_12.node_2.avatars:
+        floor_data["second_half"].append({
+            "id": avatar.id,
+            "level": avatar.level,
+            "eidolon": avatar.rank, 
+        })
+
+    return {
+        "season": challenge.name,
+        "total_stars": challenge.total_stars,
+        "floor_data": floor_data
+    }
+
+
+@traced(category="fetch")
+async def fetch_genshin_data(client, uid, old=None, cache=None):
+    """Refresh the parts of genshin_data that are past their TTL and carry the rest forward from `old`.
+
+    The roster goes through the response `cache` when one is given."""
     logger = logging.getLogger("fetch_genshin_data")
-    try:
-        user = await client.get_genshin_user(uid)
-        characters = await client.get_genshin_characters(uid)
-
-        five_stars = {
-            char.name: {
-                "icon": char.icon,
-                "constellation": char.constellation,
-                "element": char.element,
-                "weaponType": char.weapon_type,
-                "level": char.level,
-                "friendship": char.friendship,
-                "weapon": {
-                    "name": char.weapon.name,
-                    "icon": char.weapon.icon,
-                    "rarity": char.weapon.rarity,
-                    "level": char.weapon.level,
-                    "refinement": char.weapon.refinement
-                } if char.weapon else None
-            } for char in characters if char.rarity == 5
-        }
+    ttls = SECTION_TTLS["genshin_data"]
 
-        notes = await client.get_genshin_notes(uid)
+    async def profile():
+        user = await _limited("get_genshin_user", client.get_genshin_user(uid))
 
         oculus = user.stats.anemoculi + user.stats.geoculi + user.stats.electroculi + user.stats.dendroculi + user.stats.hydroculi + user.stats.pyroculi + user.stats.lunoculi
 
@@ -268,12 +315,42 @@ async def fetch_genshin_data(client, uid):
             "avatar_count": user.stats.characters,
             "oculus": oculus,
             "chest_count": chests,
-            "five_star_characters": five_stars,
+        }
+
+    async def roster(refresh=False):
+        return await _cached(cache, "get_genshin_characters", uid, ttls["roster"], load_roster, refresh)
+
+    async def load_roster():
+        characters = await _limited("get_genshin_characters", client.get_genshin_characters(uid))
+
+        with span("parse genshin_data", "parse"):
+            five_stars = {
+                char.name: {
+                    "icon": char.icon,
+                    "constellation": char.constellation,
+                    "element": char.element,
+                    "weaponType": char.weapon_type,
+                    "level": char.level,
+                    "friendship": char.friendship,
+                    "weapon": {
+                        "name": char.weapon.name,
+                        "icon": char.weapon.icon,
+                        "rarity": char.weapon.rarity,
+                        "level": char.weapon.level,
+                        "refinement": char.weapon.refinement
+                    } if char.weapon else None
+                } for char in characters if char.rarity == 5
+            }
 
-            "resin": notes.current_resin,
-            "daily_task": notes.daily_task.completed_tasks
+        return {"five_star_characters": five_stars}
+
+    async def notes():
+        genshin_notes = await _limited("get_genshin_notes", client.get_genshin_notes(uid))
+        return {
+            "resin": genshin_notes.current_resin,
+            "daily_task": genshin_notes.daily_task.completed_tasks
         }
-    
-    except Exception:
-        logger.error("Failed to fetch Genshin data", exc_info=True)
-        return {}
\ No newline at end of file
+
+    fetchers = {"profile": profile, "roster": roster, "notes": notes}
+
+    return await _refresh(fetchers, old, ttls, logger, ("roster",) if cache else ())
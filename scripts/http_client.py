@@ -0,0 +1,15 @@
+import httpx
+
+
+def create_http_client(timeout: int = 15, cassette=None) -> httpx.AsyncClient:
+    """Create a pooled HTTP/2 client with keep-alive, shared by the Endfield API and image downloads.
+
+    With a replay.Cassette the transport records or replays every response."""
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=30),
+    )
+    if cassette:
+        transport = cassette.wrap_transport(transport)
+
+    return httpx.AsyncClient(timeout=timeout, transport=transport)
@@ -1,39 +1,232 @@
+import asyncio
 import calendar
+import logging
+import time
+from collections import defaultdict, deque
 from datetime import timedelta
-from typing import Any, Dict
-
-import requests
-
-from scripts.constants import now
+from typing import Any, Dict, List
+
+import httpx
+
+from scripts.constants import (
+    OUTBOX_MAX_AGE_DAYS,
+    WEBHOOK_BACKOFF,
+    WEBHOOK_FLUSH_TIMEOUT,
+    WEBHOOK_MAX_ATTEMPTS,
+    WEBHOOK_MAX_WAIT,
+    now
+)
+from scripts.http_client import create_http_client
+from scripts.outbox import Outbox
+from scripts.tracing import span
 
 GREEN_EMBED = 5763719
 RED_EMBED = 15548997
 
+# Discord's per-message limits: embeds, and characters across all of them
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+
+def _embed_chars(embed: Dict[str, Any]) -> int:
+    """Characters Discord counts towards the per-message total."""
+    parts = [embed.get("title", ""), embed.get("description", ""), embed.get("footer", {}).get("text", "")]
+    for field in embed.get("fields", []):
+        parts += [field.get("name", ""), field.get("value", "")]
+    return sum(len(part) for part in parts)
+
+def pack_embeds(embeds: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split embeds, in order, into as few messages as Discord's limits allow."""
+    messages, current, chars = [], [], 0
+
+    for embed in embeds:
+        size = _embed_chars(embed)
+        if current and (len(current) == MAX_EMBEDS or chars + size > MAX_EMBED_CHARS):
+            messages.append(current)
+            current, chars = [], 0
+        current.append(embed)
+        chars += size
+
+    return messages + [current] if current else messages
+
 class WebhookClient:
-    def __init__(self, hoyolab_webhook: str, endfield_webhook: str, discord_id: str | None = None):
+    """Discord webhook sender backed by an on-disk outbox.
+
+    send_* only queue a message: it is written to the outbox, then delivered by
+    a background task per webhook, in order, over one pooled HTTP client.
+    Discord's rate-limit headers and 429 Retry-After are waited out, other
+    failures are retried with exponential backoff. flush() waits for delivery
+    up to a deadline; whatever is still undelivered is sent by the next run."""
+
+    def __init__(self, hoyolab_webhook: str, endfield_webhook: str, discord_id: str | None = None,
+                 dry_run: bool = False, outbox: Outbox | None = None):
         self.hoyolab_webhook = hoyolab_webhook
         self.endfield_webhook = endfield_webhook
         self.discord_id = discord_id
+        self.dry_run = dry_run  # offline replays log the payload instead of posting it
+        self.outbox = outbox or Outbox()
+        self.logger = logging.getLogger("WebhookClient")
+
+        self._webhooks = {"hoyolab": hoyolab_webhook, "endfield": endfield_webhook}
+        self._http = None
+        self._queues = defaultdict(deque)  # channel -> outbox entries waiting for delivery
+        self._tasks: Dict[str, asyncio.Task] = {}  # channel -> its delivery task
+        self._blocked_until: Dict[str, float] = {}  # webhook url -> monotonic time its bucket refills
+        self._stalled = set()  # channels that gave up this run; their queue is left to the next one
+
+    # ------------------------
+    # Queueing
+    # ------------------------
+
+    def resume(self):
+        """Start delivering what earlier runs left in the outbox; call from inside the event loop."""
+        if self.dry_run:
+            return
+
+        cutoff = (now() - timedelta(days=OUTBOX_MAX_AGE_DAYS)).isoformat()
+        pending = self.outbox.pending()
+
+        for entry in pending:
+            if entry["queued"] < cutoff or entry["channel"] not in self._webhooks:
+                self.logger.error(f"Dropping undeliverable {entry['channel']} message from {entry['queued']}: {entry['payload'].get('content')!r}")
+                self.outbox.settle(entry["id"], "expired")
+            else:
+                self._enqueue(entry)
+
+        if pending:
+            self.logger.info(f"Resuming {len(pending)} webhook messages from an earlier run")
+
+    def _enqueue(self, entry):
+        channel = entry["channel"]
+        self._queues[channel].append(entry)
+
+        # Never let a new message overtake unsettled ones; the outbox keeps them all in order
+        if channel in self._stalled:
+            return
+
+        task = self._tasks.get(channel)
+        if not task or task.done():
+            self._tasks[channel] = asyncio.create_task(self._deliver(channel), name=f"webhook {channel}")
+
+    def _send(self, channel: str, content: str, embeds, username: str | None = None):
+        """Queue the embeds in as few messages as possible; the text goes with the first."""
+        for i, chunk in enumerate(pack_embeds(embeds) or [[]]):
+            payload = {"embeds": chunk}
+            if username:
+                payload["username"] = username
+            if i == 0:
+                payload["content"] = content
+
+            if self.dry_run:
+                self.logger.info(f"Dry run, not posting: {payload.get('content')!r} with {len(chunk)} embeds")
+            else:
+                self._enqueue(self.outbox.add(channel, payload))
+
+    async def flush(self, timeout: float = WEBHOOK_FLUSH_TIMEOUT):
+        """Wait for queued messages, at most `timeout` seconds; never raises for delivery problems."""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+
+        if tasks:
+            _, unfinished = await asyncio.wait(tasks, timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+        if self._http:
+            await self._http.aclose()
+            self._http = None
+
+        if not self.dry_run:
+            self.outbox.compact()
+
+    # ------------------------
+    # Delivery
+    # ------------------------
+
+    async def _deliver(self, channel: str):
+        queue = self._queues[channel]
+
+        while queue:
+            entry = queue[0]
+            try:
+                outcome = await self._post(self._webhooks[channel], entry["payload"])
+            except Exception as e:
+                # Later messages (including ones queued from now on) wait too, so the channel stays in order
+                self.logger.error(f"{channel} webhook unreachable, {len(queue)} messages kept in the outbox: {e}")
+                self._stalled.add(channel)
+                return
+
+            self.outbox.settle(entry["id"], outcome)
+            queue.popleft()
+
+    async def _wait_for_bucket(self, url: str):
+        delay = self._blocked_until.get(url, 0) - time.monotonic()
+        if delay > WEBHOOK_MAX_WAIT:
+            raise RuntimeError(f"Webhook rate limited for another {delay:.0f}s")
+        if delay > 0:
+            self.logger.info(f"Webhook rate limit reached, waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _track_bucket(self, url: str, response):
+        """Remember when the webhook may be used again, from Discord's rate-limit headers."""
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After") or response.headers.get("X-RateLimit-Reset-After")
+            if retry_after is None:
+                try:
+                    body = response.json()
+                except ValueError:  # e.g. an HTML page from a proxy in front of Discord
+                    body = None
+                retry_after = body.get("retry_after") if isinstance(body, dict) else None
+            self._blocked_until[url] = time.monotonic() + float(retry_after or WEBHOOK_BACKOFF)
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = float(response.headers.get("X-RateLimit-Reset-After", 1))
+            self._blocked_until[url] = time.monotonic() + reset_after
+
+    async def _post(self, url: str, payload) -> str:
+        """Deliver one message; "delivered", or "rejected" when Discord refuses the payload itself."""
+        if self._http is None:
+            self._http = create_http_client(timeout=10)
+
+        for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+            await self._wait_for_bucket(url)
+
+            try:
+                with span("webhook", "network", username=payload.get("username", "")) as attrs:
+                    response = await self._http.post(url, json=payload)
+                    attrs["status"] = response.status_code
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                self._track_bucket(url, response)
+                if response.is_success:
+                    return "delivered"
+                if response.status_code == 400:
+                    # Malformed payload: retrying (now or next run) can never succeed
+                    self.logger.error(f"Webhook rejected message {payload.get('content')!r}: {response.text[:300]}")
+                    return "rejected"
+                error = f"HTTP {response.status_code}"
+
+            if attempt < WEBHOOK_MAX_ATTEMPTS and error != "HTTP 429":
+                delay = WEBHOOK_BACKOFF * 2 ** (attempt - 1)
+                self.logger.warning(f"Webhook post failed ({error}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+        raise RuntimeError(f"gave up after {WEBHOOK_MAX_ATTEMPTS} attempts ({error})")
 
     def send_hoyolab(self, elapsed: float, embeds):
-        payload = {
-            "username": "Hoyolab Stats Bot",
-            "content": f"✅ Task completed in `{elapsed:.2f}s`",
-            "embeds": embeds
-        }
-
-        response = requests.post(self.hoyolab_webhook, json=payload, timeout=10)
-        response.raise_for_status()
+        self._send(
+            "hoyolab",
+            username="Hoyolab Stats Bot",
+            content=f"✅ Task completed in `{elapsed:.2f}s`",
+            embeds=embeds
+        )
 
     def send_endfield(self, elapsed: float, embeds):
-        payload = {
-            "username": "Chen Qianyu - Dijiang Control Nexus Assistant",
-            "content": f"✅ Task completed in `{elapsed:.2f}s`",
-            "embeds": embeds
-        }
-
-        response = requests.post(self.endfield_webhook, json=payload, timeout=10)
-        response.raise_for_status()
+        self._send(
+            "endfield",
+            username="Chen Qianyu - Dijiang Control Nexus Assistant",
+            content=f"✅ Task completed in `{elapsed:.2f}s`",
+            embeds=embeds
+        )
 
     def send_failure(self, task_name: str, error_message: str):
         now_est = now()
@@ -47,54 +240,106 @@ class WebhookClient:
             }
         }
 
-        payload = {
-            "content": f"<@{self.discord_id}> Stats update failed!\n{error_message or ''}",
-            "embeds": [embed]
-        }
-
-        response = requests.post(self.hoyolab_webhook, json=payload, timeout=10)
-        response.raise_for_status()
+        self._send(
+            "hoyolab",
+            content=f"<@{self.discord_id}> Stats update failed!\n{error_message or ''}",
+            embeds=[embed]
+        )
+
+# Metrics summarised over the last week when a history store is available
+WEEKLY_METRICS = {
+    "genshin": [("achievements", "Achievements"), ("chest_count", "Chests"), ("oculus", "Oculus")],
+    "hsr": [("achievements", "Achievements"), ("chest_count", "Chests")],
+}
+
+def weekly_field(history, game: str, name: str):
+    """Embed field with how much each of a game's key metrics moved in the last 7 days."""
+    deltas = history.deltas(game, [metric for metric, _ in WEEKLY_METRICS[game]], now() - timedelta(days=7))
+    lines = [
+        f"**{label}:** {int(deltas[metric]):+d}"
+        for metric, label in WEEKLY_METRICS[game]
+        if deltas[metric] is not None
+    ]
 
-def hoyolab_embed(old_data: dict | None, genshin_data: dict, hsr_data: dict):
+    return {"name": f"{name} (7 days)", "value": "\n".join(lines) or "-", "inline": True}
+
+# Summary lines per game: (stats.json key, label), each shown with its change since the last run
+GENSHIN_STATS = [
+    ("level", "AR"), ("achievements", "Achievements"), ("active_days", "Active Days"),
+    ("avatar_count", "Character Count"), ("oculus", "Oculus"), ("chest_count", "Chest Count"),
+    ("resin", "Resin"), ("daily_task", "Daily Tasks"),
+]
+HSR_STATS = [
+    ("level", "Trailblaze Level"), ("achievements", "Achievements"), ("active_days", "Active Days"),
+    ("avatar_count", "Character Count"), ("chest_count", "Chest Count"), ("stamina", "Trailblaze Power"),
+    ("current_train_score", "Daily Training"),
+]
+ENDFIELD_STATS = [
+    ("level", "Level"), ("achievements", "Achievements"), ("active_days", "Active Days"),
+    ("avatar_count", "Character Count"), ("aurylenes", "Aurylenes"), ("chest_count", "Chest Count"),
+    ("stamina", "Stamina"), ("daily_mission", "Daily Mission"),
+]
+
+# Character (and weapon) attributes worth a line when they change, and their prefix
+ROSTER_LABELS = {
+    "eidolon": "E", "constellation": "C", "potential": "P", "level": "Lv. ",
+    "superimposition": "S", "refinement": "R", "refineLevel": "R",
+}
+WEAPON_KEYS = ("lc", "weapon")
+
+# Roster lines per field; Discord caps a field at 1024 characters
+ROSTER_LINES = 10
+
+def stat_lines(changes, stats) -> str:
+    return "".join(f"**{label}:** {changes.stat(key)}\n" for key, label in stats)
+
+def _roster_entry(name: str, changes) -> str | None:
+    whole = [change for change in changes if len(change.path) == 2]
+    if whole:
+        return f"**{name}** joined the roster" if whole[0].kind == "added" else None
+
+    parts = []
+    for change in changes:
+        key = change.path[-1]
+        if key in WEAPON_KEYS and isinstance(change.new, dict):
+            parts.append(f"now using {change.new.get('name')}")
+        elif change.path[2] in WEAPON_KEYS and key == "name":
+            parts.append(f"now using {change.new}")
+        elif key in ROSTER_LABELS and change.delta:
+            label = ROSTER_LABELS[key]
+            parts.append(f"{label}{change.old} → {label}{change.new}")
+
+    return f"**{name}:** {', '.join(parts)}" if parts else None
+
+def roster_field(changes, key: str, name: str):
+    """Embed field listing new characters and eidolon/constellation/potential/level/weapon changes, or None."""
+    lines = [line for entry, group in changes.grouped(key).items() if (line := _roster_entry(entry, group))]
+    if not lines:
+        return None
+
+    if len(lines) > ROSTER_LINES:
+        lines = lines[:ROSTER_LINES] + [f"+{len(lines) - ROSTER_LINES} more"]
+    return {"name": f"{name} Roster", "value": "\n".join(lines), "inline": False}
+
+def hoyolab_embed(genshin, hsr, history=None):
+    """`genshin` and `hsr` are diff.ChangeSet objects of their stats.json sections."""
     embed_color = GREEN_EMBED
 
-    if old_data:
-        old_genshin = old_data.get("genshin_data", {})
-        old_hsr = old_data.get("hsr_data", {})
-    else:
-        old_genshin = {}
-        old_hsr = {}
-
     fields = [
-        {
-            "name": "Genshin Impact",
-            "value": (
-                f"**AR:** {genshin_data.get('level', 'N/A')}\n"
-                f"**Achievements:** {calculate_delta(old_genshin.get('achievements', '0'), genshin_data.get('achievements', '0'))}\n"
-                f"**Active Days:** {calculate_delta(old_genshin.get('active_days', '0'), genshin_data.get('active_days', '0'))}\n"
-                f"**Character Count:** {calculate_delta(old_genshin.get('avatar_count', '0'), genshin_data.get('avatar_count', '0'))}\n"
-                f"**Oculus:** {calculate_delta(old_genshin.get('oculus', '0'), genshin_data.get('oculus', '0'))}\n"
-                f"**Chest Count:** {calculate_delta(old_genshin.get('chest_count', '0'), genshin_data.get('chest_count', '0'))}\n"
-                f"**Resin:** {calculate_delta(old_genshin.get('resin', '0'), genshin_data.get('resin', '0'))}\n"
-                f"**Daily Tasks:** {calculate_delta(old_genshin.get('daily_task', '0'), genshin_data.get('daily_task', '0'))}\n"
-            ),
-            "inline": True
-        },
-        {
-            "name": "Honkai: Star Rail",
-            "value": (
-                f"**Trailblaze Level:** {hsr_data.get('level', 'N/A')}\n"
-                f"**Achievements:** {calculate_delta(old_hsr.get('achievements', '0'), hsr_data.get('achievements', '0'))}\n"
-                f"**Active Days:** {calculate_delta(old_hsr.get('active_days', '0'), hsr_data.get('active_days', '0'))}\n"
-                f"**Character Count:** {calculate_delta(old_hsr.get('avatar_count', '0'), hsr_data.get('avatar_count', '0'))}\n"
-                f"**Chest Count:** {calculate_delta(old_hsr.get('chest_count', '0'), hsr_data.get('chest_count', '0'))}\n"
-                f"**Trailblaze Power:** {calculate_delta(old_hsr.get('stamina', '0'), hsr_data.get('stamina', '0'))}\n"
-                f"**Daily Training:** {calculate_delta(old_hsr.get('current_train_score', '0'), hsr_data.get('current_train_score', '0'))}\n"
-            ),
-            "inline": True
-        }
+        {"name": "Genshin Impact", "value": stat_lines(genshin, GENSHIN_STATS), "inline": True},
+        {"name": "Honkai: Star Rail", "value": stat_lines(hsr, HSR_STATS), "inline": True},
     ]
 
+    for field in (roster_field(genshin, "five_star_characters", "Genshin Impact"),
+                  roster_field(hsr, "five_star_characters", "Honkai: Star Rail")):
+        if field:
+            fields.append(field)
+
+    if history:
+        fields.append({"name": "\u200b", "value": "\u200b", "inline": False})  # line break
+        fields.append(weekly_field(history, "genshin", "Genshin Impact"))
+        fields.append(weekly_field(history, "hsr", "Honkai: Star Rail"))
+
     now_est = now()
 
     embed = {
@@ -150,6 +395,52 @@ def hoyolab_diary_embed(hsr_diary: dict | None, genshin_diary: dict | None):
 
     return embed
 
+def _usual(baseline: dict | None, fmt) -> str:
+    if not baseline:
+        return ""
+    return f" (p50 {fmt(baseline['p50'])}, p95 {fmt(baseline['p95'])})"
+
+def performance_embed(metrics: Dict[str, float], baselines: Dict[str, dict], slow: list):
+    """This run's timings and traffic next to the p50/p95 of earlier runs, red when a timing regressed."""
+    now_est = now()
+
+    seconds = lambda value: f"{value:.2f}s"
+    timings = [
+        f"{'⚠️ ' if metric[len('elapsed/'):] in slow else ''}**{metric[len('elapsed/'):]}:** "
+        f"{seconds(value)}{_usual(baselines.get(metric), seconds)}"
+        for metric, value in metrics.items()
+        if metric.startswith("elapsed/")
+    ]
+
+    count = lambda value: f"{value:.0f}"
+    kilobytes = lambda value: f"{value / 1024:.0f} KB"
+    traffic = [
+        f"**Requests:** {count(metrics['requests'])}{_usual(baselines.get('requests'), count)}",
+        f"**Downloaded:** {kilobytes(metrics['bytes'])}{_usual(baselines.get('bytes'), kilobytes)}",
+        f"**Retries:** {count(metrics['retries'])}{_usual(baselines.get('retries'), count)}",
+        f"**Images Fetched:** {count(metrics['images'])}{_usual(baselines.get('images'), count)}",
+    ]
+
+    if slow:
+        description = f"⚠️ **Slower than usual:** {', '.join(slow)}"
+    elif baselines:
+        description = f"✅ **Within the usual range** of the last {max(b['runs'] for b in baselines.values())} runs"
+    else:
+        description = "📊 **First run with metrics**, no baseline yet"
+
+    return {
+        "title": "Run Performance",
+        "description": description,
+        "color": RED_EMBED if slow else GREEN_EMBED,
+        "fields": [
+            {"name": "Latency", "value": "\n".join(timings), "inline": True},
+            {"name": "Traffic", "value": "\n".join(traffic), "inline": True},
+        ],
+        "footer": {
+            "text": f"Time: {now_est.strftime('%m/%d/%Y, %I:%M:%S %p')} (ET)"
+        }
+    }
+
 def endfield_attendance_embed(results: Dict[str, Any]):
     embed_color = GREEN_EMBED
 
@@ -174,7 +465,7 @@ def endfield_attendance_embed(results: Dict[str, Any]):
             },
             {
                 "name": "Claimed Rewards" if results.get("status") == "Already Claimed" else "Rewards",
-                "value": rewards_text
+                "value": rewards_text or "-"
             },
             {
                 "name": "Progress",
@@ -216,30 +507,18 @@ def endfield_attendance_embed(results: Dict[str, Any]):
     
     return embeds
 
-def endfield_embed(old_data: dict | None, endfield_data: dict):
+def endfield_embed(endfield):
+    """`endfield` is the diff.ChangeSet of the endfield_data section."""
     embed_color = GREEN_EMBED
 
-    if old_data:
-        old_endfield = old_data.get("endfield_data", {})
-    else:
-        old_endfield = {}
-
     fields = [
-        {
-            "name": "Arknights: Endfield",
-            "value": (
-                f"**Level:** {endfield_data.get('level', 'N/A')}\n"
-                f"**Achievements:** {calculate_delta(old_endfield.get('achievements', 0), endfield_data.get('achievements', '0'))}\n"
-                f"**Active Days:** {calculate_delta(old_endfield.get('active_days', '0'), endfield_data.get('active_days', '0'))}\n"
-                f"**Character Count:** {calculate_delta(old_endfield.get('avatar_count', '0'), endfield_data.get('avatar_count', '0'))}\n"
-                f"**Aurylenes:** {calculate_delta(old_endfield.get('aurylenes', '0'), endfield_data.get('aurylenes', '0'))}\n"
-                f"**Chest Count:** {calculate_delta(old_endfield.get('chest_count', '0'), endfield_data.get('chest_count', '0'))}\n"
-                f"**Stamina:** {calculate_delta(old_endfield.get('stamina', '0'), endfield_data.get('stamina', '0'))}\n"
-                f"**Daily Mission:** {calculate_delta(old_endfield.get('daily_mission', '0'), endfield_data.get('daily_mission', '0'))}\n"
-            )
-        }
+        {"name": "Arknights: Endfield", "value": stat_lines(endfield, ENDFIELD_STATS)}
     ]
 
+    roster = roster_field(endfield, "six_star_characters", "Arknights: Endfield")
+    if roster:
+        fields.append(roster)
+
     now_est = now()
 
     embed = {
@@ -254,18 +533,3 @@ def endfield_embed(old_data: dict | None, endfield_data: dict):
     }
 
     return embed
-
-def calculate_delta(old_value, new_value):
-    try:
-        old_value = int(old_value)
-        new_value = int(new_value)
-        diff = new_value - old_value
-
-        if diff > 0:
-            return f"{new_value} (+{diff})"
-        elif diff < 0:
-            return f"{new_value} ({diff})"
-        else:
-            return f"{new_value}"
-    except Exception:
-        return str(new_value)
\ No newline at end of file
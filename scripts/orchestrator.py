@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+@dataclass
+class Source:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    timeout: Optional[float]  # None: bounded only by the run deadline
+    default: Any = None
+
+
+@dataclass
+class SourceResult:
+    name: str
+    value: Any
+    status: str  # "ok", "timeout" or "error"
+    elapsed: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
+async def _run_source(source: Source) -> SourceResult:
+    logger = logging.getLogger("orchestrator")
+    start = time.perf_counter()
+
+    try:
+        value = await asyncio.wait_for(source.run(), timeout=source.timeout)
+        elapsed = time.perf_counter() - start
+        logger.info(f"{source.name} finished in {elapsed:.2f}s")
+        return SourceResult(source.name, value, "ok", elapsed)
+
+    except asyncio.TimeoutError:
+        # Also raised from inside a source (e.g. an aiohttp read timeout), including one with no timeout of its own
+        elapsed = time.perf_counter() - start
+        message = f"Timed out after {elapsed:.0f}s"
+        logger.error(f"{source.name}: {message}")
+        return SourceResult(source.name, source.default, "timeout", elapsed, message)
+
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        logger.error(f"{source.name} failed", exc_info=True)
+        return SourceResult(source.name, source.default, "error", elapsed, str(e))
+
+
+async def run_sources(sources: List[Source], deadline: float) -> Dict[str, SourceResult]:
+    """Run every source as its own task and collect the results.
+
+    Each source is bounded by its own timeout (if any), and the whole fan-out by `deadline`.
+    Sources that fail or run out of time fall back to their default value, so the
+    caller always gets one result per source."""
+    logger = logging.getLogger("orchestrator")
+    start = time.perf_counter()
+
+    tasks = {
+        asyncio.create_task(_run_source(source), name=source.name): source
+        for source in sources
+    }
+
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start
+    results = {}
+
+    for task, source in tasks.items():
+        if task in done:
+            results[source.name] = task.result()
+        else:
+            logger.error(f"{source.name} cancelled by the run deadline ({deadline:.0f}s)")
+            results[source.name] = SourceResult(
+                source.name,
+                source.default,
+                "timeout",
+                elapsed,
+                f"Cancelled by the run deadline ({deadline:.0f}s)"
+            )
+
+    return results
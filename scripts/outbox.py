@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+from scripts.constants import CACHE_DIR, now
+from scripts.fileio import atomic_write
+
+OUTBOX_FILE = CACHE_DIR / "outbox.jsonl"
+
+
+class Outbox:
+    """Append-only JSON-lines queue of webhook messages that still have to reach Discord.
+
+    A message is written as {"id", "channel", "payload", "queued"} before the
+    first delivery attempt, and settled later by a {"id", "done"} line
+    ("delivered" or "rejected"). Whatever is unsettled when the process dies
+    is delivered by the next run. Messages name their channel ("hoyolab",
+    "endfield") rather than the webhook URL, so no secret is written to disk."""
+
+    def __init__(self, path: Path = OUTBOX_FILE):
+        self.path = Path(path)
+        self.logger = logging.getLogger("Outbox")
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, channel: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {"id": uuid.uuid4().hex, "channel": channel, "payload": payload, "queued": now().isoformat()}
+        self._append(entry)
+        return entry
+
+    def settle(self, entry_id: str, outcome: str = "delivered") -> None:
+        self._append({"id": entry_id, "done": outcome})
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Unsettled messages, oldest first. A torn last line (crash mid-write) is ignored."""
+        entries, settled = {}, set()
+
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "done" in record:
+                        settled.add(record["id"])
+                    else:
+                        entries[record["id"]] = record
+        except FileNotFoundError:
+            return []
+
+        return [entry for entry_id, entry in entries.items() if entry_id not in settled]
+
+    def compact(self) -> None:
+        """Drop settled messages so the file only grows while Discord is unreachable."""
+        if not self.path.exists():
+            return
+
+        pending = self.pending()
+        if not pending:
+            self.path.unlink()
+            return
+
+        atomic_write(self.path, "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in pending).encode())
+        self.logger.warning(f"{len(pending)} webhook messages left in the outbox for the next run")
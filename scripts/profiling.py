@@ -0,0 +1,183 @@
+import cProfile
+import contextlib
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from scripts.constants import PROFILE_DIR, PROFILE_TOP
+from scripts.tracing import events, export, lanes
+
+_STDLIB = sysconfig.get_paths()["stdlib"]
+_ROOT = str(Path(__file__).resolve().parent.parent)
+
+# Where the event loop sits while every task is waiting on a socket, and where
+# idle to_thread workers block waiting for work
+_IO_WAIT = ("select.epoll", "select.kqueue", "select.select", "_overlapped")
+_THREAD_IDLE = ("_queue.SimpleQueue", "_thread.lock")
+
+# C functions name their module: "<built-in method marshal.loads>", "<method 'finish' of 'brotli.Compressor' objects>"
+_C_MODULE = re.compile(r"<built-in method (\w+)\.|of '(\w+)\.")
+
+
+def enabled() -> bool:
+    return "--profile" in sys.argv[1:] or os.environ.get("PROFILE", "") not in ("", "0")
+
+
+def bucket(filename: str, function: str = "") -> str:
+    """Group a code location by package: "openpyxl", "json", "pydantic", "scripts", "I/O wait"..."""
+    if any(name in function for name in _IO_WAIT):
+        return "I/O wait"
+    if any(name in function for name in _THREAD_IDLE):
+        return "idle worker threads"
+    if filename == "~":
+        match = _C_MODULE.search(function)
+        return next(filter(None, match.groups())) if match else "builtins"
+    if filename.startswith("<frozen"):
+        return "importlib"
+
+    parts = Path(filename).parts
+    if "site-packages" in parts:
+        return parts[parts.index("site-packages") + 1].split(".")[0]
+    if filename.startswith(_STDLIB):
+        relative = Path(filename).relative_to(_STDLIB).parts
+        return relative[0].removesuffix(".py")
+    if filename.startswith(_ROOT):
+        return Path(filename).relative_to(_ROOT).parts[0].removesuffix(".py")
+    return "other"
+
+
+# ------------------------
+# Reports
+# ------------------------
+
+def _stats_table(stats: pstats.Stats, sort: str) -> str:
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.sort_stats(sort).print_stats(PROFILE_TOP)
+    return buffer.getvalue()
+
+
+def _by_package(stats: pstats.Stats) -> Dict[str, float]:
+    """Own time (excluding callees) per package, in seconds."""
+    totals = defaultdict(float)
+    for (filename, _, function), (_, _, own, _, _) in stats.stats.items():
+        totals[bucket(filename, function)] += own
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def _allocations(snapshot: tracemalloc.Snapshot) -> List[str]:
+    lines = []
+    for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+
+    packages = defaultdict(int)
+    for stat in snapshot.statistics("filename"):
+        packages[bucket(stat.traceback[0].filename)] += stat.size
+
+    lines.append("")
+    lines.extend(f"{size / 1024:10.1f} KB  {name}" for name, size in sorted(packages.items(), key=lambda item: -item[1]))
+    return lines
+
+
+def _task_timeline() -> List[str]:
+    """Per task: when it started and finished, and the spans it spent its time in."""
+    by_lane = defaultdict(list)
+    for event in events():
+        by_lane[event["tid"]].append(event)
+
+    names = lanes()
+    lines = []
+    for tid, spans in by_lane.items():
+        spans.sort(key=lambda e: e["ts"])
+        start = spans[0]["ts"] / 1e6
+        end = max(e["ts"] + e["dur"] for e in spans) / 1e6
+        lines.append(f"[{start:7.3f}s - {end:7.3f}s] {names.get(tid, tid)}")
+        for e in spans:
+            lines.append(f"    {e['ts'] / 1e6:7.3f}s  {e['dur'] / 1e3:9.1f} ms  {e['cat']:<8} {e['name']}")
+    return lines
+
+
+def _write_reports(directory: Path, profiles: List[cProfile.Profile], snapshot, peak: int, wall: float) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    stats.dump_stats(directory / "main.pstats")
+
+    packages = _by_package(stats)
+    summary = [
+        f"Wall time {wall:.2f}s, CPU time in profile {stats.total_tt:.2f}s, peak traced memory {peak / 1024 / 1024:.1f} MB",
+        f"{len(profiles) - 1} worker threads profiled alongside the event loop",
+        "",
+        "== Own time by package ==",
+        *(f"{seconds:8.3f}s  {name}" for name, seconds in packages.items()),
+        "",
+        "== Hot functions (cumulative) ==",
+        _stats_table(stats, "cumulative"),
+        "== Hot functions (own time) ==",
+        _stats_table(stats, "tottime"),
+        "== Allocation sites (live at the end of the run) ==",
+        *_allocations(snapshot),
+    ]
+    (directory / "summary.txt").write_text("\n".join(summary) + "\n")
+    (directory / "tasks.txt").write_text("\n".join(_task_timeline()) + "\n")
+    export(directory / "trace.json")
+
+
+@contextlib.contextmanager
+def profiled(directory: Path = PROFILE_DIR) -> Iterator[None]:
+    """Run the block under cProfile (event loop and worker threads) and tracemalloc.
+
+    Writes main.pstats (open with `python -m pstats` or snakeviz), summary.txt,
+    tasks.txt and trace.json to `directory`."""
+    logger = logging.getLogger("profiling")
+    profiles = [cProfile.Profile()]
+    running = [0]
+
+    # asyncio.to_thread workers start after this point; give each its own profiler.
+    # A profiler only stops in its own thread, so each one is disabled as its thread
+    # ends and only then handed over for the report.
+    thread_run = threading.Thread.run
+
+    def profiled_run(thread):
+        profiler = cProfile.Profile()
+        running[0] += 1
+        profiler.enable()
+        try:
+            thread_run(thread)
+        finally:
+            profiler.disable()
+            running[0] -= 1
+            profiles.append(profiler)
+
+    threading.Thread.run = profiled_run
+    tracemalloc.start()
+    start = time.perf_counter()
+    profiles[0].enable()
+
+    try:
+        yield
+    finally:
+        profiles[0].disable()
+        wall = time.perf_counter() - start
+        threading.Thread.run = thread_run
+        if running[0]:
+            logger.warning(f"{running[0]} threads still running, left out of the profile")
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        _write_reports(directory, profiles, snapshot, peak, wall)
+        logger.info(f"Profile written to {directory}/ (summary.txt, main.pstats, tasks.txt, trace.json)")
@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict
+
+try:
+    import brotli  # installed with httpx[brotli]
+except ImportError:
+    brotli = None
+
+from scripts.constants import DELTA_WINDOW, STATS_DIR
+from scripts.diff import json_patch
+from scripts.fileio import write_if_changed
+
+STATS_FILE = Path("data/stats.json")
+MINIFIED_STATS_FILE = Path("data/stats.min.json")
+
+SHARD_MANIFEST = STATS_DIR / "manifest.json"
+
+# Keys that change on every run without saying anything about the data
+VOLATILE_KEYS = {"last_updated"}
+DELTA_DIR = STATS_DIR / "deltas"
+DELTA_INDEX = STATS_DIR / "deltas.json"
+
+# Shard name -> stats.json sections it carries
+SHARDS = {
+    "hsr": ["hsr_data"],
+    "genshin": ["genshin_data"],
+    "endfield": ["endfield_data"],
+    "diaries": ["hsr_diary", "genshin_diary"],
+    "attendance": ["endfield_attendance"],
+    "images": ["images"],
+}
+
+# Manifest layout:
+#   last_updated: snapshot time
+#   shards: name -> {"path", "hash", "bytes", "encoded_bytes", "sections"}
+#
+# Shard files are named <name>.<hash[:16]>.json, so an unchanged shard keeps
+# the same bytes and URL from run to run and can be cached forever; only the
+# manifest has to be revalidated.
+#
+# Delta index layout (data/stats/deltas.json):
+#   latest: hash of the newest snapshot
+#   deltas: [{"from", "to", "time", "path", "ops", "bytes"}], oldest first
+#
+# Snapshots are identified by the sha256 of their canonical JSON (the bytes of
+# stats.min.json). A client holding snapshot `from` applies the JSON Patch at
+# `path` to get `to`, and follows the chain up to `latest`.
+#
+# Everything published here is canonical JSON (sorted keys, no whitespace) with
+# .gz and .br siblings, so a static host can serve the smallest encoding as-is.
+
+
+def canonical_json(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _encodings(content: bytes) -> Dict[str, bytes]:
+    """Precompressed variants by file suffix. Both encoders are deterministic (gzip mtime is pinned)."""
+    encoded = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli:
+        encoded[".br"] = brotli.compress(content, quality=11)
+    return encoded
+
+
+def _publish(path: Path, content: bytes) -> Dict[str, int]:
+    """Write `path` and its precompressed siblings; returns the size of each encoding.
+
+    Files that already hold the same bytes are not touched."""
+    write_if_changed(path, content)
+    sizes = {"identity": len(content)}
+
+    for suffix, encoded in _encodings(content).items():
+        write_if_changed(path.with_name(path.name + suffix), encoded)
+        sizes[suffix.lstrip(".")] = len(encoded)
+
+    return sizes
+
+
+def _published(path: Path) -> bool:
+    """Whether `path` and every precompressed sibling _publish would write are on disk."""
+    suffixes = [".gz", ".br"] if brotli else [".gz"]
+    return path.exists() and all(path.with_name(path.name + suffix).exists() for suffix in suffixes)
+
+
+def _size_summary(sizes: Dict[str, int]) -> str:
+    return ", ".join(f"{encoding} {size / 1024:.1f} KB" for encoding, size in sizes.items())
+
+
+def _load_json(path: Path, default: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def publish_shards(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Write one content-hashed file per shard plus the manifest, and drop stale shards."""
+    logger = logging.getLogger("publish_shards")
+    previous = _load_json(SHARD_MANIFEST, {"shards": {}})
+    manifest = {"last_updated": data.get("last_updated"), "shards": {}}
+
+    for name, sections in SHARDS.items():
+        # Only sections the snapshot has (e.g. no "images" before describe_images ran);
+        # a shard of nothing but nulls is left out of the manifest
+        sections = [section for section in sections if section in data]
+        if not sections:
+            continue
+
+        content = canonical_json({section: data[section] for section in sections})
+        digest = hashlib.sha256(content).hexdigest()
+        path = STATS_DIR / f"{name}.{digest[:16]}.json"
+        entry = previous.get("shards", {}).get(name, {})
+
+        # Reuse the entry only if no sibling went missing (partial write, cache restore)
+        if entry.get("hash") == digest and _published(path):
+            sizes = entry["encoded_bytes"]
+        else:
+            sizes = _publish(path, content)
+            logger.info(f"Shard {name} changed ({_size_summary(sizes)})")
+
+        manifest["shards"][name] = {
+            "path": path.as_posix(),
+            "hash": digest,
+            "bytes": len(content),
+            "encoded_bytes": sizes,
+            "sections": sections,
+        }
+
+    _publish(SHARD_MANIFEST, canonical_json(manifest))
+
+    # Keep the previous generation too, so a client holding the old manifest can still finish loading
+    keep = {entry["path"] for entry in manifest["shards"].values()}
+    keep |= {entry["path"] for entry in previous.get("shards", {}).values()}
+    keep.add(SHARD_MANIFEST.as_posix())
+
+    for path in STATS_DIR.glob("*.*.json*"):
+        if path.as_posix().removesuffix(".gz").removesuffix(".br") not in keep:
+            path.unlink()
+            logger.debug(f"Removed stale shard {path}")
+
+    return manifest
+
+
+def publish_stats(data: Dict[str, Any]) -> Dict[str, int]:
+    """Write stats.json for people and the canonical minified/precompressed copies for clients."""
+    logger = logging.getLogger("publish_stats")
+
+    write_if_changed(STATS_FILE, json.dumps(data, indent=2).encode())
+
+    sizes = _publish(MINIFIED_STATS_FILE, canonical_json(data))
+    logger.info(f"Payload: pretty {STATS_FILE.stat().st_size / 1024:.1f} KB, {_size_summary(sizes)}")
+    return sizes
+
+
+def snapshot_hash(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(canonical_json(data)).hexdigest()
+
+
+def content_hash(data: Dict[str, Any] | None) -> str | None:
+    """Hash of a snapshot without its volatile keys, to tell whether a run found anything new."""
+    if not data:
+        return None
+    return snapshot_hash({key: value for key, value in data.items() if key not in VOLATILE_KEYS})
+
+
+def publish_delta(old_data: Dict[str, Any] | None, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Append the JSON Patch from the previous snapshot to this one to the rolling delta feed."""
+    logger = logging.getLogger("publish_delta")
+    index = _load_json(DELTA_INDEX, {"latest": None, "deltas": []})
+    new_hash = snapshot_hash(data)
+
+    if old_data:
+        old_hash = snapshot_hash(old_data)
+        if old_hash != new_hash:
+            patch = json_patch(old_data, data)
+            path = DELTA_DIR / f"{old_hash[:16]}-{new_hash[:16]}.json"
+            sizes = _publish(path, canonical_json(patch))
+
+            index["deltas"].append({
+                "from": old_hash,
+                "to": new_hash,
+                "time": data.get("last_updated"),
+                "path": path.as_posix(),
+                "ops": len(patch),
+                "bytes": sizes,
+            })
+            logger.info(f"Delta: {len(patch)} operations ({_size_summary(sizes)})")
+
+    index["latest"] = new_hash
+    index["deltas"] = index["deltas"][-DELTA_WINDOW:]
+    _publish(DELTA_INDEX, canonical_json(index))
+
+    # Drop patches that fell out of the window
+    keep = {entry["path"] for entry in index["deltas"]}
+    for path in DELTA_DIR.glob("*.json*"):
+        if path.as_posix().removesuffix(".gz").removesuffix(".br") not in keep:
+            path.unlink()
+
+    return index
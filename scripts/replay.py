@@ -0,0 +1,335 @@
+import asyncio
+import base64
+import functools
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+import httpx
+
+from scripts.constants import CACHE_DIR
+from scripts.fileio import atomic_write
+
+CASSETTE_FILE = CACHE_DIR / "cassette.json"
+
+# Query parameters that identify the account. They are blanked before matching,
+# so a cassette replays under any uid.
+SCRUBBED_PARAMS = {"uid", "role_id", "roleId"}
+
+# JSON fields that carry credentials; their values never reach the cassette
+SCRUBBED_FIELDS = {
+    "token", "cred", "stoken", "ltoken", "ltoken_v2", "cookie_token", "cookie_token_v2",
+    "ltuid", "ltuid_v2", "ltmid_v2", "account_id", "account_id_v2", "mid",
+}
+
+# Response headers worth replaying; Set-Cookie and friends are dropped
+KEPT_HEADERS = {"content-type", "etag", "last-modified", "cache-control"}
+
+REDACTED = "REDACTED"
+
+# Stands in for a uid the cassette did not record: an NA account, for both games
+PLACEHOLDER_UID = 600000000
+
+# Cassette layout:
+#   uids: {"HOYOLAB_HSR_UID": 600000000, ...}, the recorded uids with all but their server digits zeroed
+#   interactions: [{"key", "status", "headers", "body" | "body_b64", "elapsed"}], in recording order
+#
+# Set HTTP_CASSETTE_MODE=record to capture a live run into .cache/cassette.json
+# (or HTTP_CASSETTE), and HTTP_CASSETTE_MODE=replay to run the whole pipeline
+# from it offline. HTTP_REPLAY_LATENCY_MS fixes the delay before each replayed
+# response; by default the recorded timing is used.
+
+
+def _match_key(method: str, url: str) -> str:
+    parts = urlsplit(str(url))
+    query = sorted(
+        (name, "" if name in SCRUBBED_PARAMS else value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+    )
+    return f"{method.upper()} {urlunsplit(parts._replace(query=urlencode(query), fragment=''))}"
+
+
+def _scrub(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in SCRUBBED_FIELDS and isinstance(item, str) else _scrub(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_scrub(item) for item in value]
+    return value
+
+
+class Cassette:
+    """Recorded HTTP responses for the genshin.py (aiohttp) and httpx clients."""
+
+    def __init__(self, path: Path, mode: str, latency: Optional[float] = None):
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.logger = logging.getLogger("Cassette")
+        self.interactions: List[Dict[str, Any]] = []
+        self.uids: Dict[str, int] = {}
+        self._queues: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+        if mode == "replay":
+            with open(self.path, "r") as f:
+                recorded = json.load(f)
+            self.interactions = recorded["interactions"]
+            self.uids = recorded.get("uids", {})
+            for interaction in self.interactions:
+                self._queues[interaction["key"]].append(interaction)
+            self.logger.info(f"Replaying {len(self.interactions)} responses from {self.path}")
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        mode = os.environ.get("HTTP_CASSETTE_MODE")
+        if mode not in ("record", "replay"):
+            return None
+
+        latency = os.environ.get("HTTP_REPLAY_LATENCY_MS")
+        return cls(
+            Path(os.environ.get("HTTP_CASSETTE", CASSETTE_FILE)),
+            mode,
+            float(latency) / 1000 if latency else None,
+        )
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # ------------------------
+    # Recording
+    # ------------------------
+
+    def add(self, method: str, url: str, status: int, headers, body: bytes, elapsed: float) -> None:
+        headers = {name.lower(): value for name, value in headers.items() if name.lower() in KEPT_HEADERS}
+        interaction = {"key": _match_key(method, url), "status": status, "headers": headers, "elapsed": round(elapsed, 4)}
+
+        if "json" in headers.get("content-type", ""):
+            try:
+                interaction["body"] = json.dumps(_scrub(json.loads(body)))
+            except ValueError:
+                interaction["body"] = body.decode(errors="replace")
+        elif headers.get("content-type", "").startswith("text/"):
+            interaction["body"] = body.decode(errors="replace")
+        else:
+            interaction["body_b64"] = base64.b64encode(body).decode()
+
+        self.interactions.append(interaction)
+
+    def record_uid(self, name: str, uid: int) -> None:
+        """Keep which server `uid` is on (genshin.py picks hosts and params by it), not the account."""
+        digits = str(uid)
+        self.uids[name] = int(digits[:-8] + "0" * 8) if len(digits) > 8 else PLACEHOLDER_UID
+
+    def save(self) -> None:
+        if self.mode != "record":
+            return
+        atomic_write(self.path, json.dumps({"uids": self.uids, "interactions": self.interactions}, indent=1).encode())
+        self.logger.info(f"Recorded {len(self.interactions)} responses to {self.path}")
+
+    # ------------------------
+    # Replaying
+    # ------------------------
+
+    def next(self, method: str, url: str) -> Optional[Dict[str, Any]]:
+        """Responses for a request come back in recording order; the last one repeats once exhausted."""
+        queue = self._queues.get(_match_key(method, url))
+        if not queue:
+            self.logger.warning(f"No recorded response for {method} {url}")
+            return None
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def uid(self, name: str) -> int:
+        """A uid on the server the cassette was recorded against."""
+        return self.uids.get(name, PLACEHOLDER_UID)
+
+    async def delay(self, interaction: Dict[str, Any]) -> None:
+        await asyncio.sleep(self.latency if self.latency is not None else interaction["elapsed"])
+
+    @staticmethod
+    def body(interaction: Dict[str, Any]) -> bytes:
+        if "body_b64" in interaction:
+            return base64.b64decode(interaction["body_b64"])
+        return interaction["body"].encode()
+
+    # ------------------------
+    # Client hooks
+    # ------------------------
+
+    def wrap_transport(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        """Transport for create_http_client: records through `transport`, or replays without it."""
+        if self.replaying:
+            return _ReplayTransport(self)
+        return _RecordingTransport(self, transport)
+
+    def wrap_session(self, create: Callable[[], aiohttp.ClientSession]):
+        """Session for the genshin.py cookie manager: records through a real one, or replays without it."""
+        if self.replaying:
+            return _ReplaySession(self)
+        return _RecordingSession(self, create())
+
+
+# ------------------------
+# httpx
+# ------------------------
+
+class _RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, inner: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # Ask for an unencoded body, so what is recorded is what the client reads
+        request.headers["Accept-Encoding"] = "identity"
+        start = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        body = await response.aread()
+
+        self.cassette.add(request.method, str(request.url), response.status_code, response.headers, body, time.perf_counter() - start)
+        return httpx.Response(response.status_code, headers=response.headers, content=body, request=request)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class _ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self.cassette.next(request.method, str(request.url))
+        if interaction is None:
+            raise httpx.ConnectError("No recorded response (offline replay)", request=request)
+
+        await self.cassette.delay(interaction)
+        return httpx.Response(
+            interaction["status"],
+            headers=interaction["headers"],
+            content=Cassette.body(interaction),
+            request=request,
+        )
+
+
+# ------------------------
+# aiohttp (genshin.py)
+# ------------------------
+
+class _RecordingSession:
+    def __init__(self, cassette: Cassette, session: aiohttp.ClientSession):
+        self.cassette = cassette
+        self.session = session
+
+    def request(self, method: str, url, **kwargs) -> "_RecordingRequest":
+        return _RecordingRequest(self, method, url, kwargs)
+
+    get = functools.partialmethod(request, "GET")
+    post = functools.partialmethod(request, "POST")
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class _RecordingRequest:
+    def __init__(self, owner: _RecordingSession, method: str, url, kwargs: Dict[str, Any]):
+        self.owner, self.method, self.url, self.kwargs = owner, method, url, kwargs
+        self.response: Optional[aiohttp.ClientResponse] = None
+
+    async def _send(self) -> aiohttp.ClientResponse:
+        start = time.perf_counter()
+        self.response = await self.owner.session.request(self.method, self.url, **self.kwargs)
+        body = await self.response.read()  # aiohttp keeps the body, so the caller can still read it
+        self.owner.cassette.add(self.method, str(self.url), self.response.status, self.response.headers, body, time.perf_counter() - start)
+        return self.response
+
+    def __await__(self):
+        return self._send().__await__()
+
+    async def __aenter__(self) -> aiohttp.ClientResponse:
+        return await self._send()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.response.release()
+
+
+class _ReplaySession:
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def request(self, method: str, url, **kwargs) -> "_ReplayRequest":
+        return _ReplayRequest(self.cassette, method, url)
+
+    get = functools.partialmethod(request, "GET")
+    post = functools.partialmethod(request, "POST")
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+class _ReplayRequest:
+    def __init__(self, cassette: Cassette, method: str, url):
+        self.cassette, self.method, self.url = cassette, method, url
+
+    async def _send(self) -> "_ReplayResponse":
+        interaction = self.cassette.next(self.method, str(self.url))
+        if interaction is None:
+            raise aiohttp.ClientConnectionError(f"No recorded response for {self.method} {self.url} (offline replay)")
+
+        await self.cassette.delay(interaction)
+        return _ReplayResponse(interaction, self.url)
+
+    def __await__(self):
+        return self._send().__await__()
+
+    async def __aenter__(self) -> "_ReplayResponse":
+        return await self._send()
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+class _ReplayResponse:
+    """The slice of aiohttp.ClientResponse that genshin.py reads."""
+
+    def __init__(self, interaction: Dict[str, Any], url):
+        self.status = interaction["status"]
+        self.headers = interaction["headers"]
+        self.content_type = self.headers.get("content-type", "application/octet-stream").split(";")[0].strip()
+        self.cookies: Dict[str, str] = {}
+        self.url = url
+        self._body = Cassette.body(interaction)
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, *args, **kwargs) -> str:
+        return self._body.decode()
+
+    async def json(self, *args, **kwargs) -> Any:
+        return json.loads(self._body)
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status, message=f"Replayed HTTP {self.status}")
+
+    def release(self) -> None:
+        pass
@@ -0,0 +1,103 @@
+import json
+import logging
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from scripts.constants import CACHE_DIR, RESPONSE_CACHE_MAX_BYTES, now
+from scripts.fileio import atomic_write
+
+RESPONSE_CACHE_FILE = CACHE_DIR / "responses.json"
+
+
+class ResponseCache:
+    """Parsed HoYoLAB responses kept between runs, keyed by endpoint and uid.
+
+    Values are what the fetchers build from a response (plain JSON), so a hit
+    skips the request and genshin.py's model parsing alike. Entries expire
+    after their endpoint's TTL, and on save the least recently used ones are
+    dropped until the file fits in RESPONSE_CACHE_MAX_BYTES."""
+
+    def __init__(self, path: Path = RESPONSE_CACHE_FILE, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger("ResponseCache")
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+
+        try:
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    @staticmethod
+    def key(endpoint: str, uid: Any) -> str:
+        return f"{endpoint}:{uid}"
+
+    def get(self, endpoint: str, uid: Any) -> Optional[Any]:
+        key = self.key(endpoint, uid)
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+
+        if datetime.fromisoformat(entry["expires"]) <= now():
+            self.invalidate(endpoint, uid)
+            return None
+
+        entry["used"] = now().isoformat()
+        self._dirty = True
+        return entry["value"]
+
+    def set(self, endpoint: str, uid: Any, value: Any, ttl: timedelta) -> None:
+        self._entries[self.key(endpoint, uid)] = {
+            "value": value,
+            "expires": (now() + ttl).isoformat(),
+            "used": now().isoformat(),
+            "size": len(json.dumps(value, separators=(",", ":"))),
+        }
+        self._dirty = True
+
+    def invalidate(self, endpoint: Optional[str] = None, uid: Any = None) -> int:
+        """Drop one entry, every entry of an endpoint (uid=None), or everything (no arguments)."""
+        doomed = [
+            key for key in self._entries
+            if endpoint is None or key == self.key(endpoint, uid) or (uid is None and key.startswith(f"{endpoint}:"))
+        ]
+        for key in doomed:
+            del self._entries[key]
+
+        self._dirty = self._dirty or bool(doomed)
+        return len(doomed)
+
+    def _evict(self) -> None:
+        current = now()
+        for key in [key for key, entry in self._entries.items() if datetime.fromisoformat(entry["expires"]) <= current]:
+            del self._entries[key]
+
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda key: self._entries[key]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries.pop(key)["size"]
+            self.logger.debug(f"Evicted {key} (least recently used)")
+
+    def save(self) -> None:
+        """Persist the cache if anything changed, after dropping expired and least recently used entries."""
+        if not self._dirty:
+            return
+
+        self._evict()
+        atomic_write(self.path, json.dumps(self._entries, separators=(",", ":")).encode())
+        self._dirty = False
+
+
+if __name__ == "__main__":
+    # Drop cached responses, e.g. after a game update changed their format:
+    #   python -m scripts.response_cache                          (everything)
+    #   python -m scripts.response_cache get_starrail_characters  (one endpoint)
+    cache = ResponseCache()
+    endpoint = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"Dropped {cache.invalidate(endpoint)} cached responses")
+    cache.save()
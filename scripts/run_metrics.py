@@ -0,0 +1,119 @@
+import logging
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from scripts.constants import (
+    RUN_METRICS_DB,
+    RUN_METRICS_MIN_RUNS,
+    RUN_METRICS_WINDOW,
+    RUN_REGRESSION_FACTOR,
+    RUN_REGRESSION_SLACK,
+    now,
+)
+from scripts.tracing import events
+
+# Timings are stored as "elapsed/<source>" plus "elapsed/total"; everything else is a count
+ELAPSED_PREFIX = "elapsed/"
+COUNTS = ("requests", "bytes", "retries", "images")
+
+
+SCHEMA = """
+-- One row per metric per run (timings, request counts)
+CREATE TABLE IF NOT EXISTS runs (
+    metric TEXT    NOT NULL,
+    ts     INTEGER NOT NULL,  -- unix seconds
+    value  REAL    NOT NULL,
+    PRIMARY KEY (metric, ts)
+) WITHOUT ROWID;
+"""
+
+
+class RunStore:
+    """SQLite log of every run's metrics in .cache/ (persisted by the workflow cache,
+    never committed), so recording a run does not touch the published data."""
+
+    def __init__(self, path: Path = RUN_METRICS_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, metrics: Dict[str, float], when: Optional[datetime] = None) -> None:
+        """Store every metric of one run; unlike stats these are kept even when unchanged."""
+        ts = int((when or now()).timestamp())
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?)",
+                [(metric, ts, value) for metric, value in metrics.items()]
+            )
+
+    def values(self, metric: str, n: int, before: Optional[datetime] = None) -> List[float]:
+        """The last `n` recorded values of a metric strictly before `before`, newest first."""
+        query = "SELECT value FROM runs WHERE metric = ? AND ts < ? ORDER BY ts DESC LIMIT ?"
+        bound = int(before.timestamp()) if before else 2**62
+        return [row[0] for row in self.db.execute(query, (metric, bound, n))]
+
+
+def collect(results: Dict[str, Any], elapsed: float) -> Dict[str, float]:
+    """Metrics for this run: per-source latency from the orchestrator, traffic from the trace spans.
+
+    Webhook posts are not counted: they happen after the metrics are taken."""
+    network = [e for e in events() if e["cat"] == "network" and e["name"] != "webhook"]
+
+    metrics = {f"{ELAPSED_PREFIX}{name}": result.elapsed for name, result in results.items()}
+    metrics[f"{ELAPSED_PREFIX}total"] = elapsed
+    metrics["requests"] = len(network)
+    metrics["bytes"] = sum(e["args"].get("bytes", 0) for e in network)
+    metrics["retries"] = sum(1 for e in events() if e["cat"] == "retry")
+    metrics["images"] = sum(1 for e in network if e["name"] == "image" and e["args"].get("status") == 200)
+    return metrics
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (0-100) of a non-empty list."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def baselines(store: RunStore, metrics: Dict[str, float], window: int = RUN_METRICS_WINDOW) -> Dict[str, Dict[str, float]]:
+    """p50/p95 of each metric over the last `window` runs recorded before this one."""
+    summary = {}
+    for metric in metrics:
+        values = store.values(metric, window)
+        if values:
+            summary[metric] = {"p50": percentile(values, 50), "p95": percentile(values, 95), "runs": len(values)}
+    return summary
+
+
+def regressed(value: float, baseline: Optional[Dict[str, float]]) -> bool:
+    """Whether a timing landed well past its usual range (never before the baseline has enough runs)."""
+    if not baseline or baseline["runs"] < RUN_METRICS_MIN_RUNS:
+        return False
+    return value > baseline["p95"] and value > baseline["p50"] * RUN_REGRESSION_FACTOR + RUN_REGRESSION_SLACK
+
+
+def regressions(metrics: Dict[str, float], summary: Dict[str, Dict[str, float]]) -> List[str]:
+    """Names of the timings that regressed, e.g. ["hsr_data", "total"]."""
+    slow = [
+        metric[len(ELAPSED_PREFIX):]
+        for metric, value in metrics.items()
+        if metric.startswith(ELAPSED_PREFIX) and regressed(value, summary.get(metric))
+    ]
+
+    if slow:
+        logging.getLogger("run_metrics").warning(f"Slower than usual: {', '.join(slow)}")
+    return slow
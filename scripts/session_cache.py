@@ -0,0 +1,63 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from scripts.constants import CACHE_DIR, now
+from scripts.fileio import atomic_write
+
+SESSION_CACHE_FILE = CACHE_DIR / "sessions.json"
+
+
+def credential_key(prefix: str, secret: str) -> str:
+    """Cache key tied to a credential, so rotating the secret never reuses stale state."""
+    return f"{prefix}:{hashlib.sha256(secret.encode()).hexdigest()[:16]}"
+
+
+class SessionCache:
+    """Small on-disk store for tokens and cookies that are worth reusing across runs.
+
+    Entries carry their own expiry. The file lives outside data/ so credentials
+    are never committed with the site."""
+
+    def __init__(self, path: Path = SESSION_CACHE_FILE):
+        self.path = path
+        self.logger = logging.getLogger("SessionCache")
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+
+        try:
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+
+        if datetime.fromisoformat(entry["expires"]) <= now():
+            self.logger.debug(f"Session entry expired: {key.split(':')[0]}")
+            self.invalidate(key)
+            return None
+
+        return entry["value"]
+
+    def set(self, key: str, value: Any, ttl: timedelta) -> None:
+        self._entries[key] = {"value": value, "expires": (now() + ttl).isoformat()}
+        self._dirty = True
+
+    def invalidate(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def save(self) -> None:
+        """Persist the cache if anything changed, readable only by the current user."""
+        if not self._dirty:
+            return
+
+        atomic_write(self.path, json.dumps(self._entries, indent=2).encode(), mode=0o600)
+        self._dirty = False
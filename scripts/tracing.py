@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+# Written next to automation.log; open it in chrome://tracing or https://ui.perfetto.dev
+TRACE_FILE = Path("trace.json")
+
+_origin = time.perf_counter()
+_events: List[Dict[str, Any]] = []
+_lanes: Dict[int, str] = {}  # timeline row -> task (or thread) name
+
+# Task/thread -> timeline row. Weak keys rather than id(): an id can be reused by
+# a later task once the first one is gone, which would merge unrelated lanes.
+_owners: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+
+
+def _lane() -> int:
+    """Timeline row for the current asyncio task (or thread), so concurrent spans never overlap."""
+    try:
+        owner = asyncio.current_task()
+    except RuntimeError:
+        owner = None
+    owner = owner or threading.current_thread()
+
+    if owner not in _owners:
+        tid = len(_lanes) + 1
+        _lanes[tid] = owner.get_name() if isinstance(owner, asyncio.Task) else owner.name
+        _owners[owner] = tid
+    return _owners[owner]
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = "app", **args: Any) -> Iterator[Dict[str, Any]]:
+    """Time a block as one trace event. The yielded dict can be filled with extra attributes."""
+    start = time.perf_counter()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        _events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - _origin) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": _lane(),
+            "args": args,
+        })
+
+
+def traced(name: Optional[str] = None, category: str = "app"):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(func):
+        label = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(label, category):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(label, category):
+                    return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def events() -> List[Dict[str, Any]]:
+    return list(_events)
+
+
+def lanes() -> Dict[int, str]:
+    """Timeline row -> task (or thread) name."""
+    return dict(_lanes)
+
+
+def reset() -> None:
+    global _origin
+    _origin = time.perf_counter()
+    _events.clear()
+    _lanes.clear()
+    _owners.clear()
+
+
+def export(path: Path = TRACE_FILE) -> None:
+    """Write the collected spans in Chrome trace event format."""
+    names = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+        for tid, name in _lanes.items()
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": names + _events, "displayTimeUnit": "ms"}, f)